@@ -1,5 +1,6 @@
 import speedtest, asyncio, os, shutil, requests, subprocess, psutil, random, string, secrets, qrcode, time
 from config import Config
+from engine import storage
 
 async def run_speedtest_task():
     """Menjalankan Speedtest di Thread terpisah"""
@@ -43,6 +44,7 @@ def force_clean_system():
                     deleted += 1
                 except: pass
             os.makedirs(folder, exist_ok=True)
+    storage.rescan()
     return deleted
 
 async def exec_shell(cmd):
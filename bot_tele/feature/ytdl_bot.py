@@ -1,12 +1,13 @@
 import os
 from aiogram.types import FSInputFile
 from config import Config
-from engine import run_dual_engine_buffer
+from engine import run_shared, unpin_result
 
-async def process_ytdl_request(bot, chat_id, url, type_req, msg_id_to_edit=None):
+async def process_ytdl_request(bot, chat_id, url, type_req, msg_id_to_edit=None, fmt=None):
     """
     Menjalankan proses download dan upload ke Telegram.
     """
+    res = None
     try:
         # Edit pesan jadi "Processing"
         if msg_id_to_edit:
@@ -16,8 +17,9 @@ async def process_ytdl_request(bot, chat_id, url, type_req, msg_id_to_edit=None)
                 text="⏳ <b>Sedang Memproses di Server...</b>\nMohon tunggu, sedang download dan convert."
             )
         
-        # Panggil Engine Utama
-        res = await run_dual_engine_buffer(url, type_req)
+        # Cache / job yang sedang jalan / Engine Utama.
+        # pin=True: file sudah di-pin sebelum dikembalikan, jadi tidak di-evict sebelum / selama upload
+        res = await run_shared(url, type_req, fmt=fmt, pin=True)
         
         if res['status'] != 'ok':
             text = f"❌ <b>Gagal:</b> {res.get('error_detail', 'Unknown Error')}"
@@ -55,10 +57,13 @@ async def process_ytdl_request(bot, chat_id, url, type_req, msg_id_to_edit=None)
         # Download thumbnail logic (optional, skip for speed)
         # if res.get('thumbnail'): ...
 
-        if type_req == "audio":
-            await bot.send_audio(chat_id, audio=media_file, caption=caption)
-        else:
+        if type_req != "audio":
             await bot.send_video(chat_id, video=media_file, caption=caption)
+        elif fmt == "opus":
+            # sendAudio hanya untuk MP3/M4A; opus dikirim sebagai dokumen supaya file tetap utuh
+            await bot.send_document(chat_id, document=media_file, caption=caption)
+        else:
+            await bot.send_audio(chat_id, audio=media_file, caption=caption)
             
         # Hapus pesan status
         if msg_id_to_edit:
@@ -70,3 +75,5 @@ async def process_ytdl_request(bot, chat_id, url, type_req, msg_id_to_edit=None)
             await bot.edit_message_text(chat_id=chat_id, message_id=msg_id_to_edit, text=err_text)
         else:
             await bot.send_message(chat_id, err_text)
+    finally:
+        unpin_result(res)
@@ -150,11 +150,15 @@ async def cb_dl_start(call: types.CallbackQuery):
     url = globals().get('url_cache', {}).get(call.from_user.id)
     if not url: return await call.answer("❌ Link Expired", show_alert=True)
     
-    mode = call.data.split("_")[2]
+    # dl_mode_<audio|video>[_<mp3|m4a|opus>]
+    parts = call.data.split("_")
+    mode = parts[2]
+    fmt = parts[3] if len(parts) > 3 else None
     await call.message.delete()
     
-    msg = await call.message.answer(f"⏳ <b>Memproses {mode.upper()}...</b>\nMohon tunggu sebentar...")
-    await process_ytdl_request(bot, call.message.chat.id, url, mode, msg.message_id)
+    label = fmt or mode
+    msg = await call.message.answer(f"⏳ <b>Memproses {label.upper()}...</b>\nMohon tunggu sebentar...")
+    await process_ytdl_request(bot, call.message.chat.id, url, mode, msg.message_id, fmt)
 
 # --- USER TOOLS ---
 @router.callback_query(F.data == "feat_whois")
@@ -80,5 +80,9 @@ def ytdl_menu():
             InlineKeyboardButton(text="🎵 MP3 Audio", callback_data="dl_mode_audio"),
             InlineKeyboardButton(text="🎬 MP4 Video", callback_data="dl_mode_video")
         ],
+        [
+            InlineKeyboardButton(text="🎧 M4A Audio", callback_data="dl_mode_audio_m4a"),
+            InlineKeyboardButton(text="🎼 OPUS Audio", callback_data="dl_mode_audio_opus")
+        ],
         [InlineKeyboardButton(text="❌ Cancel", callback_data="menu_home")]
     ])
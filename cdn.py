@@ -0,0 +1,206 @@
+import os, asyncio, mimetypes, uuid
+from email.utils import formatdate, parsedate_to_datetime
+from starlette.responses import Response
+from engine import naming, storage, hot_tier
+
+# --- CDN FILE RESPONSE ---
+# Kirim file hasil tanpa generator Python per-chunk di event loop:
+#  - server ASGI yang punya extension "http.response.zerocopysend" -> kernel sendfile langsung
+#  - selain itu os.pread di thread (bukan f.read blocking di loop) + posix_fadvise readahead
+# File kecil yang panas dikirim dari hot tier (mmap tmpfs, engine/hot_tier.py) tanpa menyentuh disk.
+# Mendukung full, Range tunggal (N-M, N-, -N), multi-range (multipart/byteranges) dan HEAD.
+# Validator: nama content-addressed -> ETag kuat dari hash + immutable (edge boleh simpan lama);
+# nama lama -> ETag weak size/mtime + revalidasi. If-None-Match / If-Modified-Since -> 304,
+# If-Range yang tidak cocok -> Range diabaikan (kirim full).
+
+CHUNK_SIZE = 1024 * 1024
+MAX_RANGES = 16             # Lebih dari ini -> kirim full (cegah request range kecil-kecil ribuan)
+ZEROCOPY_EXT = "http.response.zerocopysend"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+MUTABLE_CACHE = "public, max-age=0, must-revalidate"
+
+def parse_ranges(header: str, size: int):
+    """
+    Return list[(start, end)] inklusif, sudah diurutkan & digabung.
+    None = header tidak valid / tidak didukung -> abaikan, kirim full (RFC 9110).
+    [] = valid tapi tidak ada range yang bisa dipenuhi -> 416.
+    """
+    if not header or not header.strip().lower().startswith("bytes="): return None
+    ranges = []
+    for part in header.split("=", 1)[1].split(","):
+        part = part.strip()
+        if not part: continue
+        if "-" not in part: return None
+        first, last = part.split("-", 1)
+        try:
+            if first == "":
+                # Suffix: N byte terakhir
+                n = int(last)
+                if n <= 0: continue
+                start, end = max(size - n, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if end < start: return None
+                if start >= size: continue
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if size > 0: ranges.append((start, end))
+    if len(ranges) > MAX_RANGES: return None
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class FileRangeResponse(Response):
+    """Response ASGI untuk satu file + daftar range (kosong = full body). data = isi dari hot tier."""
+    def __init__(self, path: str, size: int, ranges: list = None, status_code: int = 200,
+                 headers: dict = None, media_type: str = None, data: bytes = None):
+        self.path = path
+        self.data = data
+        self.filename = os.path.basename(path)
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        headers = dict(headers or {})
+        # parts: [(prefix bytes, start, end)], suffix = penutup multipart
+        self.suffix = b""
+        if not ranges:
+            self.parts = [(b"", 0, size - 1)] if size > 0 else []
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.parts = [(b"", start, end)]
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        else:
+            boundary = uuid.uuid4().hex
+            self.parts = []
+            for start, end in ranges:
+                prefix = (f"\r\n--{boundary}\r\nContent-Type: {media_type}\r\n"
+                          f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+                self.parts.append((prefix, start, end))
+            self.suffix = f"\r\n--{boundary}--\r\n".encode()
+            self.media_type = f"multipart/byteranges; boundary={boundary}"
+        length = sum(len(prefix) + end - start + 1 for prefix, start, end in self.parts) + len(self.suffix)
+        headers["Content-Length"] = str(length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or not self.parts:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if self.data is not None:
+            # Hot tier: slice langsung dari memory, tanpa pin / file descriptor
+            view = memoryview(self.data)
+            for prefix, start, end in self.parts:
+                body = bytes(view[start:end + 1])
+                await send({"type": "http.response.body", "body": prefix + body if prefix else body, "more_body": True})
+            await send({"type": "http.response.body", "body": self.suffix, "more_body": False})
+            return
+
+        disconnected = asyncio.Event()
+        async def _listen():
+            while True:
+                if (await receive())["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+        listener = asyncio.create_task(_listen())
+
+        zerocopy = ZEROCOPY_EXT in (scope.get("extensions") or {})
+        storage.pin(self.filename) # Jangan di-evict selama masih dikirim
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            storage.unpin(self.filename)
+            listener.cancel()
+            raise
+        fd = f.fileno()
+        try:
+            for prefix, start, end in self.parts:
+                if prefix: await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                _fadvise(fd, start, end - start + 1)
+                if zerocopy:
+                    await send({"type": ZEROCOPY_EXT, "file": f, "offset": start, "count": end - start + 1, "more_body": True})
+                    continue
+                offset = start
+                while offset <= end and not disconnected.is_set():
+                    chunk = await asyncio.to_thread(os.pread, fd, min(CHUNK_SIZE, end - offset + 1), offset)
+                    if not chunk: break
+                    offset += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                if disconnected.is_set(): return
+            await send({"type": "http.response.body", "body": self.suffix, "more_body": False})
+        finally:
+            f.close()
+            storage.unpin(self.filename)
+            listener.cancel()
+
+def _fadvise(fd: int, offset: int, length: int):
+    # Hint ke kernel: baca berurutan + mulai readahead range ini sekarang
+    if not hasattr(os, "posix_fadvise"): return
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, offset, min(length, 8 * CHUNK_SIZE), os.POSIX_FADV_WILLNEED)
+    except OSError: pass
+
+def validators(filename: str, st: os.stat_result):
+    """(etag, last_modified, cache_control) untuk file yang sudah final."""
+    digest = naming.digest_of(filename)
+    if digest: etag, cache = f'"{digest}"', IMMUTABLE_CACHE
+    else: etag, cache = f'W/"{st.st_size:x}-{st.st_mtime_ns:x}"', MUTABLE_CACHE
+    return etag, formatdate(st.st_mtime, usegmt=True), cache
+
+def _etag_match(header: str, etag: str, weak: bool) -> bool:
+    if header.strip() == "*": return True
+    strip = lambda t: t.strip()[2:] if t.strip().startswith("W/") else t.strip()
+    if not weak and etag.startswith("W/"): return False
+    for tag in header.split(","):
+        if weak and strip(tag) == strip(etag): return True
+        if not weak and tag.strip() == etag: return True
+    return False
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try: return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError): return False
+
+def _if_range_ok(header: str, etag: str, last_modified: str) -> bool:
+    # If-Range pakai perbandingan kuat: ETag weak tidak pernah cocok
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"): return _etag_match(header, etag, weak=False)
+    return header == last_modified
+
+def file_response(path: str, filename: str, request_headers=None, download: bool = False, headers: dict = None):
+    """Bangun FileRangeResponse (200 / 206 / 304 / 416) untuk file yang sudah selesai."""
+    req = request_headers or {}
+    st = os.stat(path)
+    size = st.st_size
+    ctype, _ = mimetypes.guess_type(path)
+    ctype = ctype or "application/octet-stream"
+    etag, last_modified, cache = validators(filename, st)
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": last_modified, "Cache-Control": cache, **(headers or {})}
+    if download: headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    # If-None-Match menang atas If-Modified-Since (RFC 9110 13.2.2)
+    inm, ims = req.get("if-none-match"), req.get("if-modified-since")
+    if (inm and _etag_match(inm, etag, weak=True)) or (not inm and ims and _not_modified_since(ims, st.st_mtime)):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Accept-Ranges"})
+
+    range_header = req.get("range")
+    if_range = req.get("if-range")
+    if range_header and if_range and not _if_range_ok(if_range, etag, last_modified): range_header = None
+
+    ranges = parse_ranges(range_header, size) if range_header else None
+    if ranges == []:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    # Hit dihitung tiap serve (termasuk yang sudah di RAM) supaya file populer tidak terlihat dingin setelah decay
+    hot_tier.hit(path, size)
+    data = hot_tier.get(filename)
+    if ranges:
+        return FileRangeResponse(path, size, ranges, status_code=206, headers=headers, media_type=ctype, data=data)
+    return FileRangeResponse(path, size, headers=headers, media_type=ctype, data=data)
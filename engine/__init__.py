@@ -1,27 +1,180 @@
 import asyncio, os, re
+from urllib.parse import urlparse, parse_qs
 from config import Config, STATUS_OK, STATUS_FAIL
 from logger import log
 from user_agent import get_batch_user_agents
 from proxy_manager import get_batch_proxies
-from .progress1.audio import run_audio_engine
+from .progress1.audio import run_audio_engine, convert_audio, AUDIO_FORMATS, DEFAULT_FORMAT as DEFAULT_AUDIO_FORMAT
 from .progress1.video import run_video_engine
 from .progress2 import run_engine_b
+from . import result_cache, hedge, live, stages, naming, storage
+from .hedge import EngineProgress
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_YT_HOSTS = ("youtube.com", "youtube-nocookie.com", "youtu.be")
+_PATH_PREFIXES = ("shorts", "embed", "v", "e", "live")
+
+# Kualitas default per tipe (bagian dari cache key)
+DEFAULT_QUALITY = {"audio": "mp3-128k", "video": "best"}
+
+def extract_video_id(url: str):
+    """
+    Ambil canonical Video ID dari semua variasi link YouTube:
+    youtu.be, watch?v=, shorts/, embed/, live/, music., m., nocookie,
+    termasuk parameter tambahan (si=, t=, feature=, list=).
+    """
+    try:
+        url = url.strip()
+        if _VIDEO_ID_RE.match(url): return url
+        if "://" not in url: url = "https://" + url
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        if not any(host == h or host.endswith("." + h) for h in _YT_HOSTS): return None
+
+        parts = [p for p in parsed.path.split("/") if p]
+        candidate = None
+        if host.endswith("youtu.be"):
+            candidate = parts[0] if parts else None
+        elif parts and parts[0] == "watch":
+            candidate = parse_qs(parsed.query).get("v", [None])[0]
+        elif len(parts) >= 2 and parts[0] in _PATH_PREFIXES:
+            candidate = parts[1]
+        elif parts and parts[0] == "attribution_link":
+            inner = parse_qs(parsed.query).get("u", [""])[0]
+            candidate = parse_qs(urlparse(inner).query).get("v", [None])[0]
+        if candidate and _VIDEO_ID_RE.match(candidate): return candidate
+    except: pass
+    return None
 
 def standardize_url(url: str) -> str:
+    video_id = extract_video_id(url)
+    if video_id: return f"https://www.youtube.com/watch?v={video_id}"
+    return url
+
+def normalize_format(type_req: str, fmt: str = None):
+    """Format output audio yang valid (None untuk video / kosong -> default). Tidak dikenal -> ValueError."""
+    if type_req != "audio": return None
+    fmt = (fmt or DEFAULT_AUDIO_FORMAT).lower().strip()
+    if fmt not in AUDIO_FORMATS: raise ValueError(f"Unsupported format: {fmt}")
+    return fmt
+
+def quality_for(type_req: str, fmt: str = None) -> str:
+    if type_req == "audio" and fmt: return AUDIO_FORMATS[fmt]["quality"]
+    return DEFAULT_QUALITY.get(type_req, "best")
+
+def cache_key_for(url: str, type_req: str, fmt: str = None):
+    video_id = extract_video_id(url)
+    if not video_id: return None
+    return result_cache.make_key(video_id, type_req, quality_for(type_req, fmt))
+
+async def lookup_cached(url: str, type_req: str, fmt: str = None):
+    """Cek hasil yang sudah pernah diproses (HIT = return dict, MISS = None)."""
+    key = cache_key_for(url, type_req, fmt)
+    if not key: return None
+    res = await result_cache.lookup(key)
+    if res:
+        log.info(f"CACHE HIT: {key} -> {res['filename']}")
+        storage.touch(res["filename"])
+    return res
+
+# --- SINGLE FLIGHT (Request identik nebeng ke 1 job yang sedang jalan) ---
+_inflight = {}
+
+def inflight_count() -> int:
+    return len(_inflight)
+
+class _FanOut:
+    """Teruskan progress job leader ke channel semua request yang nebeng."""
+    def __init__(self, first=None):
+        self.listeners = [first] if first else []
+        self.stream = None # Pesan "streaming" terakhir, diulang untuk yang join belakangan
+        self.pins = 0      # Pemanggil pin=True yang menunggu; file hasil di-pin task sebelum dilepas
+
+    async def broadcast(self, message: dict):
+        if message.get("stream_url"): self.stream = message
+        for listener in list(self.listeners):
+            try: await listener.broadcast(message)
+            except: pass
+
+def _pin_result(res: dict, count: int = 1):
+    if res and res.get("status") == STATUS_OK and res.get("filename"):
+        for _ in range(count): storage.pin(res["filename"])
+
+def unpin_result(res: dict):
+    """Pasangan run_shared(pin=True): lepas pin setelah file selesai dipakai (mis. upload bot)."""
+    if res and res.get("status") == STATUS_OK and res.get("filename"): storage.unpin(res["filename"])
+
+async def _await_flight(task, fanout: _FanOut, pin: bool):
+    if pin: fanout.pins += 1
     try:
-        video_id = None
-        if "youtu.be" in url: video_id = url.split("youtu.be/")[1].split("?")[0]
-        elif "youtube.com/watch" in url:
-            query = url.split("?")[1]
-            for param in query.split("&"): 
-                if param.startswith("v="): video_id = param.split("=")[1]; break
-        if video_id: return f"https://www.youtube.com/watch?v={video_id}"
-        return url
-    except: return url
-
-async def run_dual_engine_buffer(url: str, type_req: str, ws_manager=None):
+        return await asyncio.shield(task)
+    except BaseException:
+        if pin:
+            # Pemanggil batal: pin yang sudah diambil task untuk kita dilepas, atau jatahnya dikembalikan
+            if task.done() and not task.cancelled() and task.exception() is None: unpin_result(task.result())
+            else: fanout.pins -= 1
+        raise
+
+async def run_shared(url: str, type_req: str, ws_manager=None, fmt: str = None, deadline: float = None, pin: bool = False):
+    """
+    Entry point untuk Router & Bot: Cache -> Join job yang sedang jalan -> Job baru.
+    Semua request untuk (video, type) yang sama menunggu 1 task yang sama,
+    jadi hanya 1 pipeline yt-dlp/ffmpeg yang dipakai (slot download/transcode diatur engine/stages.py).
+    pin=True: file hasil sudah di-pin saat dikembalikan (tidak ada celah untuk eviction);
+    pemanggil wajib unpin_result(res) setelah selesai membaca file.
+    """
+    fmt = normalize_format(type_req, fmt)
+    cached = await lookup_cached(url, type_req, fmt)
+    if cached:
+        if pin: _pin_result(cached)
+        return cached
+
+    key = cache_key_for(url, type_req, fmt) or f"{standardize_url(url)}:{type_req}:{quality_for(type_req, fmt)}"
+    flight = _inflight.get(key)
+    if flight:
+        task, fanout = flight
+        log.info(f"SINGLE FLIGHT JOIN: {key}")
+        if ws_manager:
+            fanout.listeners.append(ws_manager)
+            await ws_manager.broadcast({"status": "progress", "msg": "Joined running job..."})
+            if fanout.stream: await ws_manager.broadcast(fanout.stream)
+        try:
+            res = await _await_flight(task, fanout, pin)
+        finally:
+            if ws_manager in fanout.listeners: fanout.listeners.remove(ws_manager)
+        return {**res, "shared": True}
+
+    # Admission control hanya untuk pipeline baru (cache hit & join tidak menambah beban).
+    # deadline None = pemanggil sudah lolos admission sendiri (job queue) / tidak ada timeout (bot).
+    if deadline is not None:
+        ok, wait, retry_after = stages.admit(deadline)
+        if not ok:
+            log.warning(f"ADMISSION REJECT: {key} (est wait {wait:.0f}s > {deadline}s)")
+            return {"status": STATUS_FAIL, "overloaded": True, "retry_after": retry_after,
+                    "error_detail": [f"Server busy, estimated wait {wait:.0f}s"]}
+
+    fanout = _FanOut(ws_manager)
+
+    async def _leader():
+        try:
+            res = await run_dual_engine_buffer(url, type_req, fanout, fmt)
+            _pin_result(res, fanout.pins) # Sinkron sebelum task selesai -> storage manager tidak sempat evict
+            return res
+        finally:
+            _inflight.pop(key, None)
+
+    # Task berdiri sendiri: client pertama disconnect tidak membatalkan job untuk yang lain
+    task = asyncio.create_task(_leader())
+    _inflight[key] = (task, fanout)
+    return dict(await _await_flight(task, fanout, pin))
+
+ENGINE_A_TIMEOUT = 150
+HEDGE_ENABLED = True
+
+async def run_dual_engine_buffer(url: str, type_req: str, ws_manager=None, fmt: str = None):
     clean_url = standardize_url(url)
-    log.info(f"ROUTER: {url} -> {clean_url} [{type_req}]")
+    fmt = normalize_format(type_req, fmt)
+    log.info(f"ROUTER: {url} -> {clean_url} [{type_req}{'/' + fmt if fmt else ''}]")
     
     # Engine 1 skrg TIDAK butuh proxy list
     # Engine 2 tetap butuh proxy list
@@ -34,44 +187,110 @@ async def run_dual_engine_buffer(url: str, type_req: str, ws_manager=None):
     log.info("PHASE 1: ENGINE PRIMARY (Direct Connection)")
     if ws_manager: await ws_manager.broadcast({"status": "progress", "msg": "Engine 1 Started (Direct Mode)..."})
     
+    # Kita tidak lagi melempar 'proxies' ke Engine 1
+    progress = EngineProgress()
+    if ws_manager:
+        # Output Engine A mulai ditulis -> client boleh langsung stream sebelum job selesai
+        progress.on_stream = lambda filename: asyncio.create_task(ws_manager.broadcast({
+            "status": "streaming", "msg": "Output Streaming...", "stream_url": live.stream_url(filename)
+        }))
+    if type_req == "audio": engine_a = run_audio_engine(clean_url, Config.TMP_DIR, progress, fmt=fmt)
+    else: engine_a = run_video_engine(clean_url, Config.TMP_DIR, progress)
+    # Timeout 150s (Cukup lama karena direct connection biasanya stabil)
+    task_a = asyncio.create_task(asyncio.wait_for(engine_a, timeout=ENGINE_A_TIMEOUT))
+    task_b = None
+
+    def start_engine_b():
+        nonlocal task_b
+        task_b = asyncio.create_task(run_engine_b(clean_url, Config.TMP_DIR, type_req, proxies, uas))
+        return task_b
+
     try:
-        # Kita tidak lagi melempar 'proxies' ke Engine 1
-        if type_req == "audio": 
-            task = run_audio_engine(clean_url, Config.TMP_DIR)
-        else: 
-            task = run_video_engine(clean_url, Config.TMP_DIR)
-            
-        # Timeout 150s (Cukup lama karena direct connection biasanya stabil)
-        res_a = await asyncio.wait_for(task, timeout=150)
-        
-        if res_a.get("status") == STATUS_OK:
-            log.info("ENGINE 1 SUCCESS")
-            if ws_manager: await ws_manager.broadcast({"status": "progress", "msg": "Engine 1 Success, Finalizing..."})
-            return _finalize_result(res_a)
-        error_detail.append(f"Engine1: {res_a.get('reason')}")
-    except asyncio.TimeoutError:
-        log.warning("ENGINE 1 TIMEOUT -> Switch to Engine 2")
-        error_detail.append("Engine1: Timeout")
-    except Exception as e:
-        log.error(f"ENGINE 1 ERROR: {e}")
-        error_detail.append(f"Engine1: {str(e)}")
-
-    # --- PHASE 2: ENGINE FALLBACK (PROXY SWARM) ---
-    log.info("PHASE 2: ENGINE FALLBACK (Progress 2)")
-    if ws_manager: await ws_manager.broadcast({"status": "progress", "msg": "Switching to Fallback Engine..."})
-    
-    res_b = await run_engine_b(clean_url, Config.TMP_DIR, type_req, proxies, uas)
-    if res_b.get("status") == STATUS_OK:
-        log.info("ENGINE 2 SUCCESS")
-        return _finalize_result(res_b)
-    
-    error_detail.append(f"Engine2: {res_b.get('reason')}")
+        # --- HEDGE: Engine A belum dapat info / byte pertama dalam deadline adaptif -> B ikut jalan ---
+        if HEDGE_ENABLED and not await hedge.wait_milestones(progress, task_a):
+            log.info("PHASE 2: ENGINE FALLBACK (Hedged, racing Engine 1)")
+            if ws_manager: await ws_manager.broadcast({"status": "progress", "msg": "Engine 1 Slow, Racing Fallback Engine..."})
+            start_engine_b()
+
+        pending = {t for t in (task_a, task_b) if t}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            # Urutkan supaya Engine A menang jika keduanya selesai bersamaan
+            for t in sorted(done, key=lambda t: t is not task_a):
+                try:
+                    res = t.result()
+                except asyncio.TimeoutError:
+                    log.warning("ENGINE 1 TIMEOUT")
+                    error_detail.append("Engine1: Timeout")
+                    continue
+                except Exception as e:
+                    log.error(f"ENGINE {'1' if t is task_a else '2'} ERROR: {e}")
+                    error_detail.append(f"Engine{'1' if t is task_a else '2'}: {str(e)}")
+                    continue
+
+                if res.get("status") != STATUS_OK:
+                    error_detail.append(f"Engine{'1' if t is task_a else '2'}: {res.get('reason')}")
+                elif winner is None:
+                    winner = (t, res)
+                else:
+                    _discard_output(res) # Dua-duanya sukses bersamaan -> buang yang kalah
+
+            if winner:
+                t, res = winner
+                if t is task_a:
+                    hedge.record(progress)
+                    log.info("ENGINE 1 SUCCESS")
+                    if ws_manager: await ws_manager.broadcast({"status": "progress", "msg": "Engine 1 Success, Finalizing..."})
+                else:
+                    log.info("ENGINE 2 SUCCESS")
+                    # Scraper selalu kasih mp3 -> samakan dengan format yang diminta (remux/encode)
+                    if fmt and fmt != DEFAULT_AUDIO_FORMAT:
+                        res = await _convert_engine_b(res, fmt)
+                        if res.get("status") != STATUS_OK:
+                            error_detail.append(f"Engine2: {res.get('reason')}")
+                            continue # Engine A (hedge) mungkin masih jalan
+                return await _finalize_result(res, clean_url, type_req, fmt)
+
+            # Engine A gagal sebelum hedge -> fallback klasik ke Engine B
+            if task_b is None:
+                log.info("PHASE 2: ENGINE FALLBACK (Progress 2)")
+                if ws_manager: await ws_manager.broadcast({"status": "progress", "msg": "Switching to Fallback Engine..."})
+                pending.add(start_engine_b())
+    finally:
+        # Yang kalah dibatalkan; masing-masing engine membersihkan file setengah jadinya sendiri
+        progress.cancelled.set()
+        losers = [t for t in (task_a, task_b) if t and not t.done()]
+        for t in losers: t.cancel()
+        if losers: await asyncio.gather(*losers, return_exceptions=True)
+
     return {"status": STATUS_FAIL, "engine": None, "filename": None, "error_detail": error_detail}
 
-def _finalize_result(data: dict):
+def _discard_output(data: dict):
+    filename = data.get("filename")
+    if not filename: return
+    try: os.remove(os.path.join(Config.TMP_DIR, filename))
+    except OSError: pass
+    storage.forget(filename)
+
+async def _convert_engine_b(res: dict, fmt: str) -> dict:
+    path = await convert_audio(os.path.join(Config.TMP_DIR, res["filename"]), fmt)
+    if not path: return {"status": STATUS_FAIL, "reason": f"convert to {fmt} failed"}
+    return {**res, "filename": os.path.basename(path)}
+
+async def _finalize_result(data: dict, url: str = None, type_req: str = None, fmt: str = None):
     filename = data.get("filename")
     if not filename: return {"status": STATUS_FAIL, "error_detail": ["filename missing"]}
     file_path = os.path.join(Config.TMP_DIR, filename)
     if not os.path.exists(file_path): return {"status": STATUS_FAIL, "error_detail": [f"file lost: {filename}"]}
-    data["filename"] = filename
+    # Nama final diturunkan dari isi file -> URL CDN stabil & bisa di-cache immutable di edge
+    try:
+        file_path = await asyncio.to_thread(naming.rename_to_content, file_path, data.get("title"))
+    except OSError as e:
+        log.error(f"CONTENT NAME ERROR ({filename}): {e}")
+    data["filename"] = os.path.basename(file_path)
+    if data["filename"] != filename: storage.forget(filename) # Nama sementara (track) sudah tidak ada
+    storage.register(data["filename"])
+    key = cache_key_for(url, type_req, fmt) if url else None
+    if key: await result_cache.store(key, data)
     return data
@@ -0,0 +1,102 @@
+import asyncio, os, threading, time
+import yt_dlp
+from logger import log
+
+# --- HEDGING (Engine A lambat -> Engine B ikut balapan) ---
+# Engine A melapor milestone (info extracted, byte pertama) lewat EngineProgress.
+# Kalau milestone tidak tercapai dalam deadline adaptif, Engine B dijalankan paralel.
+
+HEDGE_FACTOR = 3.0      # deadline = EWMA waktu milestone x faktor
+HEDGE_MIN = 6.0
+HEDGE_MAX = 45.0
+EWMA_ALPHA = 0.2
+
+# Estimasi awal (detik), diperbarui dari run Engine A yang sukses
+_stats = {"info": 6.0, "bytes": 10.0}
+
+class EngineProgress:
+    """Jembatan thread yt-dlp -> event loop: milestone + sinyal cancel untuk engine yang kalah."""
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.started = time.monotonic()
+        self.info = asyncio.Event()
+        self.first_bytes = asyncio.Event()
+        self.cancelled = threading.Event()
+        self.raw_dir = None
+        self.t_info = None
+        self.t_bytes = None
+        self.on_stream = None # callback(filename) saat output mulai bisa di-stream (engine/live.py)
+
+    def _set(self, event: asyncio.Event, attr: str):
+        if getattr(self, attr) is None:
+            setattr(self, attr, time.monotonic() - self.started)
+            self.loop.call_soon_threadsafe(event.set)
+
+    def mark_info(self):
+        """Dipanggil dari thread download setelah extract_info selesai."""
+        self._set(self.info, "t_info")
+
+    def mark_bytes(self):
+        """Byte pertama dari jalur non yt-dlp (mis. ffmpeg baca URL langsung)."""
+        self._set(self.first_bytes, "t_bytes")
+
+    def hook(self, d: dict):
+        """yt-dlp progress_hooks: cek cancel + tandai byte pertama."""
+        if self.cancelled.is_set(): raise yt_dlp.utils.DownloadCancelled("hedge loser")
+        if d.get("status") in ("downloading", "finished") and (d.get("downloaded_bytes") or 0) > 0:
+            self._set(self.first_bytes, "t_bytes")
+
+    def stream_ready(self, filename: str):
+        if self.on_stream: self.on_stream(filename)
+
+    def check_cancel(self):
+        if self.cancelled.is_set(): raise yt_dlp.utils.DownloadCancelled("hedge loser")
+
+    def has_bytes(self) -> bool:
+        # aria2c tidak selalu memanggil progress hook -> cek isi raw_dir juga
+        if self.first_bytes.is_set(): return True
+        if not self.raw_dir: return False
+        try:
+            for entry in os.scandir(self.raw_dir):
+                if entry.is_file() and entry.stat().st_size > 0:
+                    self.t_bytes = time.monotonic() - self.started
+                    self.first_bytes.set()
+                    return True
+        except OSError: pass
+        return False
+
+def deadline(stage: str) -> float:
+    return min(max(_stats[stage] * HEDGE_FACTOR, HEDGE_MIN), HEDGE_MAX)
+
+def record(progress: EngineProgress):
+    """Update EWMA dari Engine A yang sukses. 'bytes' diukur sejak info didapat."""
+    if progress.t_info is not None:
+        _stats["info"] += EWMA_ALPHA * (progress.t_info - _stats["info"])
+        if progress.t_bytes is not None:
+            delta = max(progress.t_bytes - progress.t_info, 0.0)
+            _stats["bytes"] += EWMA_ALPHA * (delta - _stats["bytes"])
+
+async def wait_milestones(progress: EngineProgress, task: asyncio.Task) -> bool:
+    """
+    True jika Engine A mencapai info + byte pertama tepat waktu (atau sudah selesai).
+    False -> saatnya hedge.
+    """
+    end_info = time.monotonic() + deadline("info")
+    while not progress.info.is_set():
+        if task.done(): return True
+        remaining = end_info - time.monotonic()
+        if remaining <= 0:
+            log.warning(f"HEDGE: Engine A info > {deadline('info'):.1f}s")
+            return False
+        try: await asyncio.wait_for(progress.info.wait(), timeout=min(remaining, 0.5))
+        except asyncio.TimeoutError: pass
+
+    end_bytes = time.monotonic() + deadline("bytes")
+    while not progress.has_bytes():
+        if task.done(): return True
+        if time.monotonic() >= end_bytes:
+            log.warning(f"HEDGE: Engine A first bytes > {deadline('bytes'):.1f}s")
+            return False
+        try: await asyncio.wait_for(progress.first_bytes.wait(), timeout=0.5)
+        except asyncio.TimeoutError: pass
+    return True
@@ -0,0 +1,201 @@
+import os, time, asyncio, mmap, shutil
+from config import Config
+from logger import log
+import shared_state
+from . import naming
+
+# --- HOT TIER (tmpfs + mmap) ---
+# File kecil yang sering diminta (audio viral 3-10MB) disalin ke tmpfs (/dev/shm) lalu di-mmap,
+# jadi CDN tidak menyentuh disk. Halaman tmpfs dipakai bersama semua worker uvicorn: satu
+# salinan per file untuk seluruh server dan budget HOT_MAX_BYTES berlaku global.
+# Hanya nama content-addressed (isi tidak pernah berubah) yang boleh masuk, jadi tidak perlu
+# validasi ulang ke disk. Promosi/demosi berdasarkan frekuensi hit yang di-decay berkala:
+# kandidat baru hanya menggusur entry yang frekuensinya lebih rendah.
+# Multi-worker: worker primary jadi owner (start()) yang memegang counter dan isi HOT_DIR;
+# worker lain mengirim hit lewat bus (digabung per HOT_SHARE_INTERVAL) dan hanya mmap file
+# yang diumumkan owner.
+
+HOT_DIR = getattr(Config, "HOT_TIER_DIR", "/dev/shm/ytdl-hot")
+HOT_MAX_BYTES = getattr(Config, "HOT_TIER_MAX_BYTES", 256 * 1024 * 1024)
+HOT_MAX_FILE = getattr(Config, "HOT_TIER_MAX_FILE", 16 * 1024 * 1024)
+HOT_PROMOTE_HITS = 3        # Hit (setelah decay) minimal sebelum file dimuat ke RAM
+HOT_DECAY_INTERVAL = 600    # Tiap interval ini semua counter dibagi 2
+HOT_MAX_TRACKED = 10000     # Batas jumlah counter
+HOT_SHARE_INTERVAL = 2      # Hit worker non-owner dikirim ke owner per interval ini
+HOT_ENABLED = os.path.isdir(os.path.dirname(HOT_DIR)) # Tanpa tmpfs -> tier mati, CDN baca disk
+
+_resident = {}  # filename -> size (file di HOT_DIR, diketahui semua worker)
+_maps = {}      # filename -> mmap (per worker, dibuat saat pertama dibaca)
+_hits = {}      # owner: filename -> frekuensi (ter-decay)
+_loading = set()
+_bytes = 0
+_owner = False
+_pending_hits = {}  # non-owner: filename -> [path, size, n] yang belum dikirim
+_share_handle = None
+_last_decay = time.monotonic()
+_served = 0
+_promoted = 0
+_demoted = 0
+
+def _hot_path(filename: str) -> str:
+    return os.path.join(HOT_DIR, filename)
+
+def get(filename: str):
+    """Isi file (mmap read-only) kalau ada di hot tier, else None."""
+    global _served
+    if filename not in _resident: return None
+    data = _maps.get(filename)
+    if data is None:
+        try:
+            with open(_hot_path(filename), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            _resident.pop(filename, None)
+            return None
+        _maps[filename] = data
+    _served += 1
+    return data
+
+def _decay():
+    global _last_decay
+    _last_decay = time.monotonic()
+    for name in list(_hits):
+        _hits[name] //= 2
+        if not _hits[name] and name not in _resident: del _hits[name]
+
+def hit(path: str, size: int):
+    """Catat hit dari CDN; owner mempromosikan (salin ke tmpfs di thread) kalau sudah cukup panas."""
+    if not HOT_ENABLED: return
+    filename = os.path.basename(path)
+    if _owner: _count(filename, path, size, 1)
+    else: _forward(filename, path, size)
+
+def _count(filename: str, path: str, size: int, n: int):
+    if time.monotonic() - _last_decay > HOT_DECAY_INTERVAL: _decay()
+    if filename not in _hits and len(_hits) >= HOT_MAX_TRACKED: return
+    _hits[filename] = _hits.get(filename, 0) + n
+    if filename in _resident or filename in _loading: return
+    if not 0 < size <= HOT_MAX_FILE or size > HOT_MAX_BYTES or not naming.digest_of(filename): return
+    if _hits[filename] < HOT_PROMOTE_HITS: return
+    if not _make_room(size, _hits[filename], dry_run=True): return
+    _loading.add(filename)
+    asyncio.get_running_loop().create_task(_promote(path, filename))
+
+def _forward(filename: str, path: str, size: int):
+    global _share_handle
+    entry = _pending_hits.get(filename)
+    if entry: entry[2] += 1
+    else: _pending_hits[filename] = [path, size, 1]
+    if _share_handle is None:
+        _share_handle = asyncio.get_running_loop().call_later(HOT_SHARE_INTERVAL, _share_hits)
+
+def _share_hits():
+    global _share_handle
+    _share_handle = None
+    for filename, (path, size, n) in _pending_hits.items():
+        shared_state.publish("hot_tier", {"op": "hits", "file": filename, "path": path, "size": size, "n": n})
+    _pending_hits.clear()
+
+def _make_room(size: int, freq: int, dry_run: bool = False) -> bool:
+    """Gusur entry paling dingin (frekuensi < kandidat) sampai ada ruang."""
+    free = HOT_MAX_BYTES - _bytes
+    if free >= size: return True
+    victims = []
+    for name in sorted(_resident, key=lambda n: _hits.get(n, 0)):
+        if _hits.get(name, 0) >= freq: break
+        victims.append(name)
+        free += _resident[name]
+        if free >= size: break
+    if free < size: return False
+    if not dry_run:
+        for name in victims: _evict(name)
+    return True
+
+def _evict(filename: str):
+    """Owner: buang dari HOT_DIR. mmap yang masih dipakai response tetap valid sampai dilepas."""
+    global _bytes, _demoted
+    size = _resident.pop(filename, None)
+    _maps.pop(filename, None)
+    if size is None: return
+    _bytes -= size
+    _demoted += 1
+    try: os.remove(_hot_path(filename))
+    except OSError: pass
+    shared_state.publish("hot_tier", {"op": "demote", "file": filename})
+
+async def _promote(path: str, filename: str):
+    global _bytes, _promoted
+    try:
+        size = await asyncio.to_thread(_copy, path, filename)
+        if size is None: return
+        if filename not in _loading or not _make_room(size, _hits.get(filename, 0)):
+            try: os.remove(_hot_path(filename))
+            except OSError: pass
+            return
+        _resident[filename] = size
+        _bytes += size
+        _promoted += 1
+        shared_state.publish("hot_tier", {"op": "promote", "file": filename, "size": size})
+        log.info(f"HOT TIER: promoted {filename} ({size / 1024 / 1024:.1f} MB)")
+    finally:
+        _loading.discard(filename)
+
+def _copy(path: str, filename: str):
+    """Salin ke tmpfs (tmp + rename: worker lain tidak pernah mmap file setengah jadi)."""
+    tmp = _hot_path(f".{filename}.{os.getpid()}.tmp")
+    try:
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, _hot_path(filename))
+        return os.path.getsize(_hot_path(filename))
+    except OSError as e:
+        log.error(f"HOT TIER: copy failed {filename}: {e}")
+        try: os.remove(tmp)
+        except OSError: pass
+        return None
+
+def _on_shared(event: dict):
+    op, filename = event.get("op"), event.get("file")
+    if op == "hits" and _owner: _count(filename, event["path"], event["size"], event["n"])
+    elif op == "promote": _resident[filename] = event["size"]
+    elif op == "demote":
+        _resident.pop(filename, None)
+        _maps.pop(filename, None)
+    elif op == "clear": _reset()
+
+shared_state.on("hot_tier", _on_shared)
+
+def drop(filename: str):
+    """File dihapus dari disk (eviction storage manager) -> keluarkan juga dari hot tier."""
+    _loading.discard(filename)
+    _hits.pop(filename, None)
+    if _owner: _evict(filename)
+    else:
+        _resident.pop(filename, None)
+        _maps.pop(filename, None)
+
+def _reset():
+    global _bytes
+    _resident.clear(); _maps.clear(); _hits.clear(); _loading.clear()
+    _bytes = 0
+
+def clear():
+    _reset()
+    if not _owner: return
+    shutil.rmtree(HOT_DIR, ignore_errors=True)
+    os.makedirs(HOT_DIR, exist_ok=True)
+    shared_state.publish("hot_tier", {"op": "clear"})
+
+def start():
+    """Dipanggil worker primary: jadi owner, HOT_DIR dikosongkan dari sisa proses sebelumnya."""
+    global _owner
+    if not HOT_ENABLED: return
+    _owner = True
+    clear()
+    log.info(f"HOT TIER: {HOT_DIR} ({HOT_MAX_BYTES / 1024 / 1024:.0f} MB shared)")
+
+def snapshot() -> dict:
+    return {
+        "enabled": HOT_ENABLED, "owner": _owner, "files": len(_resident), "mapped": len(_maps),
+        "bytes": sum(_resident.values()), "max_bytes": HOT_MAX_BYTES,
+        "served": _served, "promoted": _promoted, "demoted": _demoted
+    }
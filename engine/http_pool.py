@@ -0,0 +1,95 @@
+import aiohttp
+from yarl import URL
+from logger import log
+
+# --- SHARED HTTP POOL (Engine B) ---
+# Satu ClientSession untuk umur aplikasi: koneksi keep-alive dipakai ulang per host
+# (dan per proxy, karena aiohttp mengelompokkan koneksi berdasarkan proxy juga),
+# DNS di-cache, jumlah socket dibatasi.
+
+POOL_LIMIT = 200          # total socket terbuka
+POOL_LIMIT_PER_HOST = 16  # per (host, proxy)
+DNS_CACHE_TTL = 600
+KEEPALIVE_TIMEOUT = 30
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=15)
+
+_session = None
+
+def _resolver():
+    # aiodns opsional: kalau terpasang pakai resolver async, kalau tidak pakai threaded default
+    try:
+        import aiodns  # noqa: F401
+        return aiohttp.AsyncResolver()
+    except Exception:
+        return None
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        kwargs = {}
+        resolver = _resolver()
+        if resolver: kwargs["resolver"] = resolver
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            enable_cleanup_closed=True,
+            **kwargs
+        )
+        # DummyCookieJar: cookie antar scraper / antar request tidak boleh tercampur
+        _session = aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT, cookie_jar=aiohttp.DummyCookieJar())
+        log.info("HTTP Pool Ready (shared session)")
+    return _session
+
+async def close_session():
+    global _session
+    if _session and not _session.closed:
+        await _session.close()
+    _session = None
+
+class ScopedSession:
+    """
+    Pengganti `aiohttp.ClientSession(headers=...)` per scraper: default headers milik
+    scraper, tapi koneksi diambil dari shared pool. Tidak menutup apa pun saat keluar.
+    Cookie jar sendiri per scope: Set-Cookie dari langkah token dibawa ke langkah convert,
+    tanpa bocor ke scraper lain (jar shared session sengaja Dummy).
+    """
+    def __init__(self, headers: dict = None):
+        self.headers = headers or {}
+        self.cookie_jar = aiohttp.CookieJar(unsafe=True) # unsafe: scraper kadang pakai host IP
+
+    async def __aenter__(self): return self
+    async def __aexit__(self, *exc): return False
+
+    def request(self, method: str, url: str, headers: dict = None, **kwargs):
+        cookies = {k: m.value for k, m in self.cookie_jar.filter_cookies(URL(url)).items()}
+        if kwargs.get("cookies"): cookies.update(kwargs.pop("cookies"))
+        ctx = get_session().request(method, url, headers={**self.headers, **(headers or {})}, cookies=cookies or None, **kwargs)
+        return _ScopedRequest(ctx, self.cookie_jar)
+
+    def get(self, url: str, **kwargs): return self.request("GET", url, **kwargs)
+    def post(self, url: str, **kwargs): return self.request("POST", url, **kwargs)
+
+class _ScopedRequest:
+    """Bisa `async with` maupun `await`, seperti request context aiohttp; simpan cookie respons ke jar scope."""
+    def __init__(self, ctx, jar: aiohttp.CookieJar):
+        self._ctx = ctx
+        self._jar = jar
+
+    def _remember(self, resp):
+        for r in (*resp.history, resp): self._jar.update_cookies(r.cookies, r.url)
+        return resp
+
+    async def __aenter__(self):
+        return self._remember(await self._ctx.__aenter__())
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+    def __await__(self):
+        return self._await().__await__()
+
+    async def _await(self):
+        return self._remember(await self._ctx)
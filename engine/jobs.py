@@ -0,0 +1,172 @@
+import asyncio, time, uuid
+from config import STATUS_OK
+from logger import log
+import shared_state
+from . import run_shared
+
+# --- ASYNC JOB QUEUE ---
+# POST /jobs langsung dapat job_id, proses jalan di worker pool (bukan di handler HTTP).
+# Client polling GET /jobs/{id} lalu ambil hasil di /jobs/{id}/result.
+# Multi-worker: snapshot job ditulis ke shared_state (saat pindah status / ganti stage),
+# jadi polling yang mendarat di worker lain tetap menemukan job-nya.
+
+JOB_WORKERS = 4
+JOB_QUEUE_MAX = 200
+JOB_TTL = 60 * 60 # Job selesai disimpan 1 jam untuk polling
+EWMA_ALPHA = 0.2
+DEFAULT_JOB_TIME = 30.0 # Estimasi durasi job sampai ada sampel
+PERSIST_INTERVAL = 1.0 # Update stage ke shared_state paling sering sekali per detik
+
+class Job:
+    def __init__(self, url: str, type_req: str, client_ip: str = None, fmt: str = None):
+        self.id = uuid.uuid4().hex[:16]
+        self.url = url
+        self.type_req = type_req
+        self.fmt = fmt
+        self.client_ip = client_ip
+        self.status = "queued" # queued -> running -> done / failed
+        self.stage = "Waiting in queue"
+        self.result = None
+        self.error_detail = []
+        self.user_stat = {}
+        self.stream_url = None # Ada selagi output masih ditulis (progressive streaming)
+        self.created = time.time()
+        self.updated = self.created
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id, "state": self.status, "stage": self.stage,
+            "type": self.type_req, "format": self.fmt, "url": self.url, "stream_url": self.stream_url,
+            "created": self.created, "updated": self.updated,
+            "error_detail": self.error_detail if self.status == "failed" else []
+        }
+
+    def dump(self) -> dict:
+        return {**self.to_dict(), "client_ip": self.client_ip, "result": self.result,
+                "errors": self.error_detail, "user_stat": self.user_stat}
+
+    @classmethod
+    def restore(cls, data: dict) -> "Job":
+        job = cls(data["url"], data["type"], data.get("client_ip"), data.get("format"))
+        job.id = data["job_id"]
+        job.status, job.stage = data["state"], data["stage"]
+        job.stream_url = data.get("stream_url")
+        job.created, job.updated = data["created"], data["updated"]
+        job.result, job.error_detail, job.user_stat = data.get("result"), data.get("errors") or [], data.get("user_stat") or {}
+        return job
+
+class JobReporter:
+    """Pengganti ws_manager untuk engine: catat stage ke Job lalu teruskan ke WebSocket."""
+    def __init__(self, job: Job, ws_manager=None):
+        self.job = job
+        self.ws_manager = ws_manager
+
+    async def broadcast(self, message: dict):
+        changed = False
+        if message.get("msg"):
+            self.job.stage = message["msg"]
+            self.job.updated = time.time()
+            changed = True
+        if message.get("stream_url"):
+            self.job.stream_url = message["stream_url"]
+            job_manager.persist(self.job, force=True)
+        elif changed: job_manager.persist(self.job)
+        if self.ws_manager: await self.ws_manager.broadcast({**message, "job_id": self.job.id})
+
+class JobManager:
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_MAX, ttl: int = JOB_TTL):
+        self.workers = workers
+        self.ttl = ttl
+        self.jobs = {}
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks = []
+        self.ws_manager = None
+        self.service_time = None # EWMA durasi job (detik)
+        self._persisted = {}     # job_id -> waktu persist terakhir
+
+    def start(self, ws_manager=None):
+        if self._tasks: return
+        self.ws_manager = ws_manager
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        self._tasks.append(asyncio.create_task(self._expire_loop()))
+        log.info(f"Job Queue Started ({self.workers} workers)")
+
+    def submit(self, url: str, type_req: str, client_ip: str = None, fmt: str = None):
+        """Return Job, atau None jika antrian penuh."""
+        job = Job(url, type_req, client_ip, fmt)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return None
+        self.jobs[job.id] = job
+        self.persist(job, force=True)
+        return job
+
+    async def get(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job or not shared_state.ENABLED: return job
+        data = await shared_state.job_load(job_id) # Job milik worker lain
+        return Job.restore(data) if data else None
+
+    def persist(self, job: Job, force: bool = False):
+        if not shared_state.ENABLED: return
+        now = time.monotonic()
+        if not force and now - self._persisted.get(job.id, 0) < PERSIST_INTERVAL: return
+        self._persisted[job.id] = now
+        try: shared_state.job_save(job.id, job.dump()) # Ditulis di thread shared state, tidak menahan loop
+        except Exception as e: log.error(f"JOB {job.id} persist error: {e}")
+
+    def estimated_wait(self) -> float:
+        """Perkiraan detik sampai job baru diambil worker."""
+        svc = self.service_time if self.service_time is not None else DEFAULT_JOB_TIME
+        return self.queue.qsize() * svc / self.workers
+
+    def snapshot(self) -> dict:
+        running = sum(1 for j in self.jobs.values() if j.status == "running")
+        return {"workers": self.workers, "queued": self.queue.qsize(), "running": running, "max_queue": self.queue.maxsize,
+                "estimated_wait": round(self.estimated_wait(), 1)}
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.stage = "Started"
+            job.updated = time.time()
+            self.persist(job, force=True)
+            started = time.monotonic()
+            try:
+                res = await run_shared(job.url, job.type_req, JobReporter(job, self.ws_manager), fmt=job.fmt)
+                if res.get("status") == STATUS_OK:
+                    job.result = res
+                    job.status = "done"
+                    job.stage = "Done"
+                else:
+                    job.error_detail = res.get("error_detail", [])
+                    job.status = "failed"
+                    job.stage = "Failed"
+            except Exception as e:
+                log.error(f"JOB {job.id} ERROR: {e}")
+                job.error_detail = [str(e)]
+                job.status = "failed"
+                job.stage = "Failed"
+            finally:
+                job.stream_url = None # Selesai/gagal -> pakai URL di result (output live bisa saja dari engine yang kalah)
+                job.updated = time.time()
+                self.persist(job, force=True)
+                elapsed = time.monotonic() - started
+                self.service_time = elapsed if self.service_time is None else self.service_time + EWMA_ALPHA * (elapsed - self.service_time)
+                self.queue.task_done()
+
+    async def _expire_loop(self):
+        while True:
+            await asyncio.sleep(300)
+            now = time.time()
+            for job_id in [j.id for j in self.jobs.values() if j.status in ("done", "failed") and now - j.updated > self.ttl]:
+                self.jobs.pop(job_id, None)
+                self._persisted.pop(job_id, None)
+            if shared_state.ENABLED:
+                try: await shared_state.call(shared_state.job_expire, self.ttl)
+                except Exception as e: log.error(f"JOB expire error: {e}")
+
+job_manager = JobManager()
@@ -0,0 +1,143 @@
+import asyncio, os, time
+from config import Config
+from logger import log
+import shared_state
+from . import storage
+
+# --- LIVE OUTPUT (progressive streaming) ---
+# File output yang masih ditulis ffmpeg didaftarkan di sini. CDN menyajikannya dengan
+# tailing: kirim byte yang sudah ada, lalu tunggu notifikasi "file bertambah" sampai
+# writer selesai. Watcher polling os.stat (tidak ada inotify yang portable).
+# Multi-worker: open/finish diumumkan lewat bus shared_state; worker lain membuat LiveFile
+# "remote" untuk path yang sama supaya request CDN yang mendarat di sana juga di-tail.
+
+LIVE_POLL = 0.25         # interval cek ukuran file (detik)
+LIVE_CHUNK = 256 * 1024
+LIVE_IDLE_TIMEOUT = 60   # writer diam selama ini -> reader menyerah
+LIVE_AUDIO = True        # mp3 bisa di-tail apa adanya
+# MP4 +faststart memindah moov ke depan di akhir proses (tulis ulang file) -> tidak bisa di-tail.
+# Fragmented MP4 (moov kosong di depan, moof per keyframe) bisa diputar sambil tumbuh.
+LIVE_VIDEO_FRAGMENTED = True
+
+_live = {}  # filename -> LiveFile
+
+class LiveFile:
+    def __init__(self, path: str, on_ready=None, remote: bool = False):
+        self.path = path
+        self.remote = remote     # Writer ada di worker lain
+        self.on_ready = on_ready # Dipanggil sekali saat byte pertama muncul
+        self.filename = os.path.basename(path)
+        self.size = 0
+        self.generation = 0      # Naik kalau file menyusut (writer menulis ulang dari awal)
+        self.done = False
+        self.failed = False
+        self.last_growth = time.monotonic()
+        self._grew = asyncio.Event()
+        self._watcher = asyncio.create_task(self._watch())
+        storage.pin(self.filename)
+
+    def _notify(self):
+        # Event baru per generasi: semua reader yang menunggu dibangunkan sekaligus
+        grew, self._grew = self._grew, asyncio.Event()
+        grew.set()
+
+    def _stat(self):
+        try: size = os.path.getsize(self.path)
+        except OSError: return
+        if size < self.size:
+            # Ditruncate (mis. ffmpeg -y menimpa file lama): byte yang sudah dikirim reader tidak valid
+            log.warning(f"LIVE: {self.filename} shrank {self.size} -> {size}, resetting readers")
+            self.size = size
+            self.generation += 1
+            self.last_growth = time.monotonic()
+            self._notify()
+            return
+        if size > self.size:
+            self.size = size
+            self.last_growth = time.monotonic()
+            self._notify()
+            if self.on_ready:
+                on_ready, self.on_ready = self.on_ready, None
+                try: on_ready(self.filename)
+                except Exception as e: log.error(f"LIVE ready callback error: {e}")
+
+    async def _watch(self):
+        while not self.done:
+            self._stat()
+            # Event finish dari worker lain tidak pernah datang (worker mati) -> anggap gagal
+            if self.remote and time.monotonic() - self.last_growth > LIVE_IDLE_TIMEOUT:
+                self.finish(False)
+                return
+            await asyncio.sleep(LIVE_POLL)
+
+    async def wait_growth(self, known: int) -> bool:
+        """Tunggu sampai size > known atau writer selesai. False kalau writer diam terlalu lama."""
+        while self.size <= known and not self.done:
+            try: await asyncio.wait_for(self._grew.wait(), timeout=LIVE_IDLE_TIMEOUT)
+            except asyncio.TimeoutError: return False
+        return True
+
+    def finish(self, ok: bool):
+        if self.done: return
+        if ok: self._stat()
+        self.failed = not ok
+        self.done = True
+        self._watcher.cancel()
+        self._notify()
+        storage.unpin(self.filename)
+        if _live.get(self.filename) is self: _live.pop(self.filename, None)
+        if not self.remote: shared_state.publish("live", {"op": "finish", "file": self.filename, "ok": ok})
+
+def open_live(path: str, on_ready=None) -> LiveFile:
+    """Daftarkan output SEBELUM writer mulai; sisa file lama di path dibuang dulu supaya ukuran mulai dari 0."""
+    try: os.remove(path)
+    except FileNotFoundError: pass
+    lf = LiveFile(path, on_ready)
+    _live[lf.filename] = lf
+    shared_state.publish("live", {"op": "open", "path": path})
+    return lf
+
+def _on_shared(event: dict):
+    if event.get("op") == "open":
+        filename = os.path.basename(event["path"])
+        if filename not in _live: _live[filename] = LiveFile(event["path"], remote=True)
+    elif event.get("op") == "finish":
+        lf = _live.get(event.get("file"))
+        if lf and lf.remote: lf.finish(bool(event.get("ok")))
+
+shared_state.on("live", _on_shared)
+
+def get(filename: str):
+    return _live.get(filename)
+
+def stream_url(filename: str) -> str:
+    return f"https://{Config.PUBLIC_DOMAIN}/cdn/ytdl/{filename}"
+
+async def tail(lf: LiveFile):
+    """Generator untuk StreamingResponse: ikuti file sampai writer selesai (I/O disk di thread, bukan di loop)."""
+    sent = 0
+    # Reader bisa datang sebelum ffmpeg membuat file
+    if not await lf.wait_growth(0) or lf.failed: raise IOError(f"live source unavailable: {lf.filename}")
+    generation = lf.generation
+    fd = await asyncio.to_thread(os.open, lf.path, os.O_RDONLY)
+    try:
+        while True:
+            if lf.generation != generation: raise IOError(f"live source rewritten: {lf.filename}")
+            if sent < lf.size:
+                chunk = await asyncio.to_thread(os.pread, fd, min(LIVE_CHUNK, lf.size - sent), sent)
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+                    continue
+                # size dari watcher lebih besar dari isi file -> file diganti / terpotong
+                if lf.done or lf.generation != generation: raise IOError(f"live source truncated: {lf.filename}")
+                await asyncio.sleep(LIVE_POLL)
+                continue
+            if lf.done:
+                if lf.failed: raise IOError(f"live source failed: {lf.filename}") # Putus koneksi, jangan kirim file terpotong sbg sukses
+                return
+            if not await lf.wait_growth(sent):
+                log.warning(f"LIVE: writer idle, closing {lf.filename}")
+                raise IOError(f"live source idle: {lf.filename}")
+    finally:
+        os.close(fd)
@@ -0,0 +1,59 @@
+import os, re, hashlib
+from collections import OrderedDict
+import shared_state
+
+# --- CONTENT-ADDRESSED FILENAMES ---
+# File final di TMP_DIR diberi nama "<judul>-<hash isi>.<ext>". Isi file untuk satu nama
+# tidak pernah berubah, jadi CDN bisa kasih ETag kuat dari nama + Cache-Control immutable
+# dan Cloudflare boleh menyimpannya selama mungkin.
+
+DIGEST_SIZE = 8              # blake2b 8 byte -> 16 hex di nama file
+HASH_CHUNK = 1024 * 1024
+ALIAS_MAX = 1024             # Nama sementara (stream_url live) -> nama final
+
+_DIGEST_RE = re.compile(r"-([0-9a-f]{%d})\.[A-Za-z0-9]+$" % (DIGEST_SIZE * 2))
+_aliases = OrderedDict()
+
+def safe_title(title: str) -> str:
+    return "".join(c for c in (title or "") if c.isalnum() or c in " -_").strip()[:50] or "media"
+
+def file_digest(path: str) -> str:
+    """Hash isi file (blocking, jalankan via asyncio.to_thread)."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk: break
+            h.update(chunk)
+    return h.hexdigest()
+
+def content_name(title: str, digest: str, ext: str) -> str:
+    return f"{safe_title(title)}-{digest}{ext}"
+
+def digest_of(filename: str):
+    """Hash isi dari nama file content-addressed, None untuk nama lama / sementara."""
+    m = _DIGEST_RE.search(filename)
+    return m.group(1) if m else None
+
+def rename_to_content(path: str, title: str) -> str:
+    """Hash lalu rename ke nama content-addressed (blocking). Return path baru."""
+    name = os.path.basename(path)
+    if digest_of(name): return path
+    new_name = content_name(title, file_digest(path), os.path.splitext(name)[1])
+    new_path = os.path.join(os.path.dirname(path), new_name)
+    # Isi sama -> nama sama: kalau sudah ada, timpa saja (hasil identik)
+    os.replace(path, new_path)
+    add_alias(name, new_name)
+    shared_state.publish("naming", {"old": name, "new": new_name})
+    return new_path
+
+def add_alias(old: str, new: str):
+    # stream_url yang dibagikan saat file masih ditulis tetap bisa dipakai (redirect)
+    _aliases[old] = new
+    _aliases.move_to_end(old)
+    while len(_aliases) > ALIAS_MAX: _aliases.popitem(last=False)
+
+shared_state.on("naming", lambda event: add_alias(event["old"], event["new"]))
+
+def resolve_alias(filename: str):
+    return _aliases.get(filename)
@@ -1,6 +1,8 @@
 import yt_dlp, asyncio, os, uuid, subprocess, shutil, random
 from config import Config, STATUS_OK, STATUS_FAIL
 from logger import log
+from .. import resume, live, stages, storage
+from .tools import ffmpeg_bins, probe_codec
 
 UAS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
@@ -8,11 +10,156 @@ UAS = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
 ]
 
-async def run_audio_engine(url: str, output_path: str):
+# --- FORMAT OUTPUT ---
+# codec = codec sumber yang cukup di-remux (-c:a copy) tanpa encode ulang.
+# select = format yt-dlp yang diutamakan supaya remux mungkin.
+AUDIO_FORMATS = {
+    "mp3": {
+        "ext": "mp3", "codec": "mp3", "quality": "mp3-128k", "select": "bestaudio/best",
+        "encode": ["-acodec", "libmp3lame", "-ab", "128k", "-ar", "44100", "-ac", "2",
+                   "-preset", "ultrafast", "-tune", "zerolatency"],
+    },
+    "m4a": {
+        "ext": "m4a", "codec": "aac", "quality": "m4a", "select": "bestaudio[ext=m4a]/bestaudio/best",
+        "encode": ["-c:a", "aac", "-b:a", "128k"],
+        # +faststart menulis ulang file di akhir -> tidak bisa di-tail live
+        "mux": ["-movflags", "+faststart"], "live": False,
+    },
+    "opus": {
+        "ext": "opus", "codec": "opus", "quality": "opus", "select": "bestaudio[acodec=opus]/bestaudio/best",
+        "encode": ["-c:a", "libopus", "-b:a", "128k"],
+    },
+}
+DEFAULT_FORMAT = "mp3"
+
+def _norm_codec(codec: str):
+    codec = (codec or "").lower()
+    if codec.startswith("mp4a"): return "aac"
+    if codec in ("none", ""): return None
+    return codec.split(".")[0]
+
+async def probe_audio_codec(path: str):
+    return _norm_codec(await probe_codec(path, "a:0"))
+
+def _codec_args(fmt: str, source_codec: str):
+    """Remux kalau codec sumber sama dengan target, selain itu encode. Return (args, thread budget)."""
+    spec = AUDIO_FORMATS[fmt]
+    if source_codec == spec["codec"]:
+        log.info(f"AUDIO: remux {source_codec} -> {fmt} (stream copy)")
+        codec, threads = ["-c:a", "copy"], stages.REMUX_THREADS
+    else:
+        log.info(f"AUDIO: encode {source_codec or 'unknown'} -> {fmt}")
+        codec, threads = spec["encode"], stages.AUDIO_ENCODE_THREADS
+    return ["-vn", "-map_metadata", "-1", *codec, *spec.get("mux", [])], threads
+
+async def convert_audio(src_path: str, fmt: str):
+    """Samakan output Engine B dengan format yang diminta. Return path baru / None."""
+    spec = AUDIO_FORMATS[fmt]
+    base, ext = os.path.splitext(src_path)
+    source_codec = await probe_audio_codec(src_path)
+    if ext.lstrip(".") == spec["ext"] and source_codec == spec["codec"]: return src_path
+    final_path = f"{base}.{spec['ext']}"
+    if final_path == src_path: final_path = f"{base}-{fmt}.{spec['ext']}"
+    storage.track(final_path)
+    ffmpeg_bin, _ = ffmpeg_bins()
+    codec_args, threads = _codec_args(fmt, source_codec)
+    async with stages.transcode.slot(threads) as threads:
+        cmd = [ffmpeg_bin, "-y", "-i", src_path, *codec_args, "-threads", str(threads), final_path]
+        ok = await _run_ffmpeg(cmd, final_path, streamable=False)
+    try: os.remove(src_path)
+    except OSError: pass
+    return final_path if ok else None
+
+PIPE_MODE = True
+PIPE_RW_TIMEOUT = 15 # detik tanpa data dari sumber -> ffmpeg menyerah (fallback ke file mode)
+
+def _pipe_source(info: dict):
+    """(url, headers) kalau format terpilih 1 stream HTTP biasa; None untuk DASH/HLS/merge."""
+    if info.get("requested_formats") or not info.get("url"): return None
+    if info.get("protocol", "https") not in ("http", "https"): return None
+    # yt-dlp minta download per chunk (YouTube men-throttle GET adaptive tanpa Range ke ~kecepatan putar);
+    # ffmpeg hanya bisa 1 GET utuh -> pakai file mode (yt-dlp/aria2c yang chunked)
+    if (info.get("downloader_options") or {}).get("http_chunk_size"): return None
+    return info["url"], info.get("http_headers") or {}
+
+def _pipe_input_args(headers: dict) -> list:
+    args = ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+            "-rw_timeout", str(PIPE_RW_TIMEOUT * 1000000)]
+    ua = headers.get("User-Agent")
+    if ua: args += ["-user_agent", ua]
+    extra = "".join(f"{k}: {v}\r\n" for k, v in headers.items() if k.lower() != "user-agent")
+    if extra: args += ["-headers", extra]
+    return args
+
+async def _run_ffmpeg(cmd: list, final_path: str, progress=None, pipe: bool = False, streamable: bool = True) -> bool:
+    # Output bisa di-tail CDN selagi ffmpeg menulis (lihat engine/live.py).
+    # Didaftarkan sebelum ffmpeg jalan (file lama dibuang dulu) supaya watcher mulai dari 0.
+    # Pipe mode: byte output pertama = byte sumber pertama -> milestone hedging.
+    # Output tidak streamable (m4a +faststart, moov baru ditulis di akhir) tidak didaftarkan live;
+    # milestone byte pertamanya dari _first_byte.
+    live_file = first_byte = None
+    streamable = streamable and live.LIVE_AUDIO
+    if streamable:
+        def on_ready(filename):
+            if not progress: return
+            if pipe: progress.mark_bytes()
+            progress.stream_ready(filename)
+        live_file = live.open_live(final_path, on_ready)
+    elif pipe and progress:
+        first_byte = asyncio.create_task(_first_byte(final_path, progress))
+    try:
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except BaseException:
+        if live_file: live_file.finish(False)
+        if first_byte: first_byte.cancel()
+        raise
+    try:
+        await process.wait()
+    except asyncio.CancelledError:
+        # Kalah balapan -> matikan ffmpeg & buang output setengah jadi
+        try: process.kill()
+        except ProcessLookupError: pass
+        if live_file: live_file.finish(False)
+        if os.path.exists(final_path): os.remove(final_path)
+        raise
+    finally:
+        if first_byte: first_byte.cancel()
+    ok = process.returncode == 0 and os.path.exists(final_path) and os.path.getsize(final_path) > 0
+    if live_file: live_file.finish(ok)
+    if not ok and os.path.exists(final_path): os.remove(final_path)
+    return ok
+
+async def _first_byte(path: str, progress):
+    """Milestone byte pertama (hedging) untuk output pipe yang tidak di-tail live."""
+    while True:
+        try:
+            if os.path.getsize(path) > 0:
+                progress.mark_bytes()
+                return
+        except OSError: pass
+        await asyncio.sleep(live.LIVE_POLL)
+
+def _result(info: dict, title: str, final_path: str, request_id: str, engine: str) -> dict:
+    return {
+        "status": STATUS_OK, "engine": engine, "filename": os.path.basename(final_path),
+        "title": title, "thumbnail": info.get("thumbnail"), "duration": info.get("duration_string"),
+        "author": info.get("uploader"), "request_id": request_id
+    }
+
+async def run_audio_engine(url: str, output_path: str, progress=None, fmt: str = DEFAULT_FORMAT):
     loop = asyncio.get_running_loop()
     request_id = str(uuid.uuid4())[:8]
-    raw_dir = os.path.join(Config.RAW_DIR, request_id)
+    if fmt not in AUDIO_FORMATS: fmt = DEFAULT_FORMAT
+    spec = AUDIO_FORMATS[fmt]
+    # Raw dir deterministik per URL -> percobaan ulang melanjutkan .part milik yt-dlp/aria2c.
+    # Kalau sedang dipakai job lain (kualitas beda, sumber sama) pakai dir sekali pakai.
+    raw_dir = resume.raw_dir_for(url, "audio" if fmt == DEFAULT_FORMAT else f"audio-{fmt}")
+    resumable = await resume.claim(raw_dir)
+    if not resumable:
+        raw_dir = os.path.join(Config.RAW_DIR, request_id)
+        await resume.claim(raw_dir) # Tetap di-claim supaya storage manager tahu dir ini aktif
     os.makedirs(raw_dir, exist_ok=True)
+    if progress: progress.raw_dir = raw_dir
     
     # 1. SETUP COOKIES
     cookie_file = None
@@ -23,11 +170,12 @@ async def run_audio_engine(url: str, output_path: str):
     
     # 2. CONFIG HYPER FAST YTDLP
     ydl_opts = {
-        "format": "bestaudio/best",
+        "format": spec["select"],
         "outtmpl": os.path.join(raw_dir, "%(id)s.%(ext)s"),
         "quiet": True,
         "no_warnings": True,
         "nocheckcertificate": True,
+        "continuedl": True, # Lanjutkan .part dari percobaan sebelumnya
         "user_agent": random.choice(UAS),
         
         # --- NETWORK BOOST ---
@@ -43,54 +191,103 @@ async def run_audio_engine(url: str, output_path: str):
     }
     
     if cookie_file: ydl_opts["cookiefile"] = cookie_file
+    # Milestone + cancel untuk hedging (lihat engine/hedge.py)
+    if progress: ydl_opts["progress_hooks"] = [progress.hook]
 
     try:
         # 3. DOWNLOAD
-        def _download():
+        def _extract():
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                if progress:
+                    progress.mark_info()
+                    progress.check_cancel()
+                return info
+
+        def _fetch(info=None):
+            # info dari pipe mode dipakai ulang -> tidak extract dua kali
+            if info is None: info = _extract()
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                return ydl.process_ie_result(info, download=True)
+
+        def _download_attempts(info=None):
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl: return ydl.extract_info(url, download=True)
+                return _fetch(info)
+            except yt_dlp.utils.DownloadCancelled:
+                raise # .part disimpan untuk resume
             except yt_dlp.utils.DownloadError:
+                if progress and progress.cancelled.is_set(): raise
                 # Fallback tanpa aria2c jika gagal
                 ydl_opts.pop("external_downloader", None)
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl: return ydl.extract_info(url, download=True)
+                return _fetch(info)
+
+        def _download(info=None):
+            try:
+                return _download_attempts(info)
+            finally:
+                resume.release(raw_dir) # Thread bisa hidup lebih lama dari coroutine yang dibatalkan
 
-        info = await loop.run_in_executor(None, _download)
-        
-        raw_files = os.listdir(raw_dir)
-        if not raw_files: raise Exception("Download failed")
-        raw_path = os.path.join(raw_dir, raw_files[0])
-        
-        title = info.get("title", f"audio-{request_id}")
-        safe_title = "".join(c for c in title if c.isalnum() or c in " -_").strip()[:50]
-        final_path = os.path.join(Config.TMP_DIR, f"{safe_title}.mp3")
-        
         # 4. FFMPEG MAX POWER
-        ffmpeg_bin = os.path.join(Config.BASE_DIR, "ffmpeg-master-latest-linux64-gpl", "bin", "ffmpeg")
-        if not os.path.exists(ffmpeg_bin): ffmpeg_bin = "ffmpeg"
+        ffmpeg_bin, _ = ffmpeg_bins()
+        streamable = spec.get("live", True)
+
+        def _output_path(info):
+            title = info.get("title", f"audio-{request_id}")
+            safe_title = "".join(c for c in title if c.isalnum() or c in " -_").strip()[:50]
+            # Nama sementara unik per request: worker lain dengan URL sama tidak menulis ke file yang sama
+            # (nama final content-addressed diberikan naming.rename_to_content setelah selesai)
+            final_path = os.path.join(Config.TMP_DIR, f"{safe_title}-{request_id}.{spec['ext']}")
+            storage.track(final_path) # Dibuang storage manager kalau tidak pernah di-register
+            return title, final_path
+
+        info = None
+        # 3a. PIPE MODE: ffmpeg baca URL stream langsung -> download & encode overlap, tanpa raw di disk.
+        # Dilewati kalau ada sisa download sebelumnya (lebih murah dilanjutkan, lihat engine/resume.py).
+        if PIPE_MODE and not os.listdir(raw_dir):
+            async with stages.extract.slot():
+                info = await loop.run_in_executor(None, _extract)
+            source = _pipe_source(info)
+            if source:
+                title, final_path = _output_path(info)
+                src_url, src_headers = source
+                # Pipe mode tidak bisa ffprobe dulu -> codec dari metadata format yt-dlp
+                codec_args, threads = _codec_args(fmt, _norm_codec(info.get("acodec")))
+                # Download & encode sekaligus -> pegang slot kedua stage (urutan tetap: download lalu transcode)
+                async with stages.download.slot(), stages.transcode.slot(threads) as threads:
+                    cmd = [ffmpeg_bin, "-y", *_pipe_input_args(src_headers), "-i", src_url, *codec_args, "-threads", str(threads), final_path]
+                    ok = await _run_ffmpeg(cmd, final_path, progress, pipe=True, streamable=streamable)
+                if ok:
+                    shutil.rmtree(raw_dir, ignore_errors=True)
+                    return _result(info, title, final_path, request_id, "Engine A (Audio/Pipe)")
+                log.warning("AUDIO PIPE FAILED, fallback download + encode")
+
+        # 3b. FILE MODE (klasik): download penuh ke raw dir, lalu encode
+        async with stages.download.slot():
+            # retain tepat sebelum thread dijalankan: yang menyeimbangkan hanya finally di _download
+            # (StageFull / batal saat menunggu slot tidak boleh meninggalkan claim)
+            resume.retain(raw_dir)
+            info = await loop.run_in_executor(None, _download, info)
         
-        cmd = [
-            ffmpeg_bin, "-y",
-            "-i", raw_path,
-            "-vn", "-map_metadata", "-1",
-            "-acodec", "libmp3lame",
-            "-ab", "128k", "-ar", "44100", "-ac", "2",
-            "-threads", "0", # Pakai semua Core
-            "-preset", "ultrafast", # Mode Tercepat
-            "-tune", "zerolatency", # Latency 0
-            final_path
-        ]
+        raw_path = resume.pick_output(raw_dir, info)
+        if not raw_path: raise Exception("Download failed")
         
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        await process.wait()
-        
-        if not os.path.exists(final_path): raise Exception("FFmpeg failed")
+        title, final_path = _output_path(info)
+        source_codec = await probe_audio_codec(raw_path) or _norm_codec(info.get("acodec"))
+        codec_args, threads = _codec_args(fmt, source_codec)
+        async with stages.transcode.slot(threads) as threads:
+            cmd = [ffmpeg_bin, "-y", "-i", raw_path, *codec_args, "-threads", str(threads), final_path]
+            ok = await _run_ffmpeg(cmd, final_path, progress, streamable=streamable)
+        if not ok: raise Exception("FFmpeg failed")
         shutil.rmtree(raw_dir, ignore_errors=True)
         
-        return {
-            "status": STATUS_OK, "engine": "Engine A (Audio/Hyper)", "filename": os.path.basename(final_path),
-            "title": title, "thumbnail": info.get("thumbnail"), "duration": info.get("duration_string"),
-            "author": info.get("uploader"), "request_id": request_id
-        }
+        return _result(info, title, final_path, request_id, "Engine A (Audio/Hyper)")
+    except asyncio.CancelledError:
+        # Raw dir deterministik tidak dihapus: engine/job berikutnya untuk URL ini lanjut dari sini
+        if progress: progress.cancelled.set()
+        if not resumable: shutil.rmtree(raw_dir, ignore_errors=True)
+        raise
     except Exception as e:
-        shutil.rmtree(raw_dir, ignore_errors=True)
+        if not resumable: shutil.rmtree(raw_dir, ignore_errors=True)
         return {"status": STATUS_FAIL, "reason": str(e)}
+    finally:
+        resume.release(raw_dir)
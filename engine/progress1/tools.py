@@ -0,0 +1,30 @@
+import asyncio, os, subprocess
+from config import Config
+
+# --- FFMPEG / FFPROBE HELPERS (dipakai audio & video engine) ---
+
+def ffmpeg_bins():
+    """(ffmpeg, ffprobe): build statik di BASE_DIR kalau ada, selain itu dari PATH."""
+    base = os.path.join(Config.BASE_DIR, "ffmpeg-master-latest-linux64-gpl", "bin")
+    ffmpeg_bin = os.path.join(base, "ffmpeg")
+    ffprobe_bin = os.path.join(base, "ffprobe")
+    if not os.path.exists(ffmpeg_bin): ffmpeg_bin = "ffmpeg"
+    if not os.path.exists(ffprobe_bin): ffprobe_bin = "ffprobe"
+    return ffmpeg_bin, ffprobe_bin
+
+async def probe_codec(path: str, stream: str = "a:0", timeout: float = 15):
+    """codec_name untuk stream tertentu (mis. 'v:0', 'a:0'). Async, tidak memblok event loop."""
+    _, ffprobe_bin = ffmpeg_bins()
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            ffprobe_bin, "-v", "error", "-select_streams", stream, "-show_entries", "stream=codec_name",
+            "-of", "default=noprint_wrappers=1:nokey=1", path,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=timeout)
+        return out.decode().strip().splitlines()[0] if out.strip() else None
+    except asyncio.TimeoutError:
+        try: proc.kill()
+        except ProcessLookupError: pass
+    except Exception: pass
+    return None
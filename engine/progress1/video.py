@@ -1,6 +1,8 @@
 import yt_dlp, asyncio, os, uuid, subprocess, shutil, random
 from config import Config, STATUS_OK, STATUS_FAIL
 from logger import log
+from .. import resume, live, stages, storage
+from .tools import ffmpeg_bins, probe_codec
 
 UAS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
@@ -8,11 +10,62 @@ UAS = [
     "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
 ]
 
-async def run_video_engine(url: str, output_path: str):
+# --- FORMAT RANKING ---
+# Pilih avc1 (H.264) + mp4a (AAC) <= batas resolusi supaya langkah akhir cukup remux (-c copy).
+# VP9/AV1 hanya dipakai kalau tidak ada avc1 sama sekali (re-encode, dicatat di log).
+VIDEO_MAX_HEIGHT = getattr(Config, "VIDEO_MAX_HEIGHT", 1080)
+VIDEO_MIN_REMUX_HEIGHT = 480 # avc1 lebih rendah dari ini tidak sebanding dgn turunnya kualitas -> encode saja
+FALLBACK_FORMAT = f"bestvideo[height<={VIDEO_MAX_HEIGHT}]+bestaudio/best[height<={VIDEO_MAX_HEIGHT}]/best"
+
+def _downloadable(f: dict) -> bool:
+    return f.get("protocol") != "mhtml" # storyboard (gambar), bukan media
+
+def _vcodec(f: dict) -> str: return (f.get("vcodec") or "none").lower()
+def _acodec(f: dict) -> str: return (f.get("acodec") or "none").lower()
+
+def rank_formats(formats: list, max_height: int = VIDEO_MAX_HEIGHT):
+    """
+    Return (format_spec, remux_ok, reason).
+    remux_ok = True kalau hasil pilihan sudah H.264 + AAC (ffmpeg cukup -c copy).
+    """
+    formats = [f for f in formats or [] if f.get("format_id") and _downloadable(f)]
+    fits = lambda f: (f.get("height") or 0) <= max_height
+    video_only = [f for f in formats if _vcodec(f) != "none" and _acodec(f) == "none" and fits(f)]
+    audio_only = [f for f in formats if _acodec(f) != "none" and _vcodec(f) == "none"]
+    muxed = [f for f in formats if _vcodec(f) != "none" and _acodec(f) != "none" and fits(f)]
+
+    vkey = lambda f: (f.get("height") or 0, f.get("fps") or 0, f.get("tbr") or 0)
+    akey = lambda f: (f.get("abr") or f.get("tbr") or 0)
+    avc = [f for f in video_only if _vcodec(f).startswith("avc1")]
+    aac = [f for f in audio_only if _acodec(f).startswith("mp4a")]
+    avc_muxed = [f for f in muxed if _vcodec(f).startswith("avc1") and _acodec(f).startswith("mp4a")]
+
+    best_avc = max(avc, key=vkey) if avc else None
+    best_muxed = max(avc_muxed, key=vkey) if avc_muxed else None
+    if best_avc and aac and (not best_muxed or vkey(best_avc) >= vkey(best_muxed)):
+        best_aac = max(aac, key=akey)
+        return f"{best_avc['format_id']}+{best_aac['format_id']}", True, f"avc1 {best_avc.get('height')}p + mp4a"
+    best_any = max((f.get("height") or 0 for f in video_only), default=0)
+    if best_muxed and (best_muxed.get("height") or 0) >= min(VIDEO_MIN_REMUX_HEIGHT, best_any):
+        return best_muxed["format_id"], True, f"avc1+mp4a muxed {best_muxed.get('height')}p"
+    if video_only and audio_only:
+        best_v = max(video_only, key=vkey)
+        best_a = max(aac or audio_only, key=akey)
+        return f"{best_v['format_id']}+{best_a['format_id']}", False, f"no avc1 <= {max_height}p, got {_vcodec(best_v)}"
+    return FALLBACK_FORMAT, False, "format list unusable"
+
+async def run_video_engine(url: str, output_path: str, progress=None):
     loop = asyncio.get_running_loop()
     request_id = str(uuid.uuid4())[:8]
-    raw_dir = os.path.join(Config.RAW_DIR, request_id)
+    # Raw dir deterministik per URL -> percobaan ulang melanjutkan .part milik yt-dlp/aria2c.
+    # Kalau sedang dipakai job lain (kualitas beda, sumber sama) pakai dir sekali pakai.
+    raw_dir = resume.raw_dir_for(url, "video")
+    resumable = await resume.claim(raw_dir)
+    if not resumable:
+        raw_dir = os.path.join(Config.RAW_DIR, request_id)
+        await resume.claim(raw_dir) # Tetap di-claim supaya storage manager tahu dir ini aktif
     os.makedirs(raw_dir, exist_ok=True)
+    if progress: progress.raw_dir = raw_dir
     
     # 1. SETUP COOKIES
     cookie_file = None
@@ -23,11 +76,12 @@ async def run_video_engine(url: str, output_path: str):
 
     # 2. CONFIG HYPER FAST YTDLP
     ydl_opts = {
-        "format": "bestvideo+bestaudio/best",
+        "format": FALLBACK_FORMAT, # Diganti hasil rank_formats sebelum download
         "outtmpl": os.path.join(raw_dir, "%(id)s.%(ext)s"),
         "quiet": True,
         "no_warnings": True,
         "nocheckcertificate": True,
+        "continuedl": True, # Lanjutkan .part dari percobaan sebelumnya
         "user_agent": random.choice(UAS),
         
         # --- NETWORK BOOST ---
@@ -41,58 +95,109 @@ async def run_video_engine(url: str, output_path: str):
     }
     
     if cookie_file: ydl_opts["cookiefile"] = cookie_file
+    # Milestone + cancel untuk hedging (lihat engine/hedge.py)
+    if progress: ydl_opts["progress_hooks"] = [progress.hook]
 
     try:
-        # 3. DOWNLOAD
-        def _download():
+        # 3. RANKING + DOWNLOAD
+        def _fetch():
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False)
+                if progress:
+                    progress.mark_info()
+                    progress.check_cancel()
+            # Format dipilih dari daftar format sebelum download (bukan bestvideo buta)
+            spec, remux_ok, reason = rank_formats(info.get("formats"))
+            log.info(f"VIDEO FORMAT: {spec} ({reason}){'' if remux_ok else ' -> re-encode expected'}")
+            with yt_dlp.YoutubeDL({**ydl_opts, "format": spec, "merge_output_format": "mp4"}) as ydl:
+                return ydl.process_ie_result(info, download=True)
+
+        def _download_attempts():
             try:
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl: return ydl.extract_info(url, download=True)
-            except:
+                return _fetch()
+            except yt_dlp.utils.DownloadCancelled:
+                raise # .part disimpan untuk resume
+            except Exception:
+                if progress and progress.cancelled.is_set(): raise
                 # Fallback native jika aria2c gagal
                 ydl_opts.pop("external_downloader", None)
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl: return ydl.extract_info(url, download=True)
+                return _fetch()
+
+        def _download():
+            try:
+                return _download_attempts()
+            finally:
+                resume.release(raw_dir) # Thread bisa hidup lebih lama dari coroutine yang dibatalkan
 
-        info = await loop.run_in_executor(None, _download)
+        async with stages.download.slot():
+            # retain tepat sebelum thread dijalankan: yang menyeimbangkan hanya finally di _download
+            # (StageFull / batal saat menunggu slot tidak boleh meninggalkan claim)
+            resume.retain(raw_dir)
+            info = await loop.run_in_executor(None, _download)
 
-        raw_files = os.listdir(raw_dir)
-        if not raw_files: raise Exception("Download failed")
-        raw_path = os.path.join(raw_dir, raw_files[0])
+        raw_path = resume.pick_output(raw_dir, info)
+        if not raw_path: raise Exception("Download failed")
 
         title = info.get("title", f"video-{request_id}")
         safe_title = "".join(c for c in title if c.isalnum() or c in " -_").strip()[:50]
-        final_path = os.path.join(Config.TMP_DIR, f"{safe_title}.mp4")
-
-        # 4. BINARIES
-        ffmpeg_bin = os.path.join(Config.BASE_DIR, "ffmpeg-master-latest-linux64-gpl", "bin", "ffmpeg")
-        ffprobe_bin = os.path.join(Config.BASE_DIR, "ffmpeg-master-latest-linux64-gpl", "bin", "ffprobe")
-        if not os.path.exists(ffmpeg_bin): ffmpeg_bin = "ffmpeg"
-        if not os.path.exists(ffprobe_bin): ffprobe_bin = "ffprobe"
-
-        # 5. SMART COPY (Mencegah Re-encode jika sudah H264)
-        video_codec = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "23"] # Default Fast Encode
-        try:
-            probe_cmd = [ffprobe_bin, "-v", "error", "-select_streams", "v:0", "-show_entries", "stream=codec_name", "-of", "default=noprint_wrappers=1:nokey=1", raw_path]
-            codec = subprocess.check_output(probe_cmd, stderr=subprocess.DEVNULL).decode().strip()
-            if codec == "h264": video_codec = ["-c:v", "copy"] # INSTANT COPY
-        except: pass
-
-        # 6. FFMPEG PROCESSING
-        cmd = [
-            ffmpeg_bin, "-y",
-            "-i", raw_path,
-            *video_codec,
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-movflags", "+faststart",
-            "-threads", "0",
-            "-preset", "ultrafast",
-            final_path
-        ]
-
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        await process.wait()
-
-        if not os.path.exists(final_path): raise Exception("FFmpeg failed")
+        # Nama sementara unik per request (lihat audio._output_path), nama final dari naming.rename_to_content
+        final_path = os.path.join(Config.TMP_DIR, f"{safe_title}-{request_id}.mp4")
+        storage.track(final_path) # Dibuang storage manager kalau tidak pernah di-register
+        streamable = live.LIVE_VIDEO_FRAGMENTED
+        movflags = "frag_keyframe+empty_moov+default_base_moof" if streamable else "+faststart"
+
+        # 4. CODEC CHECK (async ffprobe): H.264/AAC -> copy, selain itu encode (jarang, dicatat)
+        ffmpeg_bin, _ = ffmpeg_bins()
+        v_src, a_src = await asyncio.gather(probe_codec(raw_path, "v:0"), probe_codec(raw_path, "a:0"))
+        video_codec = ["-c:v", "copy"]
+        audio_codec = ["-c:a", "copy"]
+        threads = stages.REMUX_THREADS
+        if v_src != "h264":
+            log.warning(f"VIDEO RE-ENCODE: {v_src or 'unknown'} -> h264 ({title})")
+            video_codec = ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "23"]
+            threads = stages.VIDEO_ENCODE_THREADS
+        if a_src != "aac":
+            log.info(f"VIDEO AUDIO ENCODE: {a_src or 'unknown'} -> aac")
+            audio_codec = ["-c:a", "aac", "-b:a", "128k"]
+            threads = max(threads, stages.AUDIO_ENCODE_THREADS)
+
+        # 5. FFMPEG PROCESSING (remux kecuali codec check di atas bilang lain)
+        async with stages.transcode.slot(threads) as threads:
+            cmd = [
+                ffmpeg_bin, "-y",
+                "-i", raw_path,
+                *video_codec,
+                *audio_codec,
+                "-movflags", movflags,
+                "-threads", str(threads), # Budget dari transcode stage, bukan semua core
+                "-preset", "ultrafast",
+                final_path
+            ]
+
+            # Output bisa di-tail CDN selagi ffmpeg menulis (lihat engine/live.py).
+            # Didaftarkan sebelum ffmpeg jalan (file lama dibuang dulu) supaya watcher mulai dari 0.
+            live_file = live.open_live(final_path, progress.stream_ready if progress else None) if streamable else None
+            try:
+                process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except BaseException:
+                if live_file: live_file.finish(False)
+                raise
+            try:
+                await process.wait()
+            except asyncio.CancelledError:
+                # Kalah balapan -> matikan ffmpeg & buang output setengah jadi
+                try: process.kill()
+                except ProcessLookupError: pass
+                if live_file: live_file.finish(False)
+                if os.path.exists(final_path): os.remove(final_path)
+                raise
+            # Exit non-zero bisa meninggalkan fragmented MP4 setengah jadi -> jangan dianggap sukses
+            ok = process.returncode == 0 and os.path.exists(final_path) and os.path.getsize(final_path) > 0
+            if live_file: live_file.finish(ok)
+
+        if not ok:
+            if os.path.exists(final_path): os.remove(final_path)
+            raise Exception("FFmpeg failed")
         shutil.rmtree(raw_dir, ignore_errors=True)
 
         return {
@@ -100,6 +205,13 @@ async def run_video_engine(url: str, output_path: str):
             "title": title, "thumbnail": info.get("thumbnail"), "duration": info.get("duration_string"),
             "author": info.get("uploader"), "request_id": request_id
         }
+    except asyncio.CancelledError:
+        # Raw dir deterministik tidak dihapus: engine/job berikutnya untuk URL ini lanjut dari sini
+        if progress: progress.cancelled.set()
+        if not resumable: shutil.rmtree(raw_dir, ignore_errors=True)
+        raise
     except Exception as e:
-        shutil.rmtree(raw_dir, ignore_errors=True)
+        if not resumable: shutil.rmtree(raw_dir, ignore_errors=True)
         return {"status": STATUS_FAIL, "reason": str(e)}
+    finally:
+        resume.release(raw_dir)
@@ -6,12 +6,16 @@ import base64
 import time
 import random
 import os
+import uuid
 from urllib.parse import quote, urlparse, parse_qs, urlencode
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 from config import STATUS_OK, STATUS_FAIL
 from logger import log
-from proxy_manager import report_proxy_status
+from proxy_manager import report_proxy_status, get_batch_proxies, target_family
+from .http_pool import ScopedSession
+from . import scraper_stats, stages, storage
+from .segmented import download_segmented, RangeUnsupported, SEGMENT_CONNECTIONS
 
 # --- HELPER: ROBUST REQUESTER ---
 async def fetch_smart(session, url, method="GET", proxy=None, **kwargs):
@@ -19,22 +23,28 @@ async def fetch_smart(session, url, method="GET", proxy=None, **kwargs):
     Mencoba request dengan Proxy. 
     Jika gagal (Timeout/ConnectError), otomatis retry TANPA Proxy.
     """
+    # Flag hasil bukan argumen aiohttp, jangan ikut diteruskan ke session.request
+    json_res = kwargs.pop("json_res", False)
+    text_res = kwargs.pop("text_res", False)
     # 1. Try with Proxy
     if proxy:
+        target = target_family(url)
         try:
+            t0 = time.monotonic()
             async with session.request(method, url, proxy=proxy, **kwargs) as resp:
-                # Jika sukses, lapor proxy bagus
+                # Jika sukses, lapor proxy bagus (+ latency untuk bobot seleksi, per target)
                 if resp.status == 200:
-                    report_proxy_status(proxy, True)
-                    if kwargs.get("json_res"): return await resp.json()
-                    if kwargs.get("text_res"): return await resp.text()
+                    report_proxy_status(proxy, True, latency=time.monotonic() - t0, target=target)
+                    if json_res: return await resp.json(content_type=None)
+                    if text_res: return await resp.text()
                     return resp
                 # Jika status code error fatal (403/429), jangan retry direct (karena IP server mungkin juga kena)
                 if resp.status in [403, 429]:
+                    report_proxy_status(proxy, False, target=target)
                     return None
         except Exception:
-            # Proxy error, lapor proxy jelek
-            report_proxy_status(proxy, False)
+            # Proxy error, lapor proxy jelek (untuk target ini)
+            report_proxy_status(proxy, False, target=target)
             # Lanjut ke retry direct di bawah
 
     # 2. Retry Direct (Tanpa Proxy)
@@ -43,8 +53,8 @@ async def fetch_smart(session, url, method="GET", proxy=None, **kwargs):
         kwargs.pop("proxy", None)
         async with session.request(method, url, proxy=None, **kwargs) as resp:
             if resp.status == 200:
-                if kwargs.get("json_res"): return await resp.json()
-                if kwargs.get("text_res"): return await resp.text()
+                if json_res: return await resp.json(content_type=None)
+                if text_res: return await resp.text()
                 return resp
     except:
         pass
@@ -61,20 +71,27 @@ async def run_engine_b(url: str, output_path: str, type_req: str, proxies: list,
     proxies_pool = proxies if proxies else [None] * 5
     uas_pool = uas if uas else ["Mozilla/5.0"] * 5
     
-    # Launch Swarm (Semua Scraper Jalan Bareng)
-    # Kita acak proxy/ua untuk variasi
-    tasks.append(asyncio.create_task(scraper_savetube(url, type_req, random.choice(proxies_pool), random.choice(uas_pool))))
-    tasks.append(asyncio.create_task(scraper_ytdlp_online(url, type_req, random.choice(proxies_pool), random.choice(uas_pool))))
-    tasks.append(asyncio.create_task(scraper_ytdown(url, type_req, random.choice(proxies_pool), random.choice(uas_pool))))
-    tasks.append(asyncio.create_task(scraper_optiklink(url, type_req, random.choice(proxies_pool), random.choice(uas_pool))))
-    tasks.append(asyncio.create_task(scraper_y2mate(url, type_req, random.choice(proxies_pool), random.choice(uas_pool))))
+    def pick_proxy(family):
+        # Proxy yang sehat untuk backend scraper ini, fallback ke batch umum
+        best = get_batch_proxies(1, target=family)
+        return best[0] if best else random.choice(proxies_pool)
+
+    # Satu swarm = satu slot stage extract: burst request tidak meluncurkan scraper tanpa batas.
+    # Slot dilepas begitu ada pemenang (sebelum download) supaya service time extract tidak ikut download.
+    extract = await stages.extract.hold()
+    # Launch Portfolio: scraper terbaik (statistik) jalan duluan, sisanya di-stagger,
+    # scraper dengan circuit breaker open di-skip (kecuali probe half-open)
+    registry = dict(SCRAPERS)
+    unjudged = set() # Scraper yang sudah dapat URL tapi hasil download-nya belum diketahui
+    for family, delay in scraper_stats.plan([f for f, _ in SCRAPERS]):
+        tasks.append(asyncio.create_task(_run_scraper(family, registry[family], delay, url, type_req, pick_proxy, uas_pool, unjudged)))
 
     try:
         # Tunggu siapa yang selesai duluan (FIRST_COMPLETED)
         # Timeout total 120 detik
         for future in asyncio.as_completed(tasks, timeout=120):
             try:
-                res = await future
+                family, res, url_latency = await future
                 if res and res.get('url'):
                     # Pemenang ditemukan!
                     download_url = res['url']
@@ -82,11 +99,23 @@ async def run_engine_b(url: str, output_path: str, type_req: str, proxies: list,
                     
                     log.info(f"Engine B WINNER: ({engine_name}). Downloading...")
                     
-                    # Download File Akhir
-                    dl_proxy = random.choice(proxies_pool)
+                    # Download File Akhir (proxy yang sehat ke host file tsb)
+                    dl_family = target_family(download_url)
+                    dl_proxy = pick_proxy(dl_family) if dl_family else random.choice(proxies_pool)
                     dl_ua = random.choice(uas_pool)
+                    file_path = _output_file(output_path, res.get('title'), type_req)
                     
-                    if await _download_safe(download_url, output_path, dl_proxy, dl_ua):
+                    extract.release()
+                    try:
+                        async with stages.download.slot():
+                            downloaded = await _download_safe(download_url, file_path, dl_proxy, dl_ua, stat_name=family)
+                    except Exception:
+                        downloaded = False
+                    # Satu record per percobaan, setelah hasil download diketahui:
+                    # URL yang tidak bisa di-download tetap dihitung gagal (streak breaker jalan)
+                    unjudged.discard(family)
+                    scraper_stats.record(family, bool(downloaded), url_latency=url_latency if downloaded else None)
+                    if downloaded:
                         # Cancel sisa task yang masih jalan biar hemat resource
                         for t in tasks: t.cancel()
                         
@@ -97,38 +126,96 @@ async def run_engine_b(url: str, output_path: str, type_req: str, proxies: list,
                             "thumbnail": res.get('thumbnail'),
                             "duration": res.get('duration'),
                             "author": engine_name,
-                            "filename": os.path.basename(output_path)
+                            "filename": os.path.basename(file_path)
                         }
             except Exception:
                 continue
     except asyncio.TimeoutError:
         pass
+    finally:
+        extract.release()
+        # Selesai / gagal / dibatalkan (kalah hedge) -> jangan tinggalkan scraper yatim
+        for t in tasks: t.cancel()
+        # URL yang tidak sempat diuji (ada pemenang lain) bukan sukses/gagal -> lepas probe saja
+        for family in unjudged: scraper_stats.release(family)
+        scraper_stats.maybe_save()
     
     # Jika semua gagal
-    for t in tasks: t.cancel()
     return {"status": STATUS_FAIL, "reason": "All Scrapers Failed"}
 
+async def _run_scraper(family, scraper, delay, url, type_req, pick_proxy, uas_pool, unjudged):
+    """
+    Jalankan satu scraper (setelah jeda stagger). Gagal dapat URL langsung dicatat;
+    sukses baru dicatat pemanggil setelah download (lihat run_engine_b).
+    """
+    try:
+        if delay: await asyncio.sleep(delay)
+        t0 = time.monotonic()
+        res = await scraper(url, type_req, pick_proxy(family), random.choice(uas_pool))
+    except asyncio.CancelledError:
+        # Kalah balapan / dibatalkan bukan kegagalan scraper
+        scraper_stats.release(family)
+        raise
+    except Exception:
+        res = None
+    if not (res and res.get('url')):
+        scraper_stats.record(family, False)
+        return family, res, None
+    unjudged.add(family)
+    return family, res, time.monotonic() - t0
+
+def _output_file(output_path: str, title: str, type_req: str) -> str:
+    # output_path = folder output (TMP_DIR) -> nama unik per job supaya tidak saling timpa
+    if not os.path.isdir(output_path): return output_path
+    ext = "mp3" if type_req == "audio" else "mp4"
+    safe_title = "".join(c for c in (title or "") if c.isalnum() or c in " -_").strip()[:50] or "media"
+    path = os.path.join(output_path, f"{safe_title}-{uuid.uuid4().hex[:6]}.{ext}")
+    storage.track(path) # Dibuang storage manager kalau tidak pernah di-register
+    return path
+
 # --- SAFE DOWNLOADER ---
-async def _download_safe(url, path, proxy, ua):
+async def _download_safe(url, path, proxy, ua, stat_name=None):
+    target = target_family(url)
+    t_start = time.monotonic()
+    def on_first_byte():
+        if stat_name: scraper_stats.record_ttfb(stat_name, time.monotonic() - t_start)
     try:
         headers = {"User-Agent": ua, "Connection": "keep-alive"}
         timeout = aiohttp.ClientTimeout(total=600, connect=30)
         
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        # Multi-koneksi dulu (Range), fallback single-stream kalau server tidak mendukung
+        routes = list(dict.fromkeys(get_batch_proxies(SEGMENT_CONNECTIONS - 1, target=target) + [proxy, None]))
+        try:
+            if await download_segmented(url, path, headers, routes, on_first_byte): return True
+            log.warning("Engine B Segmented failed, retry single-stream")
+        except RangeUnsupported as e:
+            log.info(f"Engine B Single-stream ({e})")
+
+        async with ScopedSession() as session:
             # Gunakan fetch_smart logic manual disini karena ini streaming
             # Try Proxy First
             try:
                 if proxy:
-                    async with session.get(url, headers=headers, proxy=proxy) as resp:
+                    t0 = time.monotonic()
+                    async with session.get(url, headers=headers, proxy=proxy, timeout=timeout) as resp:
                         if resp.status == 200:
-                            return await _stream_to_file(resp, path)
-            except: pass
+                            ok = await _stream_to_file(resp, path, on_first_byte)
+                            elapsed = time.monotonic() - t0
+                            if ok: report_proxy_status(proxy, True, throughput=os.path.getsize(path) / max(elapsed, 0.001), target=target)
+                            else: report_proxy_status(proxy, False, target=target)
+                            if ok: return True
+            except Exception: report_proxy_status(proxy, False, target=target)
             
             # Try Direct
-            async with session.get(url, headers=headers, proxy=None) as resp:
+            async with session.get(url, headers=headers, proxy=None, timeout=timeout) as resp:
                 if resp.status == 200:
-                    return await _stream_to_file(resp, path)
+                    return await _stream_to_file(resp, path, on_first_byte)
                     
+    except asyncio.CancelledError:
+        if os.path.exists(path):
+            try: os.remove(path)
+            except: pass
+        raise
     except Exception as e:
         log.error(f"Engine B Download Error: {e}")
         pass
@@ -138,13 +225,16 @@ async def _download_safe(url, path, proxy, ua):
         except: pass
     return False
 
-async def _stream_to_file(resp, path):
+async def _stream_to_file(resp, path, on_first_byte=None):
     try:
         with open(path, 'wb') as f:
             async for chunk in resp.content.iter_chunked(1024*1024):
+                if on_first_byte:
+                    on_first_byte()
+                    on_first_byte = None
                 f.write(chunk)
         if os.path.exists(path) and os.path.getsize(path) > 5000: return True
-    except: pass
+    except Exception: pass
     return False
 
 # ==========================================
@@ -185,7 +275,7 @@ async def scraper_savetube(url, type_req, proxy, ua):
             "referer": "https://ytsave.savetube.me/"
         }
         
-        async with aiohttp.ClientSession(headers=headers) as session:
+        async with ScopedSession(headers=headers) as session:
             # 1. Get CDN
             cdn_data = await fetch_smart(session, "https://media.savetube.me/api/random-cdn", proxy=proxy, json_res=True)
             if not cdn_data: return None
@@ -258,18 +348,18 @@ async def scraper_ytdlp_online(url, type_req, proxy, ua):
             
         request_url = endpoint + quote(command)
         
-        async with aiohttp.ClientSession(headers={"User-Agent": ua, "Accept": "*/*"}) as session:
+        async with ScopedSession(headers={"User-Agent": ua, "Accept": "*/*"}) as session:
             # Ini streaming text response, jadi pakai logic khusus
             try:
                 # Try Proxy
                 if proxy:
-                    async with session.get(request_url, proxy=proxy, timeout=45) as resp:
+                    async with session.get(request_url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=45)) as resp:
                         if resp.status == 200:
                             res = await _parse_ytdlp_stream(resp)
-                            if res: report_proxy_status(proxy, True); return res
+                            if res: report_proxy_status(proxy, True, target="ytdlp_online"); return res
                             
                 # Try Direct
-                async with session.get(request_url, proxy=None, timeout=45) as resp:
+                async with session.get(request_url, proxy=None, timeout=aiohttp.ClientTimeout(total=45)) as resp:
                     if resp.status == 200:
                         return await _parse_ytdlp_stream(resp)
             except: pass
@@ -295,7 +385,7 @@ async def scraper_optiklink(url, type_req, proxy, ua):
         api_url = "https://host.optikl.ink/download/youtube"
         fmt = "mp3" if type_req == 'audio' else "720"
         
-        async with aiohttp.ClientSession(headers={"User-Agent": ua}) as session:
+        async with ScopedSession(headers={"User-Agent": ua}) as session:
             data = await fetch_smart(session, api_url, params={"url": url, "format": fmt}, proxy=proxy, json_res=True)
             
             if data and data.get("code") == 200 and data.get("result"):
@@ -321,7 +411,7 @@ async def scraper_ytdown(url, type_req, proxy, ua):
             "User-Agent": ua,
             "Referer": "https://ytdown.io/"
         }
-        async with aiohttp.ClientSession(headers=headers) as session:
+        async with ScopedSession(headers=headers) as session:
             # 1. Get Init Data
             data = await fetch_smart(session, "https://ytdown.io/proxy.php", method="POST", data=urlencode({"url": url}), proxy=proxy, json_res=True)
             if not data: return None
@@ -339,7 +429,7 @@ async def scraper_ytdown(url, type_req, proxy, ua):
             
             if selected:
                 # 2. Resolve Final URL (Redirect check)
-                async with session.get(selected["mediaUrl"], proxy=proxy, timeout=15) as m_resp:
+                async with session.get(selected["mediaUrl"], proxy=proxy, timeout=aiohttp.ClientTimeout(total=15)) as m_resp:
                     if m_resp.status == 200:
                         m_json = await m_resp.json()
                         return {
@@ -361,7 +451,7 @@ async def scraper_y2mate(url, type_req, proxy, ua):
         else: vid = parse_qs(urlparse(url).query).get("v", [""])[0]
         if not vid: return None
 
-        async with aiohttp.ClientSession(headers=headers) as session:
+        async with ScopedSession(headers=headers) as session:
             # 1. Init
             u_init = "ODh0VzVGdnB3a3BhTDhSWWhIVUxYZ1ZKaVp4STF1TFJiNDlBemtUM1ZNQ2lmejVfNFNoMVBpTTdMYnNTOUU1V050UzRJUXpF"
             t_init = int(time.time())
@@ -395,3 +485,12 @@ async def scraper_y2mate(url, type_req, proxy, ua):
                 }
     except: pass
     return None
+
+# --- SCRAPER REGISTRY (family proxy_manager, fungsi) ---
+SCRAPERS = [
+    ("savetube", scraper_savetube),
+    ("ytdlp_online", scraper_ytdlp_online),
+    ("ytdown", scraper_ytdown),
+    ("optiklink", scraper_optiklink),
+    ("y2mate", scraper_y2mate),
+]
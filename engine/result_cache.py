@@ -0,0 +1,132 @@
+import os, json, time, threading, fcntl, asyncio
+from contextlib import contextmanager
+from config import Config, STATUS_OK
+from logger import log
+import shared_state
+
+# --- RESULT CACHE (Video ID -> File di TMP_DIR) ---
+# Index kecil di memory, disimpan ke disk supaya tetap hidup setelah restart.
+# Entry divalidasi pakai size + inode, jadi file yang sudah dihapus/ditimpa
+# di luar storage manager otomatis dianggap MISS.
+# Multi-worker: index dibaca ulang kalau file diubah worker lain (cek mtime), dan
+# read-modify-write dikunci flock supaya update antar worker tidak saling timpa.
+# Semua akses index (flock + baca/tulis JSON) jalan di thread, tidak pernah di event loop.
+# Hit dikumpulkan sebagai delta dan ditulis bersama save berikutnya (paling lambat HIT_FLUSH_INTERVAL).
+
+INDEX_FILE = os.path.join(Config.CACHE_DIR, "result_cache.json")
+META_FIELDS = ("title", "thumbnail", "duration", "author", "engine")
+HIT_FLUSH_INTERVAL = 30
+
+_lock = threading.Lock()
+_index = None
+_loaded_mtime = None
+_hit_delta = {}  # key -> hit yang belum ditulis
+_last_save = 0.0
+
+def make_key(video_id: str, type_req: str, quality: str) -> str:
+    return f"{video_id}:{type_req}:{quality}"
+
+def _mtime():
+    try: return os.stat(INDEX_FILE).st_mtime_ns
+    except OSError: return None
+
+def _load() -> dict:
+    global _index, _loaded_mtime
+    if _index is None or (shared_state.ENABLED and _mtime() != _loaded_mtime):
+        _loaded_mtime = _mtime()
+        try:
+            with open(INDEX_FILE, "r") as f: _index = json.load(f)
+        except: _index = {}
+    return _index
+
+def _save():
+    global _loaded_mtime, _last_save
+    # Index baru saja di-load ulang di dalam lock -> delta hit diterapkan ke versi terbaru
+    for key, n in _hit_delta.items():
+        entry = _index.get(key)
+        if entry: entry["hits"] = entry.get("hits", 0) + n
+    _hit_delta.clear()
+    _last_save = time.time()
+    try:
+        tmp = f"{INDEX_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f: json.dump(_index, f)
+        os.replace(tmp, INDEX_FILE)
+        _loaded_mtime = _mtime()
+    except Exception as e:
+        log.error(f"Result Cache Save Error: {e}")
+
+@contextmanager
+def _locked():
+    with _lock:
+        if not shared_state.ENABLED:
+            yield
+            return
+        with open(INDEX_FILE + ".lock", "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try: yield
+            finally: fcntl.flock(lf, fcntl.LOCK_UN)
+
+async def lookup(key: str):
+    """Return result dict (seperti output engine) jika file masih valid, else None."""
+    return await asyncio.to_thread(_lookup, key)
+
+def _lookup(key: str):
+    with _locked():
+        entry = _load().get(key)
+        if not entry: return None
+        path = os.path.join(Config.TMP_DIR, entry["filename"])
+        try:
+            st = os.stat(path)
+        except OSError:
+            _index.pop(key, None); _save()
+            return None
+        if st.st_size != entry["size"] or st.st_ino != entry["inode"]:
+            _index.pop(key, None); _save()
+            return None
+
+        _hit_delta[key] = _hit_delta.get(key, 0) + 1
+        if time.time() - _last_save >= HIT_FLUSH_INTERVAL: _save()
+
+    result = {k: entry.get(k) for k in META_FIELDS}
+    result.update({"status": STATUS_OK, "filename": entry["filename"], "cached": True})
+    return result
+
+async def store(key: str, data: dict):
+    await asyncio.to_thread(_store, key, data)
+
+def _store(key: str, data: dict):
+    filename = data.get("filename")
+    if not filename: return
+    try:
+        st = os.stat(os.path.join(Config.TMP_DIR, filename))
+    except OSError:
+        return
+    entry = {k: data.get(k) for k in META_FIELDS}
+    entry.update({"filename": filename, "size": st.st_size, "inode": st.st_ino, "created": time.time(), "hits": 0})
+    with _locked():
+        index = _load()
+        # Satu file hanya boleh dimiliki satu key (judul sama = nama file sama)
+        for k in [k for k, v in index.items() if v.get("filename") == filename and k != key]: index.pop(k)
+        index[key] = entry
+        _save()
+
+def forget_file(filename: str):
+    """Dipanggil oleh storage manager saat file di TMP_DIR dihapus (tidak ditunggu, jalan di thread)."""
+    asyncio.get_running_loop().run_in_executor(None, _forget_file, filename)
+
+def _forget_file(filename: str):
+    with _locked():
+        index = _load()
+        stale = [k for k, v in index.items() if v.get("filename") == filename]
+        if not stale: return
+        for k in stale: index.pop(k)
+        _save()
+
+def prune() -> int:
+    """Buang entry yang filenya sudah tidak ada (mis. setelah force clean). Blocking: via asyncio.to_thread."""
+    with _locked():
+        index = _load()
+        stale = [k for k, v in index.items() if not os.path.exists(os.path.join(Config.TMP_DIR, v.get("filename", "")))]
+        for k in stale: index.pop(k)
+        if stale or _hit_delta: _save()
+        return len(stale)
@@ -0,0 +1,184 @@
+import os, json, time, shutil, hashlib, threading
+from urllib.parse import urlparse, parse_qs
+from config import Config
+from logger import log
+import shared_state
+
+# --- RESUMABLE DOWNLOADS ---
+# Engine B: file .part + sidecar .json (URL, ETag/Last-Modified, ukuran, range selesai)
+#           di RESUME_DIR, dikunci per sumber -> retry lewat proxy/scraper lain lanjut
+#           dari range yang belum ada (Range + If-Range).
+# Engine A: raw dir deterministik per URL, yt-dlp/aria2c lanjut dari .part sendiri.
+
+RESUME_DIR = os.path.join(Config.RAW_DIR, "resume")
+RESUME_TTL = 6 * 3600      # checkpoint lebih tua dari ini dibuang
+RAW_PREFIX = "r-"          # raw dir Engine A yang deterministik
+PARTIAL_EXT = (".part", ".ytdl", ".aria2", ".temp")
+
+_claimed = {}  # path -> jumlah pemegang (coroutine + thread yt-dlp)
+_leases = {}   # path -> lease id shared_state (multi-worker: claim berlaku antar proses)
+_claim_lock = threading.Lock()
+
+def source_key(url: str) -> str:
+    """
+    Identitas sumber. URL googlevideo ditandatangani ulang tiap scrape, tapi
+    (id, itag, clen) tetap sama untuk stream yang sama -> checkpoint bisa dipakai ulang.
+    """
+    parsed = urlparse(url)
+    if parsed.netloc.endswith("googlevideo.com"):
+        qs = parse_qs(parsed.query)
+        parts = [qs.get(k, [""])[0] for k in ("id", "itag", "clen")]
+        if all(parts): return "gv:" + ":".join(parts)
+    return url
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+async def claim(path: str) -> bool:
+    """Satu proses tulis per file/dir resume (single-flight tidak cukup: kunci cache beda kualitas bisa satu sumber)."""
+    with _claim_lock:
+        if path in _claimed: return False
+        _claimed[path] = 1 # Reservasi lokal dulu; lease global diambil di thread shared state
+    if not shared_state.ENABLED: return True
+    lease_id = None
+    try:
+        lease_id = await shared_state.try_lease(f"claim:{path}", 1, 1)
+    except Exception as e:
+        log.error(f"RESUME claim error {path}: {e}")
+    finally:
+        with _claim_lock:
+            if lease_id is None: _claimed.pop(path, None)
+            else: _leases[path] = lease_id
+    return lease_id is not None
+
+def retain(path: str):
+    """Tambah pemegang (mis. thread download yang bisa hidup lebih lama dari coroutine-nya)."""
+    with _claim_lock:
+        if path in _claimed: _claimed[path] += 1
+
+def release(path: str):
+    with _claim_lock:
+        if path not in _claimed: return
+        _claimed[path] -= 1
+        if _claimed[path] > 0: return
+        del _claimed[path]
+        lease_id = _leases.pop(path, None)
+    if lease_id is not None: shared_state.release_lease(lease_id)
+
+class Checkpoint:
+    """Progres download Engine B per sumber: ranges (start, end inklusif) yang sudah ditulis."""
+    def __init__(self, url: str):
+        os.makedirs(RESUME_DIR, exist_ok=True)
+        self.url = url
+        base = os.path.join(RESUME_DIR, _digest(source_key(url)))
+        self.part_path = base + ".part"
+        self.meta_path = base + ".json"
+        self.size = None
+        self.validators = {}
+        self.done = []
+
+    def load(self, size: int, validators: dict) -> bool:
+        """True kalau checkpoint lama cocok (ukuran + ETag/Last-Modified) dan bisa dilanjut."""
+        self.size, self.validators = size, validators
+        try:
+            with open(self.meta_path, "r") as f: meta = json.load(f)
+        except (OSError, ValueError):
+            self.done = []
+            return False
+        same = meta.get("size") == size and os.path.exists(self.part_path)
+        for key, value in validators.items():
+            if meta.get("validators", {}).get(key) not in (None, value): same = False
+        if not same:
+            self.discard()
+            return False
+        self.done = [tuple(r) for r in meta.get("done", [])]
+        if self.done: log.info(f"RESUME: {self.bytes_done() / 1048576:.1f}MB already fetched")
+        return bool(self.done)
+
+    def if_range(self):
+        # ETag kuat lebih diutamakan; ETag lemah (W/) tidak boleh dipakai untuk If-Range
+        etag = self.validators.get("ETag")
+        if etag and not etag.startswith("W/"): return etag
+        return self.validators.get("Last-Modified")
+
+    def is_done(self, start: int, end: int) -> bool:
+        return any(s <= start and end <= e for s, e in self.done)
+
+    def bytes_done(self) -> int:
+        return sum(e - s + 1 for s, e in self.done)
+
+    def mark_done(self, start: int, end: int):
+        self.done.append((start, end))
+        self.save()
+
+    def save(self):
+        meta = {"url": self.url, "size": self.size, "validators": self.validators, "done": self.done, "updated": time.time()}
+        tmp = self.meta_path + ".tmp"
+        try:
+            with open(tmp, "w") as f: json.dump(meta, f)
+            os.replace(tmp, self.meta_path)
+        except OSError as e:
+            log.error(f"Checkpoint Save Error: {e}")
+
+    def finish(self, final_path: str):
+        """Pindahkan .part ke path akhir lalu hapus sidecar."""
+        shutil.move(self.part_path, final_path)
+        try: os.remove(self.meta_path)
+        except OSError: pass
+
+    def discard(self):
+        for p in (self.part_path, self.meta_path):
+            try: os.remove(p)
+            except OSError: pass
+        self.done = []
+
+def raw_dir_for(url: str, kind: str) -> str:
+    """Raw dir Engine A yang sama untuk URL + jenis yang sama (yt-dlp continuedl)."""
+    return os.path.join(Config.RAW_DIR, f"{RAW_PREFIX}{_digest(url)}-{kind}")
+
+def pick_output(raw_dir: str, info: dict):
+    """File hasil yt-dlp (bukan sisa .part/.ytdl/.aria2 dari percobaan sebelumnya)."""
+    for d in (info or {}).get("requested_downloads") or []:
+        fp = d.get("filepath")
+        if fp and os.path.exists(fp): return fp
+    for name in sorted(os.listdir(raw_dir)):
+        if not name.endswith(PARTIAL_EXT): return os.path.join(raw_dir, name)
+    return None
+
+def _in_use(path: str) -> bool:
+    # Blocking (lease_held) -> prune/prune_orphans dijalankan lewat asyncio.to_thread
+    # Sidecar .json ikut terkunci selama .part-nya di-claim
+    part = os.path.splitext(path)[0] + ".part"
+    if path in _claimed or part in _claimed: return True
+    return shared_state.ENABLED and (shared_state.lease_held(f"claim:{path}") or shared_state.lease_held(f"claim:{part}"))
+
+def prune(max_age: float = RESUME_TTL) -> int:
+    """Buang checkpoint / raw dir (termasuk sisa dir sekali pakai) yang basi dan tidak sedang dipakai."""
+    now = time.time()
+    count = 0
+    for root in (RESUME_DIR, Config.RAW_DIR):
+        if not os.path.isdir(root): continue
+        for entry in os.scandir(root):
+            if entry.path == RESUME_DIR: continue
+            try:
+                if now - entry.stat().st_mtime < max_age or _in_use(entry.path): continue
+                if entry.is_dir(): shutil.rmtree(entry.path, ignore_errors=True)
+                else: os.remove(entry.path)
+                count += 1
+            except OSError: pass
+    if count: log.info(f"RESUME: pruned {count} stale checkpoints")
+    return count
+
+def prune_orphans() -> int:
+    """Dir sekali pakai (RAW_DIR/<request_id>) yang tidak di-claim = sisa crash, tidak bisa dilanjutkan."""
+    count = 0
+    if not os.path.isdir(Config.RAW_DIR): return 0
+    for entry in os.scandir(Config.RAW_DIR):
+        if entry.path == RESUME_DIR or entry.name.startswith(RAW_PREFIX) or _in_use(entry.path): continue
+        try:
+            if entry.is_dir(): shutil.rmtree(entry.path, ignore_errors=True)
+            else: os.remove(entry.path)
+            count += 1
+        except OSError: pass
+    if count: log.info(f"RESUME: removed {count} orphaned raw dirs")
+    return count
@@ -0,0 +1,129 @@
+import os, json, time
+from config import Config
+from logger import log
+import shared_state
+
+# --- SCRAPER PORTFOLIO (Engine B) ---
+# Statistik per scraper: success rate, latency sampai dapat URL, latency byte pertama,
+# fail streak. Dipakai untuk urutan launch (top-k dulu, sisanya di-stagger) dan
+# circuit breaker (closed -> open -> half_open probe -> closed).
+# Multi-worker: tiap hasil dikirim lewat bus shared_state dan diterapkan di semua worker
+# (breaker & ranking sama di mana pun); file hanya ditulis worker primary.
+
+STATS_FILE = os.path.join(Config.CACHE_DIR, "scraper_stats.json")
+SAVE_INTERVAL = 30
+
+TOP_K = 2                # langsung jalan
+STAGGER_DELAY = 4.0      # jeda antar scraper sisanya
+EWMA_ALPHA = 0.2
+BREAKER_STREAK = 4       # gagal beruntun -> open
+BREAKER_COOLDOWN = 300   # open -> half_open setelah ini (detik)
+
+def _new():
+    return {"ok": 0, "fail": 0, "rate": 0.5, "url_latency": None, "ttfb": None,
+            "streak": 0, "state": "closed", "opened_at": 0, "probing": False}
+
+_stats = {}
+_dirty = False
+_last_save = 0.0
+
+def _load():
+    global _stats
+    try:
+        with open(STATS_FILE, "r") as f: data = json.load(f)
+        for name, st in data.items():
+            _stats[name] = {**_new(), **st, "probing": False}
+    except: pass
+
+def get(name: str) -> dict:
+    if not _stats: _load()
+    return _stats.setdefault(name, _new())
+
+def _expected_cost(st: dict) -> float:
+    # Makin kecil makin bagus: latency dibagi peluang sukses
+    latency = (st["url_latency"] or 10.0) + (st["ttfb"] or 2.0)
+    return latency / max(st["rate"], 0.05)
+
+def allow(name: str) -> bool:
+    """Circuit breaker: open = skip, setelah cooldown izinkan 1 probe (half_open)."""
+    st = get(name)
+    if st["state"] == "closed": return True
+    if st["state"] == "open" and time.time() - st["opened_at"] >= BREAKER_COOLDOWN:
+        st["state"] = "half_open"
+    if st["state"] == "half_open" and not st["probing"]:
+        st["probing"] = True
+        log.info(f"SCRAPER BREAKER: {name} half-open probe")
+        return True
+    return False
+
+def plan(names: list) -> list:
+    """Return [(name, delay)] terurut: top-k delay 0, sisanya di-stagger. Scraper open di-skip."""
+    ranked = sorted(names, key=lambda n: _expected_cost(get(n)))
+    allowed = [n for n in ranked if allow(n)]
+    if not allowed and ranked: allowed = ranked[:1] # Semua open -> tetap coba yang terbaik
+    return [(n, 0.0 if i < TOP_K else STAGGER_DELAY * (i - TOP_K + 1)) for i, n in enumerate(allowed)]
+
+def record(name: str, ok: bool, url_latency: float = None):
+    _record(name, ok, url_latency)
+    shared_state.publish("scraper", {"op": "record", "name": name, "ok": ok, "url_latency": url_latency})
+    maybe_save()
+
+def _record(name: str, ok: bool, url_latency: float = None):
+    global _dirty
+    st = get(name)
+    st["probing"] = False
+    st["rate"] += EWMA_ALPHA * ((1.0 if ok else 0.0) - st["rate"])
+    if ok:
+        st["ok"] += 1
+        st["streak"] = 0
+        if url_latency is not None:
+            st["url_latency"] = url_latency if st["url_latency"] is None else st["url_latency"] + EWMA_ALPHA * (url_latency - st["url_latency"])
+        if st["state"] != "closed": log.info(f"SCRAPER BREAKER: {name} closed")
+        st["state"] = "closed"
+    else:
+        st["fail"] += 1
+        st["streak"] += 1
+        if st["state"] == "half_open" or (st["state"] == "closed" and st["streak"] >= BREAKER_STREAK):
+            st["state"] = "open"
+            st["opened_at"] = time.time()
+            log.warning(f"SCRAPER BREAKER: {name} open (streak {st['streak']})")
+    _dirty = True
+
+def record_ttfb(name: str, ttfb: float):
+    _record_ttfb(name, ttfb)
+    shared_state.publish("scraper", {"op": "ttfb", "name": name, "ttfb": ttfb})
+
+def _record_ttfb(name: str, ttfb: float):
+    global _dirty
+    st = get(name)
+    st["ttfb"] = ttfb if st["ttfb"] is None else st["ttfb"] + EWMA_ALPHA * (ttfb - st["ttfb"])
+    _dirty = True
+
+def _on_shared(event: dict):
+    name = event.get("name")
+    if not name: return
+    if event.get("op") == "record": _record(name, bool(event.get("ok")), event.get("url_latency"))
+    elif event.get("op") == "ttfb": _record_ttfb(name, event["ttfb"])
+
+shared_state.on("scraper", _on_shared)
+
+def release(name: str):
+    """Probe half_open yang dibatalkan (bukan gagal) -> boleh probe lagi."""
+    get(name)["probing"] = False
+
+def maybe_save(force: bool = False):
+    global _dirty, _last_save
+    if not _dirty or (not force and time.time() - _last_save < SAVE_INTERVAL): return
+    if not shared_state.is_primary(): return # Satu penulis; worker lain sudah menerima hasilnya lewat bus
+    try:
+        tmp = STATS_FILE + ".tmp"
+        with open(tmp, "w") as f: json.dump(_stats, f, indent=2)
+        os.replace(tmp, STATS_FILE)
+        _dirty = False
+        _last_save = time.time()
+    except Exception as e:
+        log.error(f"Scraper Stats Save Error: {e}")
+
+def summary() -> dict:
+    if not _stats: _load()
+    return {n: {k: st[k] for k in ("ok", "fail", "rate", "url_latency", "ttfb", "streak", "state")} for n, st in _stats.items()}
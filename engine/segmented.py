@@ -0,0 +1,154 @@
+import asyncio, os, re, time
+import aiohttp
+from logger import log
+from proxy_manager import report_proxy_status, target_family
+from .http_pool import get_session
+from . import resume
+
+# --- SEGMENTED DOWNLOADER (Engine B) ---
+# File dipecah jadi beberapa range, diambil paralel lewat beberapa koneksi/proxy,
+# ditulis langsung ke offset masing-masing di file yang sudah dialokasikan.
+# Segmen yang gagal saja yang diulang (pakai proxy lain / direct).
+
+SEGMENT_CONNECTIONS = 6          # koneksi paralel
+SEGMENT_SIZE = 8 * 1024 * 1024   # ukuran 1 segmen
+SEGMENT_MIN_FILE = 4 * 1024 * 1024  # file kecil -> single-stream saja
+SEGMENT_RETRIES = 3              # percobaan per segmen
+CHUNK = 256 * 1024
+PROBE_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=10)
+# Tidak ada batas total: file besar sah makan waktu lama, yang dibatasi idle read
+SEGMENT_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=15, sock_read=30)
+
+_RANGE_RE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+class RangeUnsupported(Exception):
+    """Server tidak mendukung Range / ukuran tidak diketahui -> caller pakai single-stream."""
+
+class SourceChanged(Exception):
+    """If-Range tidak cocok (server kirim 200 penuh) -> checkpoint basi."""
+
+async def probe(url: str, headers: dict, proxy=None):
+    """
+    GET bytes=0-0 (lebih andal dari HEAD di CDN video).
+    Return (total_size, validators) atau raise RangeUnsupported.
+    """
+    async with get_session().get(url, headers={**headers, "Range": "bytes=0-0"}, proxy=proxy, timeout=PROBE_TIMEOUT) as resp:
+        if resp.status != 206: raise RangeUnsupported(f"status {resp.status}")
+        m = _RANGE_RE.match(resp.headers.get("Content-Range", ""))
+        if not m or m.group(3) == "*": raise RangeUnsupported("no total size")
+        validators = {k: resp.headers[k] for k in ("ETag", "Last-Modified") if k in resp.headers}
+        return int(m.group(3)), validators
+
+def plan_segments(size: int, segment_size: int = SEGMENT_SIZE) -> list:
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+def preallocate(path: str, size: int) -> int:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if hasattr(os, "posix_fallocate"): os.posix_fallocate(fd, 0, size)
+        else: os.ftruncate(fd, size)
+    except OSError:
+        os.ftruncate(fd, size) # FS tanpa fallocate (tmpfs lama, dll)
+    return fd
+
+async def _fetch_segment(url: str, headers: dict, proxy, fd: int, start: int, end: int, on_first_byte=None) -> bool:
+    target = target_family(url)
+    t0 = time.monotonic()
+    offset = start
+    try:
+        async with get_session().get(url, headers={**headers, "Range": f"bytes={start}-{end}"}, proxy=proxy, timeout=SEGMENT_TIMEOUT) as resp:
+            if resp.status == 200 and "If-Range" in headers: raise SourceChanged()
+            m = _RANGE_RE.match(resp.headers.get("Content-Range", ""))
+            if resp.status != 206 or not m or int(m.group(1)) != start:
+                if proxy: report_proxy_status(proxy, False, target=target)
+                return False
+            async for chunk in resp.content.iter_chunked(CHUNK):
+                if on_first_byte:
+                    on_first_byte()
+                    on_first_byte = None
+                chunk = chunk[:end + 1 - offset] # Jaga-jaga server kirim lebih
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                if offset > end: break
+    except (asyncio.CancelledError, SourceChanged):
+        raise
+    except Exception:
+        if proxy: report_proxy_status(proxy, False, target=target)
+        return False
+    ok = offset == end + 1
+    if proxy:
+        elapsed = time.monotonic() - t0
+        report_proxy_status(proxy, ok, latency=None, throughput=(offset - start) / max(elapsed, 0.001) if ok else None, target=target)
+    return ok
+
+async def download_segmented(url: str, path: str, headers: dict, proxies: list, on_first_byte=None) -> bool:
+    """
+    proxies: daftar route (proxy URL atau None = direct), dibagi round-robin ke worker.
+    Progres disimpan ke checkpoint (engine/resume.py): kalau gagal di tengah jalan,
+    percobaan berikutnya untuk sumber yang sama hanya mengambil segmen yang belum ada.
+    Return True/False; raise RangeUnsupported kalau harus fallback single-stream.
+    """
+    routes = proxies or [None]
+    size, validators = await _probe_any(url, headers, routes)
+    if size < SEGMENT_MIN_FILE: raise RangeUnsupported(f"small file ({size} bytes)")
+
+    ck = resume.Checkpoint(url)
+    if not await resume.claim(ck.part_path): ck = None # Sumber sama sedang diunduh job lain -> tanpa checkpoint
+    try:
+        if ck:
+            ck.load(size, validators)
+            if ck.if_range(): headers = {**headers, "If-Range": ck.if_range()}
+        segments = [seg for seg in plan_segments(size) if not (ck and ck.is_done(*seg))]
+        queue = asyncio.Queue()
+        for seg in segments: queue.put_nowait((seg, 0))
+        failed = []
+        fd = preallocate(ck.part_path if ck else path, size)
+        first = [on_first_byte]
+
+        def _first():
+            if first[0]:
+                first[0]()
+                first[0] = None
+
+        async def worker(idx: int):
+            while True:
+                try: (start, end), attempt = queue.get_nowait()
+                except asyncio.QueueEmpty: return
+                # Percobaan ulang pindah route (proxy lain, terakhir direct)
+                proxy = routes[(idx + attempt) % len(routes)] if attempt < SEGMENT_RETRIES - 1 else None
+                if await _fetch_segment(url, headers, proxy, fd, start, end, _first):
+                    if ck: ck.mark_done(start, end)
+                    continue
+                if attempt + 1 < SEGMENT_RETRIES: queue.put_nowait(((start, end), attempt + 1))
+                else: failed.append((start, end))
+
+        conns = min(SEGMENT_CONNECTIONS, len(segments))
+        log.info(f"Engine B Segmented: {size / 1048576:.1f}MB, {len(segments)} segments x {conns} conns")
+        workers = [asyncio.create_task(worker(i)) for i in range(conns)]
+        try:
+            await asyncio.gather(*workers)
+        except SourceChanged:
+            log.warning("Engine B Segmented: source changed, checkpoint dropped")
+            if ck: ck.discard()
+            return False
+        finally:
+            for w in workers: w.cancel()
+            os.close(fd)
+
+        if failed:
+            # Checkpoint tetap disimpan -> retry berikutnya lanjut dari sini
+            log.warning(f"Engine B Segmented: {len(failed)} segments failed")
+            return False
+        if ck: ck.finish(path)
+        return True
+    finally:
+        if ck: resume.release(ck.part_path)
+
+async def _probe_any(url: str, headers: dict, routes: list):
+    # Probe lewat route pertama, fallback direct
+    for proxy in dict.fromkeys(routes[:1] + [None]):
+        try: return await probe(url, headers, proxy)
+        except RangeUnsupported: raise
+        except asyncio.CancelledError: raise
+        except Exception: continue
+    raise RangeUnsupported("probe failed")
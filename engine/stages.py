@@ -0,0 +1,164 @@
+import asyncio, math, os, time
+from collections import deque
+from contextlib import asynccontextmanager
+import shared_state
+
+# --- STAGE SCHEDULER ---
+# Pipeline dibagi per tahap dengan batas sendiri-sendiri:
+#   extract   -> resolve URL (yt-dlp extract pipe mode, swarm scraper Engine B), network + thread executor
+#   download  -> network bound, slot banyak
+#   transcode -> CPU bound, kapasitas = jumlah core, tiap job ambil "thread budget"
+#                (ffmpeg dapat -threads sebanyak budget, bukan -threads 0 yang rebutan core)
+# Queue depth + EWMA service time tiap stage diekspos lewat snapshot() (GET /stats).
+# Admission control: estimasi waktu tunggu dari antrian x service time; job baru ditolak
+# langsung (503 + Retry-After) kalau estimasi melewati deadline atau antrian stage penuh.
+# Multi-worker: kapasitas dan batas antrian tiap stage dibagi rata per worker (bukan
+# capacity x WORKERS). Antrian tetap lokal, jadi FIFO berbobot, waiting, estimated_wait dan
+# StageFull tetap akurat tanpa polling SQLite; harganya slot kosong di satu worker tidak bisa
+# dipakai worker lain (load balancer uvicorn sudah membagi request cukup rata).
+
+CPU_CORES = os.cpu_count() or 2
+EXTRACT_SLOTS = 8
+DOWNLOAD_SLOTS = 16
+AUDIO_ENCODE_THREADS = 1                        # libmp3lame/libopus praktis single-thread
+VIDEO_ENCODE_THREADS = max(2, min(4, CPU_CORES // 2))
+REMUX_THREADS = 1                               # -c copy: I/O saja
+EWMA_ALPHA = 0.2
+
+EXTRACT_MAX_WAITING = 64
+DOWNLOAD_MAX_WAITING = 64
+TRANSCODE_MAX_WAITING = 32
+ADMISSION_DEADLINE = 90   # request sinkron: di bawah timeout tunnel Cloudflare (~100s)
+RETRY_AFTER_MIN = 5
+RETRY_AFTER_MAX = 300
+
+class StageFull(Exception):
+    """Antrian stage sudah di batas -> job ditolak, bukan ditumpuk."""
+
+class Stage:
+    """Semaphore berbobot FIFO + statistik antrian."""
+    def __init__(self, name: str, capacity: int, max_waiting: int, default_service: float):
+        self.name = name
+        if shared_state.ENABLED:
+            capacity, max_waiting = capacity // shared_state.WORKERS, max_waiting // shared_state.WORKERS
+        self.capacity = max(1, capacity)
+        self.max_waiting = max(1, max_waiting)
+        self.default_service = default_service # Dipakai sampai ada sampel service time
+        self.in_use = 0
+        self.active = 0
+        self.completed = 0
+        self.service_time = None # EWMA detik per job
+        self._waiters = deque()  # [weight, future]
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, weight: int = 1) -> int:
+        weight = max(1, min(weight, self.capacity))
+        if not self._waiters and self.in_use + weight <= self.capacity:
+            self._grant(weight)
+            return weight
+        if self.waiting >= self.max_waiting: raise StageFull(f"{self.name} queue full ({self.waiting})")
+        entry = [weight, asyncio.get_running_loop().create_future()]
+        self._waiters.append(entry)
+        try:
+            await entry[1]
+        except asyncio.CancelledError:
+            if entry in self._waiters: self._waiters.remove(entry)
+            elif entry[1].done() and not entry[1].cancelled(): self.release(weight) # Sudah dapat slot tapi keburu dibatalkan
+            self._wake()
+            raise
+        return weight
+
+    def _grant(self, weight: int):
+        self.in_use += weight
+        self.active += 1
+
+    def release(self, weight: int):
+        self.in_use -= weight
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        # FIFO ketat: job besar di depan tidak dilangkahi job kecil (anti starvation)
+        while self._waiters and self.in_use + self._waiters[0][0] <= self.capacity:
+            weight, fut = self._waiters.popleft()
+            if fut.done(): continue
+            self._grant(weight)
+            fut.set_result(True)
+
+    def _record(self, elapsed: float):
+        self.completed += 1
+        self.service_time = elapsed if self.service_time is None else self.service_time + EWMA_ALPHA * (elapsed - self.service_time)
+
+    @asynccontextmanager
+    async def slot(self, weight: int = 1):
+        """async with stage.slot(threads) as threads: ... (threads = budget yang diberikan)"""
+        weight = await self.acquire(weight)
+        t0 = time.monotonic()
+        try:
+            yield weight
+        finally:
+            self.release(weight)
+            self._record(time.monotonic() - t0)
+
+    async def hold(self, weight: int = 1) -> "Held":
+        """Seperti slot(), tapi bisa dilepas lebih awal di tengah blok (Held.release idempotent)."""
+        weight = await self.acquire(weight)
+        return Held(self, weight)
+
+    def full(self) -> bool:
+        return self.waiting >= self.max_waiting
+
+    def estimated_wait(self) -> float:
+        """Perkiraan detik sampai job baru dapat slot: antrian di depannya dilayani paralel oleh job aktif."""
+        if not self._waiters and self.in_use < self.capacity: return 0.0
+        svc = self.service_time if self.service_time is not None else self.default_service
+        return (self.waiting + 1) * svc / max(1, self.active)
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity, "in_use": self.in_use, "active": self.active,
+            "waiting": self.waiting, "max_waiting": self.max_waiting, "completed": self.completed,
+            "estimated_wait": round(self.estimated_wait(), 1),
+            "service_time": round(self.service_time, 2) if self.service_time is not None else None
+        }
+
+class Held:
+    """Slot yang dipegang lewat Stage.hold(); release() dipanggil sekali (sisanya no-op)."""
+    def __init__(self, stage: Stage, weight: int):
+        self.stage = stage
+        self.weight = weight
+        self._t0 = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released: return
+        self._released = True
+        self.stage.release(self.weight)
+        self.stage._record(time.monotonic() - self._t0)
+
+extract = Stage("extract", EXTRACT_SLOTS, EXTRACT_MAX_WAITING, default_service=8.0)
+download = Stage("download", DOWNLOAD_SLOTS, DOWNLOAD_MAX_WAITING, default_service=20.0)
+transcode = Stage("transcode", CPU_CORES, TRANSCODE_MAX_WAITING, default_service=10.0)
+
+def snapshot() -> dict:
+    return {s.name: s.snapshot() for s in (extract, download, transcode)}
+
+def estimated_wait() -> float:
+    # Stage berurutan: tunggu extract, download, lalu transcode
+    return extract.estimated_wait() + download.estimated_wait() + transcode.estimated_wait()
+
+def retry_after(wait: float, deadline: float) -> int:
+    return int(min(max(math.ceil(wait - deadline), RETRY_AFTER_MIN), RETRY_AFTER_MAX))
+
+def admit(deadline: float = ADMISSION_DEADLINE, extra_wait: float = 0.0):
+    """
+    Return (ok, estimated_wait, retry_after). Ditolak kalau salah satu antrian stage penuh
+    atau estimasi tunggu (+ extra_wait, mis. antrian job) melebihi deadline.
+    """
+    wait = estimated_wait() + extra_wait
+    if extract.full() or download.full() or transcode.full(): return False, wait, retry_after(wait, 0)
+    if wait > deadline: return False, wait, retry_after(wait, deadline)
+    return True, wait, 0
@@ -0,0 +1,239 @@
+import os, time, shutil, asyncio
+from collections import OrderedDict
+from config import Config
+from logger import log
+import shared_state
+from . import result_cache, resume, hot_tier
+
+# --- STORAGE MANAGER (TMP_DIR + RAW_DIR) ---
+# Index di memory: filename -> size, urut LRU (akses CDN / cache hit = pindah ke belakang).
+# Directory hanya di-scan sekali saat start; setelah itu index di-update lewat register/touch/forget.
+# Eviction berdasarkan kapasitas disk (statvfs, 1 syscall): di atas HIGH watermark -> hapus
+# file final paling lama tidak diakses sampai di bawah LOW. File yang sedang dikirim CDN atau
+# masih ditulis engine di-pin dan tidak pernah dihapus.
+# Multi-worker: manager hanya jalan di worker primary; worker lain mengirim register/touch/forget
+# lewat bus shared_state, dan primary mengumumkan file yang di-evict (hot tier ikut dibuang).
+# Pin tidak perlu lintas worker: fd yang sudah terbuka tetap valid walau file di-unlink.
+# Output sementara dicatat saat dibuat (track); yang tidak pernah di-register (gagal / ditinggal,
+# sisa convert) dibuang dari catatan itu setelah ORPHAN_AGE tanpa ditulis -- tanpa scan folder.
+
+HIGH_WATERMARK = getattr(Config, "STORAGE_HIGH_WATERMARK", 0.85)  # fraksi disk terpakai
+LOW_WATERMARK = getattr(Config, "STORAGE_LOW_WATERMARK", 0.70)
+MAX_BYTES = getattr(Config, "STORAGE_MAX_BYTES", None)            # Budget TMP_DIR opsional (byte)
+MAX_IDLE = getattr(Config, "STORAGE_MAX_IDLE", 24 * 3600)         # Tidak diakses selama ini -> hapus walau disk lega
+CHECK_INTERVAL = 60
+RESUME_PRUNE_INTERVAL = 600
+ORPHAN_AGE = 3 * 3600       # Output sementara tidak ditulis selama ini -> yatim, hapus
+TOUCH_SHARE_INTERVAL = 30   # Touch dari worker lain cukup dikirim sekali per interval per file
+
+_index = OrderedDict()  # filename -> [size, last_access]  (depan = LRU)
+_pins = {}              # filename -> jumlah pemegang
+_bytes = 0
+_evicted = 0
+_scanned = False
+_wake = None
+_touch_shared = {}      # filename -> waktu touch terakhir dikirim ke bus
+_pending = {}           # filename -> waktu terakhir terlihat ditulis (output sementara, belum register)
+
+def _scan():
+    """Satu kali saat start: isi index dari TMP_DIR (urut mtime sebagai perkiraan akses terakhir)."""
+    global _bytes, _scanned
+    _index.clear()
+    _bytes = 0
+    entries = []
+    if os.path.isdir(Config.TMP_DIR):
+        for entry in os.scandir(Config.TMP_DIR):
+            try:
+                if entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, entry.name, st.st_size))
+            except OSError: pass
+    for mtime, name, size in sorted(entries):
+        _index[name] = [size, mtime]
+        _bytes += size
+    _scanned = True
+    log.info(f"STORAGE: indexed {len(_index)} files ({_bytes / 1024 / 1024:.1f} MB)")
+
+def rescan():
+    """Setelah folder dibersihkan di luar manager (mis. force clean dari bot)."""
+    hot_tier.clear()
+    _scan()
+
+def register(filename: str):
+    """File final baru di TMP_DIR (dipanggil saat finalize)."""
+    _register(filename)
+    shared_state.publish("storage", {"op": "register", "file": filename})
+
+def track(path: str):
+    """Output sementara baru (nama file dibuat engine); hilang dari catatan saat register/forget."""
+    filename = os.path.basename(path)
+    _track(filename)
+    shared_state.publish("storage", {"op": "track", "file": filename})
+
+def touch(filename: str):
+    _touch(filename)
+    if not shared_state.ENABLED: return
+    now = time.monotonic()
+    if now - _touch_shared.get(filename, 0) < TOUCH_SHARE_INTERVAL: return
+    _touch_shared[filename] = now
+    shared_state.publish("storage", {"op": "touch", "file": filename})
+
+def forget(filename: str):
+    _forget(filename)
+    shared_state.publish("storage", {"op": "forget", "file": filename})
+
+def _on_shared(event: dict):
+    op, filename = event.get("op"), event.get("file")
+    if not filename: return
+    if op == "register": _register(filename)
+    elif op == "track": _track(filename)
+    elif op == "touch": _touch(filename)
+    elif op == "forget": _forget(filename)
+    elif op == "evicted":
+        _forget(filename)
+        result_cache.forget_file(filename)
+
+shared_state.on("storage", _on_shared)
+
+def _track(filename: str):
+    _pending[filename] = time.time()
+
+def _register(filename: str):
+    global _bytes
+    _pending.pop(filename, None)
+    try: size = os.path.getsize(os.path.join(Config.TMP_DIR, filename))
+    except OSError: return
+    old = _index.pop(filename, None)
+    if old: _bytes -= old[0]
+    _index[filename] = [size, time.time()]
+    _bytes += size
+    if _over_high() and _wake: _wake.set()
+
+def _touch(filename: str):
+    entry = _index.get(filename)
+    if not entry: return
+    entry[1] = time.time()
+    _index.move_to_end(filename)
+
+def _forget(filename: str):
+    global _bytes
+    _touch_shared.pop(filename, None)
+    _pending.pop(filename, None)
+    entry = _index.pop(filename, None)
+    if entry: _bytes -= entry[0]
+    hot_tier.drop(filename)
+
+def pin(filename: str):
+    _pins[filename] = _pins.get(filename, 0) + 1
+
+def unpin(filename: str):
+    n = _pins.get(filename, 0) - 1
+    if n > 0: _pins[filename] = n
+    else: _pins.pop(filename, None)
+
+def _disk_usage():
+    try:
+        du = shutil.disk_usage(Config.TMP_DIR)
+        return du.used, du.total
+    except OSError:
+        return 0, 0
+
+def _over_high() -> bool:
+    used, total = _disk_usage()
+    if total and used / total > HIGH_WATERMARK: return True
+    return bool(MAX_BYTES) and _bytes > MAX_BYTES
+
+def _remove(filename: str) -> int:
+    size = _index[filename][0]
+    _forget(filename)
+    try: os.remove(os.path.join(Config.TMP_DIR, filename))
+    except FileNotFoundError: pass
+    except OSError as e:
+        log.error(f"STORAGE: remove failed {filename}: {e}")
+        return 0
+    result_cache.forget_file(filename)
+    shared_state.publish("storage", {"op": "evicted", "file": filename})
+    return size
+
+def expire_pending() -> int:
+    """Buang output sementara yang tidak di-register dan tidak ditulis selama ORPHAN_AGE (1 stat per entry)."""
+    removed = 0
+    now = time.time()
+    for name, seen in list(_pending.items()):
+        if now - seen < ORPHAN_AGE or name in _pins: continue
+        path = os.path.join(Config.TMP_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+            if now - mtime < ORPHAN_AGE: # Masih ditulis
+                _pending[name] = mtime
+                continue
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError: pass
+        except OSError as e:
+            log.error(f"STORAGE: orphan remove failed {name}: {e}")
+            continue
+        _pending.pop(name, None)
+    if removed: log.info(f"STORAGE: removed {removed} orphan files")
+    return removed
+
+async def enforce() -> int:
+    """Eviction LRU sampai di bawah LOW watermark + buang file idle. Return jumlah file dihapus."""
+    global _evicted
+    removed = 0
+    now = time.time()
+    # 1. Idle terlalu lama (index urut LRU -> berhenti di entry pertama yang masih segar)
+    for name in list(_index):
+        if now - _index[name][1] < MAX_IDLE: break
+        if name in _pins: continue
+        _remove(name); removed += 1
+
+    # 2. Tekanan disk / budget
+    used, total = _disk_usage()
+    if (total and used / total > HIGH_WATERMARK) or (MAX_BYTES and _bytes > MAX_BYTES):
+        # Checkpoint resume yang tidak dipakai lebih murah dikorbankan daripada hasil final
+        if await asyncio.to_thread(resume.prune, 0): used, total = _disk_usage()
+        target = LOW_WATERMARK * total if total else None
+        # Budget byte pakai histeresis yang sama: turun ke LOW/HIGH x budget
+        budget_target = MAX_BYTES * LOW_WATERMARK / HIGH_WATERMARK if MAX_BYTES else None
+        for name in list(_index):
+            disk_ok = target is None or used <= target
+            budget_ok = budget_target is None or _bytes <= budget_target
+            if disk_ok and budget_ok: break
+            if name in _pins: continue
+            used -= _remove(name); removed += 1
+    _evicted += removed
+    if removed: log.info(f"STORAGE: evicted {removed} files ({_bytes / 1024 / 1024:.1f} MB indexed)")
+    return removed
+
+async def run():
+    """Loop tunggal pengganti sweep berbasis umur (dibangunkan lebih awal oleh register)."""
+    global _wake
+    _wake = asyncio.Event()
+    if not _scanned: _scan()
+    # Prune resume cek lease shared_state (blocking SQLite) -> di thread, bukan di loop
+    await asyncio.to_thread(resume.prune_orphans)
+    await asyncio.to_thread(result_cache.prune)
+    last_resume_prune = 0
+    while True:
+        try:
+            await enforce()
+            if time.time() - last_resume_prune > RESUME_PRUNE_INTERVAL:
+                expire_pending()
+                await asyncio.to_thread(resume.prune)
+                await asyncio.to_thread(resume.prune_orphans)
+                await asyncio.to_thread(result_cache.prune)
+                last_resume_prune = time.time()
+        except Exception as e:
+            log.error(f"STORAGE Error: {e}")
+        try: await asyncio.wait_for(_wake.wait(), timeout=CHECK_INTERVAL)
+        except asyncio.TimeoutError: pass
+        _wake.clear()
+
+def snapshot() -> dict:
+    used, total = _disk_usage()
+    return {
+        "files": len(_index), "bytes": _bytes, "pinned": len(_pins), "pending": len(_pending), "evicted": _evicted,
+        "disk_used": round(used / total, 3) if total else None,
+        "high_watermark": HIGH_WATERMARK, "low_watermark": LOW_WATERMARK
+    }
@@ -1,13 +1,20 @@
-import os, uvicorn, asyncio, time, mimetypes, json, logging, re
+import os, uvicorn, asyncio, mimetypes, json, logging, re
+from collections import deque
 from urllib.parse import quote
 from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from config import Config, STATUS_OK
 from logger import log, save_detailed_error
 import tunnel
-from proxy_manager import start_scheduler as start_proxy_scheduler
+import cdn
+from proxy_manager import start_scheduler as start_proxy_scheduler, start_follower as start_proxy_follower, pool as proxy_pool
+import shared_state
+from engine import scraper_stats, live, naming, storage, hot_tier
+from engine.jobs import job_manager
+from engine.http_pool import close_session as close_http_pool
+from rate_limiter import limiter
 
 # --- IMPORT ROUTERS ---
 from routers import ytdl
@@ -23,7 +30,6 @@ for path in [Config.TMP_DIR, Config.RAW_DIR, Config.CACHE_DIR, Config.ERROR_DIR,
     os.makedirs(path, exist_ok=True)
 
 TMP_DIR = Config.TMP_DIR
-EXPIRE_SECONDS = 60 * 60 * 3 
 
 app = FastAPI(title="KAAI REST API System V9.1", version="9.1.0")
 
@@ -38,82 +44,152 @@ app.add_middleware(
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["api-ytdlpy.akadev.me", "localhost", "127.0.0.1"])
 
 # --- SHARED SERVICES ---
+WS_BUFFER = 32        # Maks pesan antri per socket
+WS_MAX_DROPS = 64     # Consumer yang terus ketinggalan diputus
+WS_SEND_TIMEOUT = 10
+GLOBAL_TOPIC = "*"
+
+class _Subscriber:
+    __slots__ = ("ws", "topics", "buffer", "wakeup", "dropped", "task")
+
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.topics = set()
+        self.buffer = deque()
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.task = None
+
+class _Channel:
+    """Objek ber-interface ws_manager yang otomatis menandai pesan dengan job_id."""
+    def __init__(self, manager, job_id: str):
+        self.manager = manager
+        self.job_id = job_id
+
+    async def broadcast(self, message: dict):
+        await self.manager.broadcast({**message, "job_id": self.job_id})
+
 class ConnectionManager:
+    """
+    Pub/Sub per job: client subscribe ke job_id tertentu (atau '*' untuk semua).
+    Pesan di-serialize sekali, dimasukkan ke buffer tiap subscriber (bounded),
+    progress beruntun untuk job yang sama digabung, dan dikirim oleh task per socket
+    sehingga 1 client lambat tidak menahan publisher.
+    """
     def __init__(self): 
-        self.active_connections = set()
+        self.subscribers = {}
+        self.topics = {}
+
+    @property
+    def active_connections(self):
+        return set(self.subscribers)
     
-    async def connect(self, websocket: WebSocket): 
+    async def connect(self, websocket: WebSocket, job_id: str = None): 
         # Security Check: Origin
         if "origin" in websocket.headers and websocket.headers["origin"] not in Config.ALLOWED_ORIGINS:
             await websocket.close(code=1008)
-            return
+            return False
         await websocket.accept()
-        self.active_connections.add(websocket)
+        sub = _Subscriber(websocket)
+        self.subscribers[websocket] = sub
+        self.subscribe(websocket, job_id or GLOBAL_TOPIC)
+        sub.task = asyncio.create_task(self._sender(sub))
+        return True
+
+    def subscribe(self, websocket: WebSocket, topic: str):
+        sub = self.subscribers.get(websocket)
+        if not sub or not topic: return
+        sub.topics.add(topic)
+        self.topics.setdefault(topic, set()).add(sub)
+
+    def unsubscribe(self, websocket: WebSocket, topic: str):
+        sub = self.subscribers.get(websocket)
+        if not sub: return
+        sub.topics.discard(topic)
+        members = self.topics.get(topic)
+        if members is not None:
+            members.discard(sub)
+            if not members: self.topics.pop(topic, None)
 
     def disconnect(self, websocket: WebSocket): 
-        if websocket in self.active_connections: 
-            self.active_connections.remove(websocket)
+        sub = self.subscribers.pop(websocket, None)
+        if not sub: return
+        for topic in list(sub.topics):
+            members = self.topics.get(topic)
+            if members is not None:
+                members.discard(sub)
+                if not members: self.topics.pop(topic, None)
+        if sub.task and sub.task is not asyncio.current_task(): sub.task.cancel()
+
+    def channel(self, job_id: str) -> _Channel:
+        return _Channel(self, job_id)
 
     async def broadcast(self, message: dict):
-        if not self.active_connections: return
-        # Broadcast paralel agar cepat
-        tasks = [self._send_safe(ws, message) for ws in self.active_connections]
-        await asyncio.gather(*tasks)
+        self.deliver(message)
+        shared_state.publish("ws", message) # Subscriber di worker lain
 
-    async def _send_safe(self, ws: WebSocket, message: dict):
-        try: 
-            await ws.send_json(message)
-        except: 
-            self.disconnect(ws)
+    def deliver(self, message: dict):
+        """Kirim ke subscriber yang terhubung ke worker ini saja."""
+        job_id = message.get("job_id")
+        targets = set(self.topics.get(GLOBAL_TOPIC, ()))
+        if job_id: targets |= self.topics.get(job_id, set())
+        if not targets: return
 
-ws_manager = ConnectionManager()
+        text = json.dumps(message) # Serialize SEKALI untuk semua subscriber
+        is_progress = message.get("status") == "progress"
+        for sub in targets: self._enqueue(sub, job_id, is_progress, text)
 
-def process_database_ip(ip_address):
-    try:
-        if not re.match(r"^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$", ip_address):
-            return False, "Invalid IP"
-
-        if not os.path.exists(Config.DATABASE_FILE): 
-            with open(Config.DATABASE_FILE, "w") as f: 
-                json.dump({}, f)
-        
-        db = {}
+    def _enqueue(self, sub: _Subscriber, job_id, is_progress: bool, text: str):
+        buf = sub.buffer
+        # Coalesce: progress terbaru menggantikan progress lama yang belum terkirim
+        if is_progress and buf and buf[-1][0] == job_id and buf[-1][1]:
+            buf[-1] = (job_id, True, text)
+        else:
+            if len(buf) >= WS_BUFFER:
+                buf.popleft()
+                sub.dropped += 1
+                if sub.dropped > WS_MAX_DROPS:
+                    log.warning("WS: slow consumer dropped")
+                    self.disconnect(sub.ws)
+                    asyncio.create_task(self._close_safe(sub.ws))
+                    return
+            buf.append((job_id, is_progress, text))
+        sub.wakeup.set()
+
+    async def _sender(self, sub: _Subscriber):
         try:
-            with open(Config.DATABASE_FILE, "r") as f: 
-                content = f.read().strip()
-                db = json.loads(content) if content else {}
-        except: db = {}
-        
-        current_time = time.time()
-        if ip_address not in db: 
-            db[ip_address] = {"min_ts": current_time, "day_ts": current_time, "req_min": 0, "req_day": 0, "req_total": 0}
-        
-        user = db[ip_address]
-        if current_time - user.get("min_ts", 0) > 60: 
-            user["min_ts"] = current_time
-            user["req_min"] = 0
-        
-        if current_time - user.get("day_ts", 0) > 86400: 
-            user["day_ts"] = current_time
-            user["req_day"] = 0
-        
-        if user["req_min"] >= Config.RATE_LIMIT_MIN: return False, f"Limit Reached ({Config.RATE_LIMIT_MIN}/min)"
-        if user["req_day"] >= Config.RATE_LIMIT_DAY: return False, f"Limit Reached ({Config.RATE_LIMIT_DAY}/day)"
-        
-        user["req_min"] += 1
-        user["req_day"] += 1
-        user["req_total"] = user.get("req_total", 0) + 1
-        
-        with open(Config.DATABASE_FILE, "w") as f: json.dump(db, f, indent=None)
-        return True, user
+            while True:
+                await sub.wakeup.wait()
+                sub.wakeup.clear()
+                while sub.buffer:
+                    _, _, text = sub.buffer.popleft()
+                    await asyncio.wait_for(sub.ws.send_text(text), timeout=WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.disconnect(sub.ws)
+
+    async def _close_safe(self, ws: WebSocket):
+        try: await ws.close(code=1013)
+        except: pass
+
+ws_manager = ConnectionManager()
+
+async def process_database_ip(ip_address):
+    try: return await limiter.check(ip_address)
     except: return True, {}
 
+def mask_ip(raw_ip: str) -> str:
+    if ":" in raw_ip:
+        groups = raw_ip.split(":")
+        return ":".join(groups[:2]) + ":xxxx::" if len(groups) > 2 else "xxxx::"
+    parts = raw_ip.split('.')
+    return f"{parts[0]}.{parts[1]}.xxx.xxx" if len(parts) == 4 else "xxx.xxx.xxx.xxx"
+
 async def send_tele_log(type_log, data):
     if not Config.TELE_LOG_ID: return
     try:
-        raw_ip = data.get('ip', '0.0.0.0')
-        parts = raw_ip.split('.')
-        safe_ip = f"{parts[0]}.{parts[1]}.xxx.xxx" if len(parts) == 4 else "xxx.xxx.xxx.xxx"
+        safe_ip = mask_ip(data.get('ip', '0.0.0.0'))
         msg = f"<b>🔔 {type_log}</b>\nIP: {safe_ip}\nLink: {data.get('url')}\nMode: {data.get('type')}\nSpeed: {data.get('time')}s"
         await bot.send_message(Config.TELE_LOG_ID, msg, disable_web_page_preview=True)
     except: pass
@@ -122,96 +198,94 @@ async def send_tele_log(type_log, data):
 app.state.ws_manager = ws_manager
 app.state.process_db_ip = process_database_ip
 app.state.send_tele_log = send_tele_log
-app.state.semaphore = asyncio.Semaphore(10)
 app.include_router(ytdl.router, prefix="/api/v1/ytdl", tags=["Youtube DL"])
 
-# --- BACKGROUND ---
-async def background_tasks():
-    while True:
-        try:
-            now = time.time()
-            for f in os.listdir(TMP_DIR):
-                path = os.path.join(TMP_DIR, f)
-                if not os.path.isfile(path): continue
-                if now - os.path.getmtime(path) > EXPIRE_SECONDS: os.remove(path)
-        except: pass
-        await asyncio.sleep(600)
-
 async def start_telegram_bot():
     if not Config.TELE_TOKEN or "GANTI" in Config.TELE_TOKEN: return
     try: await dp.start_polling(bot)
     except: pass
 
-@app.on_event("startup")
-async def startup_event():
-    if not dp.sub_routers: dp.include_router(bot_router)
-    asyncio.create_task(background_tasks())
+def start_singletons():
+    # Hanya boleh 1 instance per server (multi-worker: dijalankan worker primary saja)
+    asyncio.create_task(storage.run()) # Retensi TMP_DIR/RAW_DIR (LRU + watermark disk)
+    hot_tier.start() # Owner HOT_DIR (tmpfs bersama semua worker)
+    limiter.start()
     asyncio.create_task(asyncio.to_thread(tunnel.run_tunnel))
     try: start_proxy_scheduler()
     except: pass
     try: start_bot_scheduler()
     except: pass
     asyncio.create_task(start_telegram_bot())
+
+@app.on_event("startup")
+async def startup_event():
+    if not dp.sub_routers: dp.include_router(bot_router)
+    shared_state.start()
+    shared_state.on("ws", ws_manager.deliver) # Progress dari job yang jalan di worker lain
+    job_manager.start(ws_manager)
+    start_proxy_follower()
+    asyncio.create_task(shared_state.run_primary(start_singletons))
     log.info("✅ SYSTEM ONLINE (V9.1 FIXED)")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_http_pool()
+    if not shared_state.is_primary(): return # File state lokal hanya ditulis primary
+    await limiter.flush()
+    await asyncio.to_thread(proxy_pool.flush)
+    scraper_stats.maybe_save(force=True)
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     error_id = save_detailed_error({"url": str(request.url), "method": request.method}, exc)
     return JSONResponse(status_code=500, content={"status": False, "msg": "Internal Error", "error_id": error_id})
 
 # --- CDN ---
-def file_iterator(path, start, end, chunk_size=1024*512):
-    with open(path, "rb") as f:
-        f.seek(start)
-        remaining = end - start + 1
-        while remaining > 0:
-            chunk = f.read(min(chunk_size, remaining))
-            if not chunk: break
-            remaining -= len(chunk)
-            yield chunk
-
-@app.get("/cdn/ytdl/{filename}")
+@app.api_route("/cdn/ytdl/{filename}", methods=["GET", "HEAD"])
 async def cdn_stream(filename: str, request: Request):
     if ".." in filename or filename.startswith("/") or "\\" in filename: raise HTTPException(400, "Invalid")
     path = os.path.join(TMP_DIR, filename)
-    if not os.path.exists(path): raise HTTPException(404, "Not Found")
-    
-    size = os.path.getsize(path)
-    range_header = request.headers.get("range")
-    ctype, _ = mimetypes.guess_type(path)
-    if not ctype: ctype = "application/octet-stream"
-    headers = {"Accept-Ranges": "bytes", "Content-Type": ctype}
-    
-    if request.query_params.get("download") == "1":
-        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
-    
-    if range_header:
-        try:
-            start, end = range_header.replace("bytes=", "").split("-")
-            start = int(start); end = int(end) if end else size - 1
-            headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
-            return StreamingResponse(file_iterator(path, start, end), status_code=206, headers=headers, media_type=ctype)
-        except: pass
-    headers["Content-Length"] = str(size)
-    return StreamingResponse(file_iterator(path, 0, size - 1), headers=headers, media_type=ctype)
+    live_file = live.get(filename)
+    if live_file:
+        # Masih ditulis engine -> tail sampai selesai (tanpa Content-Length / Range)
+        ctype, _ = mimetypes.guess_type(path)
+        headers = {"Accept-Ranges": "none", "Cache-Control": "no-store"}
+        if request.query_params.get("download") == "1":
+            headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return StreamingResponse(live.tail(live_file), headers=headers, media_type=ctype or "application/octet-stream")
+    if not os.path.exists(path):
+        # Nama sementara (stream_url live) sudah di-rename ke nama content-addressed
+        final = naming.resolve_alias(filename)
+        if not final: raise HTTPException(404, "Not Found")
+        target = f"/cdn/ytdl/{quote(final)}" + (f"?{request.url.query}" if request.url.query else "")
+        return RedirectResponse(target, status_code=308)
+    storage.touch(filename)
+    return cdn.file_response(path, filename, request.headers, request.query_params.get("download") == "1")
 
 @app.get("/")
 async def root(): 
     record_traffic("view")
     return {"status": "online", "version": "v9.1"}
 
-# --- WEBSOCKET ENDPOINT (YANG TADI ERROR) ---
+# --- WEBSOCKET ENDPOINT ---
+# /ws/progress?job=<job_id> -> hanya progress job tsb. Tanpa param -> semua (legacy).
+# Client juga bisa kirim {"subscribe": "<job_id>"} / {"unsubscribe": "<job_id>"}.
 @app.websocket("/ws/progress")
 async def websocket_endpoint(websocket: WebSocket):
-    await ws_manager.connect(websocket)
+    if not await ws_manager.connect(websocket, websocket.query_params.get("job")): return
     try:
-        # PERBAIKAN: Loop dipisahkan dari try line
         while True:
-            await websocket.receive_text()
+            text = await websocket.receive_text()
+            try: cmd = json.loads(text)
+            except: continue
+            if not isinstance(cmd, dict): continue
+            if cmd.get("subscribe"): ws_manager.subscribe(websocket, str(cmd["subscribe"]))
+            if cmd.get("unsubscribe"): ws_manager.unsubscribe(websocket, str(cmd["unsubscribe"]))
     except WebSocketDisconnect:
         ws_manager.disconnect(websocket)
     except Exception:
         ws_manager.disconnect(websocket)
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=Config.PORT, workers=1, log_level="info")
+    # WORKERS > 1 (env / Config.WORKERS) -> state bersama lewat shared_state (SQLite WAL)
+    uvicorn.run("main:app", host="0.0.0.0", port=Config.PORT, workers=shared_state.WORKERS, log_level="info")
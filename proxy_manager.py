@@ -1,4 +1,5 @@
-import requests
+import asyncio
+import aiohttp
 import logging
 import time
 import random
@@ -6,14 +7,22 @@ import re
 import json
 import os
 import threading
-import concurrent.futures
 from typing import Set, List, Optional
+from urllib.parse import urlparse
 from config import Config
+import shared_state
 
 # Setup Logger
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 log = logging.getLogger("proxy_manager")
 
+VALIDATE_URL = "https://www.google.com"
+VALIDATE_TIMEOUT = 6
+VALIDATE_CONCURRENCY = 200
+LOW_WATERMARK = 25       # pool sehat di bawah ini -> refill otomatis
+REFILL_COOLDOWN = 120    # jeda minimum antar refill otomatis
+FOLLOW_INTERVAL = 60     # multi-worker: worker non-primary ambil proxy baru dari file primary (susulan event bus)
+
 PROXY_SOURCES = [
     "https://api.nekolabs.web.id/tls/free-proxy",
     "https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=5000&country=all&ssl=yes&anonymity=elite"
@@ -26,7 +35,7 @@ def _load_json_set(filename: str) -> Set[str]:
         with open(filename, "r") as f: return set(json.load(f))
     except: return set()
 
-def _save_json_set(filename: str, data: Set[str]):
+def _save_json_set(filename: str, data):
     try:
         with open(filename, "w") as f: json.dump(list(data), f, indent=2)
     except: pass
@@ -42,106 +51,468 @@ def _save_score(score: dict):
         with open(Config.SCORE_FILE, "w") as f: json.dump(score, f, indent=2)
     except: pass
 
-# --- CORE LOGIC ---
-def ban_proxy(proxy: str):
-    if not proxy: return
-    try:
-        banned = _load_json_set(Config.BANNED_FILE)
+# --- PROXY POOL (IN-MEMORY) ---
+FLUSH_INTERVAL = 30          # detik
+FLUSH_EVERY = 100            # atau setelah N update
+COMPACT_INTERVAL = 60 * 60
+BAN_TTL = 60 * 60 * 24 * 7   # proxy banned dilupakan setelah 7 hari (boleh divalidasi ulang)
+DEAD_TTL = 60 * 60 * 24 * 3  # proxy aktif tanpa sukses 3 hari & score rendah dibuang
+BAN_THRESHOLD = 0.2
+
+# --- SELECTION (Weighted Sampling) ---
+EXPLORE_FRACTION = 0.2       # porsi batch untuk proxy baru (belum cukup data)
+EXPLORE_MIN_SAMPLES = 3
+EWMA_ALPHA = 0.3
+REF_RTT = 1.5                # detik, RTT "normal"
+REF_THROUGHPUT = 512 * 1024  # byte/detik, throughput "normal"
+
+# --- TARGET FAMILIES (Health per backend) ---
+# Proxy yang lolos google.com belum tentu tembus ke savetube / y2mate / googlevideo,
+# jadi score, fail streak & latency juga dicatat per (proxy, family).
+TARGET_FAMILIES = {
+    "savetube": ("savetube.me",),
+    "y2mate": ("etacloud.org", "y2mate.nu"),
+    "ytdown": ("ytdown.io",),
+    "optiklink": ("optikl.ink",),
+    "ytdlp_online": ("ytdlp.online",),
+    "googlevideo": ("googlevideo.com", "youtube.com", "ytimg.com"),
+}
+TARGET_FAIL_STREAK = 3       # gagal beruntun di 1 target -> hampir tidak dipilih untuk target tsb
+TARGET_GLOBAL_PENALTY = 0.85 # gagal di 1 target hanya sedikit menurunkan score global
+
+def target_family(url: str) -> Optional[str]:
+    try: host = (urlparse(url).hostname or "").lower()
+    except: return None
+    for family, domains in TARGET_FAMILIES.items():
+        if any(host == d or host.endswith("." + d) for d in domains): return family
+    return None
+
+class _WeightTree:
+    """Fenwick tree untuk sampling berbobot: update & pick O(log n)."""
+    def __init__(self, capacity: int = 64):
+        self.n = capacity
+        self.tree = [0.0] * (capacity + 1)
+        self.weights = [0.0] * capacity
+        self.total = 0.0
+
+    def _rebuild(self):
+        self.tree = [0.0] * (self.n + 1)
+        for i, w in enumerate(self.weights):
+            j = i + 1
+            self.tree[j] += w
+            k = j + (j & -j)
+            if k <= self.n: self.tree[k] += self.tree[j]
+        self.total = sum(self.weights)
+
+    def grow(self, capacity: int):
+        self.weights.extend([0.0] * (capacity - self.n))
+        self.n = capacity
+        self._rebuild()
+
+    def set(self, i: int, w: float):
+        delta = w - self.weights[i]
+        if not delta: return
+        self.weights[i] = w
+        self.total += delta
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, r: float) -> int:
+        """Index dengan prefix-sum pertama yang melewati r."""
+        pos, bit = 0, 1 << (self.n.bit_length() - 1)
+        while bit:
+            nxt = pos + bit
+            if nxt <= self.n and self.tree[nxt] <= r:
+                pos = nxt
+                r -= self.tree[nxt]
+            bit >>= 1
+        return min(pos, self.n - 1)
+
+class ProxyPool:
+    """
+    State proxy (active / banned / score) di memory, satu untuk seluruh proses.
+    Update score O(1) tanpa I/O; disk di-flush oleh thread scheduler
+    (per FLUSH_INTERVAL atau setelah FLUSH_EVERY update).
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.active = set()
+        self.banned = {}      # proxy -> waktu ban
+        self.score = {}       # proxy -> float
+        self.last_ok = {}     # proxy -> waktu sukses terakhir
+        self.perf = {}        # proxy -> {"rtt", "thr", "n"} (EWMA, tidak dipersist)
+        self.target = {}      # proxy -> {family: {"score", "fails", "rtt"}}
+        self.trees = {None: _WeightTree()} # None = global, family -> tree khusus target
+        self.slot = {}        # proxy -> index di tree
+        self.slot_proxy = []  # index -> proxy
+        self.free_slots = []
+        self.fresh = []       # proxy yang belum cukup sampel (untuk eksplorasi)
+        self.fresh_pos = {}
+        self.dirty = 0
+        self.last_flush = time.time()
+        self.last_compact = time.time()
+        self.loaded = False
+        self.refill_needed = threading.Event()
+
+    def load(self):
+        now = time.time()
         active = _load_json_set(Config.PROXY_FILE)
+        banned = _load_json_set(Config.BANNED_FILE)
         score = _load_score()
-        
-        banned.add(proxy)
-        active.discard(proxy)
-        score.pop(proxy, None)
-        
-        _save_json_set(Config.BANNED_FILE, banned)
+        with self.lock:
+            self.active = active - banned
+            self.banned = {p: now for p in banned}
+            self.score = {p: float(v) for p, v in score.items() if p in self.active}
+            self.last_ok = {p: now for p in self.active}
+            self.perf, self.target = {}, {}
+            self.trees = {None: _WeightTree(max(64, 1 << (len(self.active) * 2 - 1).bit_length()))}
+            self.slot, self.slot_proxy, self.free_slots = {}, [], []
+            self.fresh, self.fresh_pos = [], {}
+            for p in self.active: self._index(p)
+            self.loaded = True
+
+    @property
+    def tree(self) -> _WeightTree:
+        return self.trees[None]
+
+    # --- INDEX (tree + daftar fresh) ---
+    def _weight(self, proxy: str, family: str = None) -> float:
+        w = self.score.get(proxy, 1.0)
+        perf = self.perf.get(proxy)
+        if perf:
+            if perf["rtt"] is not None: w *= REF_RTT / (REF_RTT + perf["rtt"]) * 2
+            if perf["thr"] is not None: w *= min(max(perf["thr"] / REF_THROUGHPUT, 0.25), 2.0)
+        if family:
+            t = self.target.get(proxy, {}).get(family)
+            if t:
+                w *= t["score"]
+                if t["fails"] >= TARGET_FAIL_STREAK: w *= 0.02
+                if t["rtt"] is not None and perf and perf["rtt"]:
+                    # Ganti faktor RTT global dengan RTT yang terukur ke target ini
+                    w *= (REF_RTT + perf["rtt"]) / (REF_RTT + t["rtt"])
+        return w
+
+    def _family_tree(self, family: str) -> _WeightTree:
+        tree = self.trees.get(family)
+        if tree is None:
+            tree = _WeightTree(self.tree.n)
+            tree.weights = [self._weight(p, family) if p else 0.0 for p in self.slot_proxy] + [0.0] * (tree.n - len(self.slot_proxy))
+            tree._rebuild()
+            self.trees[family] = tree
+        return tree
+
+    def _reweight(self, proxy: str):
+        i = self.slot[proxy]
+        for family, tree in self.trees.items(): tree.set(i, self._weight(proxy, family))
+
+    def _index(self, proxy: str):
+        if self.free_slots:
+            i = self.free_slots.pop()
+            self.slot_proxy[i] = proxy
+        else:
+            i = len(self.slot_proxy)
+            self.slot_proxy.append(proxy)
+            if i >= self.tree.n:
+                new_n = self.tree.n * 2 # Hitung sekali: self.tree ikut tumbuh di dalam loop
+                for tree in self.trees.values(): tree.grow(new_n)
+        self.slot[proxy] = i
+        self._reweight(proxy)
+        self.fresh_pos[proxy] = len(self.fresh)
+        self.fresh.append(proxy)
+
+    def _unindex(self, proxy: str):
+        i = self.slot.pop(proxy, None)
+        if i is not None:
+            for tree in self.trees.values(): tree.set(i, 0.0)
+            self.slot_proxy[i] = None
+            self.free_slots.append(i)
+        self._unfresh(proxy)
+        self.perf.pop(proxy, None)
+        self.target.pop(proxy, None)
+
+    def _unfresh(self, proxy: str):
+        pos = self.fresh_pos.pop(proxy, None)
+        if pos is None: return
+        last = self.fresh.pop()
+        if last != proxy:
+            self.fresh[pos] = last
+            self.fresh_pos[last] = pos
+
+    def _ensure_loaded(self):
+        if not self.loaded: self.load()
+
+    # --- MUTATION (O(1), tanpa I/O) ---
+    def add(self, proxy: str, rtt: float = None, share: bool = True):
+        # Multi-worker: hasil refill primary diumumkan supaya worker lain langsung ikut memakai
+        if share: shared_state.publish("proxy", {"add": [proxy, rtt]})
+        with self.lock:
+            self._ensure_loaded()
+            if proxy in self.banned or proxy in self.active: return False
+            self.active.add(proxy)
+            self.score.setdefault(proxy, 1.0)
+            self.last_ok[proxy] = time.time()
+            if rtt is not None: self.perf[proxy] = {"rtt": rtt, "thr": None, "n": 0}
+            self._index(proxy)
+            self.dirty += 1
+            return True
+
+    def report(self, proxy: str, success: bool, latency: float = None, throughput: float = None, target: str = None, share: bool = True):
+        """
+        Algoritma Scoring & Auto-Ban (+ EWMA latency/throughput untuk bobot seleksi).
+        Jika `target` (family) diisi, gagal hanya dihukum penuh di target tsb.
+        Multi-worker: tiap report dikirim lewat bus dan diterapkan di semua worker (primary yang flush).
+        """
+        if share: shared_state.publish("proxy", {"report": [proxy, success, latency, throughput, target]})
+        with self.lock:
+            self._ensure_loaded()
+            if proxy not in self.active: return
+            current = self.score.get(proxy, 1.0)
+            if success:
+                self.score[proxy] = min(current + 0.5, 10.0) # Max 10
+                self.last_ok[proxy] = time.time()
+            else:
+                self.score[proxy] = current * (TARGET_GLOBAL_PENALTY if target else 0.5) # Hukuman eksponensial
+            self.dirty += 1
+            if self.score[proxy] < BAN_THRESHOLD:
+                self.ban(proxy, share=share) # Worker lain sampai ke ban yang sama dari report yang sama
+                return
+
+            perf = self.perf.setdefault(proxy, {"rtt": None, "thr": None, "n": 0})
+            if latency is not None:
+                perf["rtt"] = latency if perf["rtt"] is None else perf["rtt"] + EWMA_ALPHA * (latency - perf["rtt"])
+            if throughput is not None:
+                perf["thr"] = throughput if perf["thr"] is None else perf["thr"] + EWMA_ALPHA * (throughput - perf["thr"])
+            perf["n"] += 1
+            if perf["n"] >= EXPLORE_MIN_SAMPLES: self._unfresh(proxy)
+
+            if target:
+                t = self.target.setdefault(proxy, {}).setdefault(target, {"score": 1.0, "fails": 0, "rtt": None})
+                if success:
+                    t["score"] = min(t["score"] + 0.5, 10.0)
+                    t["fails"] = 0
+                    if latency is not None:
+                        t["rtt"] = latency if t["rtt"] is None else t["rtt"] + EWMA_ALPHA * (latency - t["rtt"])
+                else:
+                    t["score"] = max(t["score"] * 0.5, 0.01)
+                    t["fails"] += 1
+            self._reweight(proxy)
+
+    def target_health(self, proxy: str) -> dict:
+        with self.lock: return {f: dict(t) for f, t in self.target.get(proxy, {}).items()}
+
+    def ban(self, proxy: str, share: bool = True):
+        with self.lock:
+            self._ensure_loaded()
+            self.banned[proxy] = time.time()
+            if proxy in self.active: self._unindex(proxy)
+            self.active.discard(proxy)
+            self.score.pop(proxy, None)
+            self.last_ok.pop(proxy, None)
+            self.dirty += 1
+            if len(self.active) < LOW_WATERMARK: self.refill_needed.set()
+        if share: shared_state.publish("proxy", {"ban": proxy}) # Worker lain ikut berhenti memakai
+        log.warning(f"🚫 BANNED: {proxy}")
+
+    # --- READ ---
+    def snapshot_active(self) -> List[str]:
+        with self.lock:
+            self._ensure_loaded()
+            return list(self.active)
+
+    def sample(self, count: int, target: str = None) -> List[str]:
+        """
+        Weighted sampling tanpa pengembalian, O(k log n).
+        `target` = family backend -> pakai bobot kesehatan proxy untuk target tsb.
+        Sebagian kecil batch (EXPLORE_FRACTION) diambil acak dari proxy baru
+        supaya proxy yang belum punya data tetap dapat kesempatan diukur.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            count = min(count, len(self.active))
+            if count <= 0: return []
+            tree = self._family_tree(target) if target else self.tree
+
+            picked = []
+            if self.fresh:
+                # Ekspektasi jumlah eksplorasi = count * EXPLORE_FRACTION (juga untuk count kecil)
+                quota = count * EXPLORE_FRACTION
+                n_explore = int(quota) + (1 if random.random() < quota - int(quota) else 0)
+                if n_explore: picked = random.sample(self.fresh, min(len(self.fresh), n_explore))
+
+            taken, misses = [], 0
+            for p in picked:
+                i = self.slot[p]
+                taken.append((i, tree.weights[i]))
+                tree.set(i, 0.0)
+            try:
+                while len(picked) < count and tree.total > 1e-9:
+                    i = tree.find(random.random() * tree.total)
+                    w = tree.weights[i]
+                    if w <= 0: # sisa float drift
+                        misses += 1
+                        if misses > 3: break
+                        tree._rebuild()
+                        continue
+                    picked.append(self.slot_proxy[i])
+                    taken.append((i, w))
+                    tree.set(i, 0.0)
+            finally:
+                for i, w in taken: tree.set(i, w)
+            return picked
+
+    def sync_from_file(self):
+        """Tambah proxy / ban dari file primary yang belum dikenal (event bus terlewat). Tidak menimpa state lokal."""
+        active = _load_json_set(Config.PROXY_FILE)
+        banned = _load_json_set(Config.BANNED_FILE)
+        for p in banned - set(self.banned_set()): self.ban(p, share=False)
+        for p in active - banned: self.add(p, share=False)
+
+    def banned_set(self) -> Set[str]:
+        with self.lock:
+            self._ensure_loaded()
+            return set(self.banned)
+
+    # --- PERSISTENCE ---
+    def needs_flush(self) -> bool:
+        return self.dirty >= FLUSH_EVERY or (self.dirty and time.time() - self.last_flush >= FLUSH_INTERVAL)
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty: return
+            active, banned, score = list(self.active), list(self.banned), dict(self.score)
+            self.dirty = 0
+            self.last_flush = time.time()
+        # Tulis di luar lock supaya report() dari event loop tidak ikut menunggu disk
         _save_json_set(Config.PROXY_FILE, active)
+        _save_json_set(Config.BANNED_FILE, banned)
         _save_score(score)
-        log.warning(f"🚫 BANNED: {proxy}")
+
+    def compact(self):
+        now = time.time()
+        with self.lock:
+            expired = [p for p, ts in self.banned.items() if now - ts > BAN_TTL]
+            for p in expired: self.banned.pop(p, None)
+            dead = [p for p in self.active if now - self.last_ok.get(p, now) > DEAD_TTL and self.score.get(p, 1.0) < 1.0]
+            for p in dead:
+                self._unindex(p)
+                self.active.discard(p); self.score.pop(p, None); self.last_ok.pop(p, None)
+            orphans = [p for p in self.score if p not in self.active]
+            for p in orphans: self.score.pop(p, None)
+            if expired or dead or orphans: self.dirty += 1
+            self.last_compact = now
+        if expired or dead or orphans:
+            log.info(f"🧹 Proxy Pool Compacted: -{len(dead)} dead, -{len(expired)} old bans, -{len(orphans)} orphan scores")
+
+    def maintain(self):
+        """Dipanggil berkala oleh thread scheduler."""
+        if time.time() - self.last_compact >= COMPACT_INTERVAL: self.compact()
+        if self.needs_flush(): self.flush()
+
+pool = ProxyPool()
+
+def ban_proxy(proxy: str):
+    if not proxy: return
+    try: pool.ban(proxy)
     except: pass
 
-def _validate_proxy(proxy: str) -> Optional[str]:
+def _on_shared(event: dict):
+    if event.get("ban"): pool.ban(event["ban"], share=False)
+    elif event.get("report"): pool.report(*event["report"], share=False)
+    elif event.get("add"): pool.add(*event["add"], share=False)
+
+shared_state.on("proxy", _on_shared)
+
+# --- REFILL (ASYNC VALIDATOR) ---
+async def _fetch_sources(session) -> Set[str]:
+    raw = set()
+    async def _one(url):
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as r:
+                if r.status != 200: return
+                if "nekolabs" in url:
+                    data = (await r.json(content_type=None)).get("result", [])
+                    for p in data:
+                        if p.get("https") == "yes": raw.add(f"http://{p['ip']}:{p['port']}")
+                else:
+                    for line in (await r.text()).splitlines():
+                        if re.match(r"^(\d{1,3}\.){3}\d{1,3}:\d+$", line.strip()):
+                            raw.add(f"http://{line.strip()}")
+        except: pass
+    await asyncio.gather(*(_one(u) for u in PROXY_SOURCES))
+    return raw
+
+async def _validate_proxy(session, proxy: str) -> Optional[float]:
+    """Return RTT (detik) jika proxy lolos, else None."""
     try:
-        resp = requests.get("https://www.google.com", proxies={"http": proxy, "https": proxy}, timeout=5)
-        if resp.status_code == 200: return proxy
+        t0 = time.monotonic()
+        async with session.get(VALIDATE_URL, proxy=proxy, timeout=aiohttp.ClientTimeout(total=VALIDATE_TIMEOUT)) as resp:
+            if resp.status == 200: return time.monotonic() - t0
     except: pass
     return None
 
-def fetch_and_update():
-    """Mengambil proxy baru dari API"""
+async def refill_async() -> int:
+    """
+    Ambil kandidat dari semua source secara paralel lalu validasi dengan concurrency tinggi.
+    Proxy yang lolos langsung masuk ke pool (beserta RTT) tanpa menunggu kandidat lain.
+    """
     log.info("🔄 Updating Proxy List...")
-    banned = _load_json_set(Config.BANNED_FILE)
-    raw = set()
-    
-    for url in PROXY_SOURCES:
-        try:
-            r = requests.get(url, timeout=10)
-            if r.status_code != 200: continue
-            
-            if "nekolabs" in url:
-                data = r.json().get("result", [])
-                for p in data:
-                    if p.get("https") == "yes": raw.add(f"http://{p['ip']}:{p['port']}")
-            else:
-                for line in r.text.splitlines():
-                    if re.match(r"^(\d{1,3}\.){3}\d{1,3}:\d+$", line.strip()):
-                        raw.add(f"http://{line.strip()}")
-        except: continue
-        
-    candidates = list(raw - banned)
-    if not candidates:
-        log.info("⚠️ No new candidates found.")
-        return
-
-    log.info(f"⚡ Validating {len(candidates)} candidates...")
-    valid = set()
-    
-    # Validation
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as ex:
-        futures = [ex.submit(_validate_proxy, p) for p in candidates]
-        for f in concurrent.futures.as_completed(futures):
-            if f.result(): valid.add(f.result())
-            
-    if valid:
-        current_active = _load_json_set(Config.PROXY_FILE)
-        current_active.update(valid)
-        _save_json_set(Config.PROXY_FILE, current_active)
-        
-        score = _load_score()
-        for p in valid:
-            if p not in score: score[p] = 1.0
-        _save_score(score)
-        log.info(f"✅ Update Complete: {len(current_active)} proxies total")
+    connector = aiohttp.TCPConnector(limit=VALIDATE_CONCURRENCY, ssl=False, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        raw = await _fetch_sources(session)
+        candidates = list(raw - pool.banned_set() - set(pool.snapshot_active()))
+        if not candidates:
+            log.info("⚠️ No new candidates found.")
+            return 0
+
+        log.info(f"⚡ Validating {len(candidates)} candidates...")
+        sem = asyncio.Semaphore(VALIDATE_CONCURRENCY)
+        added = 0
+
+        async def _check(proxy):
+            nonlocal added
+            async with sem:
+                rtt = await _validate_proxy(session, proxy)
+            if rtt is not None and pool.add(proxy, rtt): added += 1
+
+        await asyncio.gather(*(_check(p) for p in candidates))
+
+    if added:
+        pool.flush()
+        log.info(f"✅ Update Complete: +{added} new, {len(pool.active)} proxies total")
     else:
         log.warning("⚠️ No valid proxies found in this update.")
+    return added
 
-# --- BATCH RETRIEVAL ---
-def get_batch_proxies(count=22) -> List[str]:
-    proxies = list(_load_json_set(Config.PROXY_FILE))
-    if len(proxies) < 2: return [] 
-    
+_refill_lock = threading.Lock()
+_last_refill = 0.0
+
+def fetch_and_update():
+    """Mengambil proxy baru dari API (dipanggil dari thread scheduler, bukan event loop utama)"""
+    global _last_refill
+    if not _refill_lock.acquire(blocking=False): return
     try:
-        random.shuffle(proxies)
-        return proxies[:count]
-    except: return proxies[:count]
+        _last_refill = time.time()
+        pool.refill_needed.clear()
+        asyncio.run(refill_async())
+    except Exception as e:
+        log.error(f"Proxy Refill Error: {e}")
+    finally:
+        _refill_lock.release()
 
-# --- SCORING SYSTEM (INI YANG HILANG TADI) ---
-def report_proxy_status(proxy: str, success: bool):
-    """Algoritma Scoring & Auto-Ban"""
+# --- BATCH RETRIEVAL ---
+def get_batch_proxies(count=22, target: str = None) -> List[str]:
+    """Batch proxy, dipilih berbobot (score x latency x throughput [x health target]) + eksplorasi."""
     try:
-        score = _load_score()
-        current = score.get(proxy, 1.0)
-        
-        if success:
-            new_score = min(current + 0.5, 10.0) # Max 10
-        else:
-            new_score = current * 0.5 # Hukuman eksponensial
-        
-        score[proxy] = new_score
-        _save_score(score)
-        
-        if new_score < 0.2:
-            ban_proxy(proxy)
+        proxies = pool.sample(count, target)
+        return proxies if len(pool.active) >= 2 else []
+    except: return []
+
+# --- SCORING SYSTEM ---
+def report_proxy_status(proxy: str, success: bool, latency: float = None, throughput: float = None, target: str = None):
+    if not proxy: return
+    try: pool.report(proxy, success, latency, throughput, target)
     except: pass
 
 # --- SCHEDULER ---
@@ -152,15 +523,45 @@ def start_scheduler():
     schedule.every(Config.PROXY_UPDATE_INTERVAL).seconds.do(fetch_and_update)
     
     def loop():
-        # Cek awal di dalam thread agar tidak blocking main process
-        if not os.path.exists(Config.PROXY_FILE) or os.path.getsize(Config.PROXY_FILE) < 5:
+        # Cek awal di dalam thread agar tidak blocking main process.
+        # Pool bisa sudah di-load lazy oleh request (ban/score) -> jangan ditimpa.
+        with pool.lock: pool._ensure_loaded()
+        if len(pool.active) < LOW_WATERMARK:
             log.info("⚡ Initial Proxy Fetch (Background)...")
             fetch_and_update()
             
         while True:
             schedule.run_pending()
-            time.sleep(1)
+            try: pool.maintain()
+            except Exception as e: log.error(f"Proxy Pool Maintain Error: {e}")
+            # Pool turun di bawah watermark (karena ban) -> refill tanpa menunggu jadwal
+            if pool.refill_needed.wait(1):
+                if time.time() - _last_refill >= REFILL_COOLDOWN:
+                    log.info(f"⚡ Proxy Pool Low ({len(pool.active)} < {LOW_WATERMARK}), Refilling...")
+                    fetch_and_update()
+                else: time.sleep(1)
             
     t = threading.Thread(target=loop, daemon=True)
     t.start()
     log.info("⏰ Proxy Scheduler Active (Background)")
+
+def start_follower():
+    """
+    Multi-worker: hanya primary yang refill/flush. Worker lain menerima add/report/ban lewat bus;
+    di sini hanya susulan proxy baru dari file primary (tanpa reload, perf/target lokal tetap).
+    """
+    if not shared_state.ENABLED: return
+
+    def loop():
+        last = None
+        while True:
+            time.sleep(FOLLOW_INTERVAL)
+            if shared_state.is_primary(): continue
+            try:
+                mtime = os.path.getmtime(Config.PROXY_FILE)
+                if last is not None and mtime != last: pool.sync_from_file()
+                last = mtime
+            except OSError: pass
+            except Exception as e: log.error(f"Proxy Follower Error: {e}")
+
+    threading.Thread(target=loop, daemon=True).start()
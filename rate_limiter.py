@@ -0,0 +1,183 @@
+import os, json, time, asyncio, ipaddress
+from config import Config
+from logger import log
+import shared_state
+
+# --- IN-MEMORY RATE LIMITER (Sliding Window Counter) ---
+# Tiap client punya 2 window (menit & hari). Estimasi sliding window:
+#   prev_count * (sisa porsi window sebelumnya) + cur_count
+# Semua operasi O(1), disk hanya disentuh oleh snapshot loop di background.
+# Multi-worker (shared_state.ENABLED): state client di tabel SQLite, dicek+diupdate dalam satu
+# transaksi supaya limit berlaku global, bukan per worker.
+
+SNAPSHOT_INTERVAL = 30
+IDLE_EXPIRE = 60 * 60 * 48 # Entry tanpa aktivitas 2 hari dibuang
+IPV6_PREFIX = 64
+
+MINUTE = 60
+DAY = 86400
+
+class _Window:
+    __slots__ = ("size", "start", "cur", "prev")
+
+    def __init__(self, size: int, now: float):
+        self.size = size
+        self.start = now - (now % size)
+        self.cur = 0
+        self.prev = 0
+
+    def _roll(self, now: float):
+        elapsed = now - self.start
+        if elapsed < self.size: return
+        # Lompat 1 window -> cur jadi prev. Lompat >1 window -> keduanya kosong
+        self.prev = self.cur if elapsed < self.size * 2 else 0
+        self.cur = 0
+        self.start = now - (now % self.size)
+
+    def count(self, now: float) -> float:
+        self._roll(now)
+        weight = 1.0 - (now - self.start) / self.size
+        return self.prev * weight + self.cur
+
+class _Client:
+    __slots__ = ("minute", "day", "total", "last_seen")
+
+    def __init__(self, now: float):
+        self.minute = _Window(MINUTE, now)
+        self.day = _Window(DAY, now)
+        self.total = 0
+        self.last_seen = now
+
+def _client_to_dict(c: _Client) -> dict:
+    return {
+        "min_ts": c.minute.start, "req_min": c.minute.cur, "prev_min": c.minute.prev,
+        "day_ts": c.day.start, "req_day": c.day.cur, "prev_day": c.day.prev,
+        "req_total": c.total, "last_seen": c.last_seen
+    }
+
+def _client_from_dict(u: dict, now: float) -> _Client:
+    c = _Client(now)
+    c.minute.start = float(u.get("min_ts", now)); c.minute.cur = int(u.get("req_min", 0)); c.minute.prev = int(u.get("prev_min", 0))
+    c.day.start = float(u.get("day_ts", now)); c.day.cur = int(u.get("req_day", 0)); c.day.prev = int(u.get("prev_day", 0))
+    c.total = int(u.get("req_total", 0))
+    c.last_seen = float(u.get("last_seen", max(c.minute.start, c.day.start)))
+    return c
+
+def client_key(ip_address: str):
+    """IPv4 apa adanya, IPv6 di-bucket per /64 (1 pelanggan = 1 prefix). None jika tidak valid."""
+    try:
+        ip = ipaddress.ip_address(ip_address.strip())
+    except ValueError:
+        return None
+    if ip.version == 6:
+        if ip.ipv4_mapped: return str(ip.ipv4_mapped)
+        return str(ipaddress.ip_network(f"{ip}/{IPV6_PREFIX}", strict=False))
+    return str(ip)
+
+class RateLimiter:
+    def __init__(self, per_min: int, per_day: int, db_file: str):
+        self.per_min = per_min
+        self.per_day = per_day
+        self.db_file = db_file
+        self.clients = {}
+        self.dirty = False
+        self._task = None
+        self._load()
+
+    async def check(self, ip_address: str):
+        key = client_key(ip_address)
+        if not key: return False, "Invalid IP"
+
+        now = time.time()
+        if shared_state.ENABLED:
+            def update(data):
+                client = _client_from_dict(data, now) if data else _Client(now)
+                result = self._consume(client, now)
+                return _client_to_dict(client), result
+            return await shared_state.rate_update(key, update)
+
+        client = self.clients.get(key)
+        if client is None:
+            client = self.clients[key] = _Client(now)
+        self.dirty = True
+        return self._consume(client, now)
+
+    def _consume(self, client: _Client, now: float):
+        client.last_seen = now
+        req_min = client.minute.count(now)
+        req_day = client.day.count(now)
+        if req_min >= self.per_min: return False, f"Limit Reached ({self.per_min}/min)"
+        if req_day >= self.per_day: return False, f"Limit Reached ({self.per_day}/day)"
+
+        client.minute.cur += 1
+        client.day.cur += 1
+        client.total += 1
+        return True, {"req_min": int(req_min) + 1, "req_day": int(req_day) + 1, "req_total": client.total}
+
+    def expire_idle(self) -> int:
+        cutoff = time.time() - IDLE_EXPIRE
+        if shared_state.ENABLED: return shared_state.rate_expire(cutoff)
+        stale = [k for k, c in self.clients.items() if c.last_seen < cutoff]
+        for k in stale: self.clients.pop(k, None)
+        if stale: self.dirty = True
+        return len(stale)
+
+    # --- PERSISTENCE ---
+    def _snapshot(self) -> dict:
+        return {k: _client_to_dict(c) for k, c in self.clients.items()}
+
+    def _write(self, data: dict):
+        tmp = self.db_file + ".tmp"
+        with open(tmp, "w") as f: json.dump(data, f, indent=None)
+        os.replace(tmp, self.db_file)
+
+    def _load(self):
+        try:
+            with open(self.db_file, "r") as f:
+                content = f.read().strip()
+                db = json.loads(content) if content else {}
+        except: return
+
+        now = time.time()
+        for raw_key, u in db.items():
+            key = client_key(raw_key) or raw_key
+            try: c = _client_from_dict(u, now)
+            except: continue
+            old = self.clients.get(key)
+            if old: c.total += old.total # Format lama: beberapa IPv6 dalam 1 /64
+            self.clients[key] = c
+        if not shared_state.ENABLED: self.expire_idle() # Multi-worker: expire di SQLite lewat snapshot_loop
+
+    async def flush(self):
+        if not self.dirty: return
+        self.dirty = False
+        try:
+            await asyncio.to_thread(self._write, self._snapshot())
+        except Exception as e:
+            self.dirty = True
+            log.error(f"Rate Limiter Snapshot Error: {e}")
+
+    async def snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            # Multi-worker: DELETE di SQLite jalan di thread shared state, bukan di loop
+            if shared_state.ENABLED: await shared_state.call(self.expire_idle)
+            else: self.expire_idle()
+            await self.flush()
+
+    def start(self):
+        if self._task: return
+        if shared_state.ENABLED:
+            # Data lama dari file JSON dipindah ke SQLite sekali (tabel masih kosong)
+            asyncio.create_task(self._migrate(self._snapshot()))
+            self.clients.clear()
+        self._task = asyncio.create_task(self.snapshot_loop())
+
+    async def _migrate(self, rows: dict):
+        try:
+            moved = await shared_state.call(shared_state.rate_import, rows)
+            if moved: log.info(f"Rate Limiter: migrated {moved} clients to shared state")
+        except Exception as e:
+            log.error(f"Rate Limiter Migrate Error: {e}")
+
+limiter = RateLimiter(Config.RATE_LIMIT_MIN, Config.RATE_LIMIT_DAY, Config.DATABASE_FILE)
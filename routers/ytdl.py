@@ -4,21 +4,30 @@ from urllib.parse import quote
 import time
 import os
 import asyncio
+import uuid
 
 from config import Config, STATUS_OK
-from engine import run_dual_engine_buffer
+from engine import run_shared, normalize_format, stages, storage, hot_tier, inflight_count
+from engine.jobs import job_manager
 from logger import log
 
 router = APIRouter()
 
-async def handle_ytdl_process(request: Request, url: str, type_req: str):
-    ws_manager = request.app.state.ws_manager
+def get_client_ip(request: Request) -> str:
+    return request.headers.get("X-Forwarded-For", request.client.host).split(",")[0].strip()
+
+async def handle_ytdl_process(request: Request, url: str, type_req: str, fmt: str = None):
+    # Client boleh kirim ?job=<id> lalu subscribe /ws/progress?job=<id> sebelum request
+    job_id = request.query_params.get("job") or uuid.uuid4().hex[:16]
+    ws_manager = request.app.state.ws_manager.channel(job_id)
     process_db_ip = request.app.state.process_db_ip
     send_tele_log = request.app.state.send_tele_log
-    semaphore = request.app.state.semaphore
+
+    try: fmt = normalize_format(type_req, fmt)
+    except ValueError as e: return JSONResponse(status_code=400, content={"status": False, "msg": str(e)})
     
-    client_ip = request.headers.get("X-Forwarded-For", request.client.host).split(",")[0].strip()
-    allowed, user_stat = process_db_ip(client_ip)
+    client_ip = get_client_ip(request)
+    allowed, user_stat = await process_db_ip(client_ip)
     
     if not allowed:
         return JSONResponse(status_code=429, content={"status": False, "msg": user_stat})
@@ -32,11 +41,17 @@ async def handle_ytdl_process(request: Request, url: str, type_req: str):
             "status": "PROCESSING", "engine": "-", "time": "0"
         }))
 
-    async with semaphore:
-        data = await run_dual_engine_buffer(url, type_req, ws_manager)
+    # Cache HIT / join job identik yang sedang jalan / job baru (slot per stage, engine/stages.py)
+    data = await run_shared(url, type_req, ws_manager, fmt, deadline=stages.ADMISSION_DEADLINE)
         
     duration = time.time() - start_time
 
+    if data.get("overloaded"):
+        # Ditolak di depan (antrian penuh / estimasi tunggu > deadline) -> client coba lagi nanti
+        await ws_manager.broadcast({"status": "error", "msg": "Server Busy"})
+        return JSONResponse(status_code=503, headers={"Retry-After": str(data["retry_after"])},
+                            content={"status": False, "msg": "Server sibuk, coba lagi nanti.", "retry_after": data["retry_after"], "details": data.get("error_detail", [])})
+
     if data["status"] != STATUS_OK:
         if send_tele_log:
             asyncio.create_task(send_tele_log("FAIL", {
@@ -52,9 +67,12 @@ async def handle_ytdl_process(request: Request, url: str, type_req: str):
             "time": f"{duration:.1f}"
         }))
     
+    await ws_manager.broadcast({"status": "complete", "msg": "Done"})
+    return {**build_result_payload(data, user_stat), "job_id": job_id}
+
+def build_result_payload(data: dict, user_stat: dict):
     filename = data["filename"]
     safe_name = quote(filename)
-    await ws_manager.broadcast({"status": "complete", "msg": "Done"})
 
     # --- URL MENGGUNAKAN PUBLIC DOMAIN (FRONTEND) ---
     return {
@@ -67,6 +85,7 @@ async def handle_ytdl_process(request: Request, url: str, type_req: str):
             "duration": data.get("duration"),
             "author": data.get("author"),
             "engine": data.get("engine"),
+            "cached": data.get("cached", False),
             "filename": filename,
             "preview_url": f"https://{Config.PUBLIC_DOMAIN}/cdn/ytdl/{safe_name}",
             "download_url": f"https://{Config.PUBLIC_DOMAIN}/cdn/ytdl/{safe_name}?download=1",
@@ -75,10 +94,13 @@ async def handle_ytdl_process(request: Request, url: str, type_req: str):
     }
 
 @router.api_route("/mp3", methods=["GET", "POST"])
-async def get_mp3(request: Request, url: str = Body(None), type: str = Body("audio")):
-    if request.method == "GET": url = request.query_params.get("url")
+async def get_mp3(request: Request, url: str = Body(None), type: str = Body("audio"), format: str = Body(None)):
+    # format: mp3 (default) / m4a / opus
+    if request.method == "GET":
+        url = request.query_params.get("url")
+        format = request.query_params.get("format")
     if not url: return JSONResponse(status_code=400, content={"status": False, "msg": "URL is required"})
-    return await handle_ytdl_process(request, url, "audio")
+    return await handle_ytdl_process(request, url, "audio", format)
 
 @router.api_route("/mp4", methods=["GET", "POST"])
 async def get_mp4(request: Request, url: str = Body(None), type: str = Body("video")):
@@ -90,3 +112,57 @@ async def get_mp4(request: Request, url: str = Body(None), type: str = Body("vid
 async def process_legacy(request: Request, url: str = Body(..., embed=True), type: str = Body("video", embed=True)):
     real_type = "audio" if type == "mp3" else "video"
     return await handle_ytdl_process(request, url, real_type)
+
+# --- ASYNC JOB API (Submit -> Poll -> Result) ---
+JOB_ADMISSION_DEADLINE = 900 # Client polling, boleh menunggu lebih lama dari request sinkron
+
+@router.post("/jobs")
+async def submit_job(request: Request, url: str = Body(..., embed=True), type: str = Body("video", embed=True), format: str = Body(None, embed=True)):
+    real_type = "audio" if type in ("audio", "mp3") else "video"
+    try: fmt = normalize_format(real_type, format)
+    except ValueError as e: return JSONResponse(status_code=400, content={"status": False, "msg": str(e)})
+    client_ip = get_client_ip(request)
+    allowed, user_stat = await request.app.state.process_db_ip(client_ip)
+    if not allowed:
+        return JSONResponse(status_code=429, content={"status": False, "msg": user_stat})
+
+    ok, wait, retry_after = stages.admit(JOB_ADMISSION_DEADLINE, extra_wait=job_manager.estimated_wait())
+    job = job_manager.submit(url, real_type, client_ip, fmt) if ok else None
+    if not job:
+        retry_after = retry_after or 30
+        return JSONResponse(status_code=503, headers={"Retry-After": str(retry_after)}, content={"status": False, "msg": "Queue Full, coba lagi nanti.", "retry_after": retry_after})
+    job.user_stat = user_stat
+
+    send_tele_log = request.app.state.send_tele_log
+    if send_tele_log:
+        asyncio.create_task(send_tele_log("REQUEST", {
+            "ip": client_ip, "url": url, "type": real_type,
+            "status": "QUEUED", "engine": "-", "time": "0"
+        }))
+
+    base = "/api/v1/ytdl/jobs"
+    return JSONResponse(status_code=202, content={
+        "status": True, "job_id": job.id, "state": job.status,
+        "status_url": f"{base}/{job.id}", "result_url": f"{base}/{job.id}/result"
+    })
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_manager.get(job_id)
+    if not job: return JSONResponse(status_code=404, content={"status": False, "msg": "Job Not Found"})
+    return {"status": True, **job.to_dict()}
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await job_manager.get(job_id)
+    if not job: return JSONResponse(status_code=404, content={"status": False, "msg": "Job Not Found"})
+    if job.status == "failed":
+        return JSONResponse(status_code=503, content={"status": False, "msg": "Gagal memproses media.", "details": job.error_detail})
+    if job.status != "done":
+        return JSONResponse(status_code=202, headers={"Retry-After": "3"}, content={"status": False, **job.to_dict()})
+    return build_result_payload(job.result, job.user_stat)
+
+# --- PIPELINE STATS (kedalaman antrian per stage) ---
+@router.get("/stats")
+async def pipeline_stats():
+    return {"status": True, "stages": stages.snapshot(), "jobs": job_manager.snapshot(), "inflight": inflight_count(), "storage": storage.snapshot(), "hot_tier": hot_tier.snapshot()}
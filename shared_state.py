@@ -0,0 +1,255 @@
+import os, json, time, sqlite3, threading, asyncio, fcntl
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from config import Config
+from logger import log
+
+# --- SHARED STATE (multi-worker uvicorn) ---
+# WORKERS > 1 -> beberapa proses uvicorn. State yang harus global pindah ke SQLite (WAL) di CACHE_DIR:
+#   rate    : counter rate limiter per client (transaksi BEGIN IMMEDIATE = atomik antar proses)
+#   leases  : claim global (raw dir / checkpoint resume dipakai satu proses)
+#   jobs    : snapshot job supaya GET /jobs/{id} bisa dijawab worker mana pun
+#   events  : bus antar worker (progress WebSocket, update storage index, ban proxy)
+# Satu worker jadi "primary" (flock) dan menjalankan task singleton: storage manager,
+# proxy scheduler, bot Telegram, tunnel. WORKERS = 1 -> semua fungsi di sini no-op.
+# Semua akses DB jalan di satu thread khusus (call/defer); event loop tidak pernah menunggu
+# lock SQLite (busy timeout bisa sampai DB_TIMEOUT) atau _lock.
+
+WORKERS = max(1, int(os.environ.get("WORKERS") or getattr(Config, "WORKERS", 1)))
+ENABLED = WORKERS > 1
+DB_FILE = os.path.join(Config.CACHE_DIR, "shared_state.db")
+PRIMARY_LOCK = os.path.join(Config.CACHE_DIR, "primary.lock")
+
+BUS_INTERVAL = 0.2        # flush outbox + ambil event worker lain
+EVENT_TTL = 120           # event lebih tua dari ini dihapus primary
+MAINTAIN_INTERVAL = 30
+PRIMARY_RETRY = 15        # worker non-primary cek ulang lock (primary mati -> diambil alih)
+DB_TIMEOUT = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, weight INTEGER NOT NULL, pid INTEGER NOT NULL, ts REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS leases_name ON leases (name);
+CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, pid INTEGER NOT NULL, channel TEXT NOT NULL, payload TEXT NOT NULL, ts REAL NOT NULL);
+"""
+
+_lock = threading.Lock()   # Satu koneksi per proses; jangan diambil dari thread event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+_conn = None
+_conn_pid = None
+_primary_fd = None
+_outbox = []
+_handlers = {}             # channel -> [handler(payload)]
+_last_event = 0
+_pump_task = None
+
+def _db() -> sqlite3.Connection:
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _conn, _conn_pid = conn, os.getpid()
+    return _conn
+
+@contextmanager
+def transaction():
+    """Transaksi tulis (BEGIN IMMEDIATE: lock tulis diambil di awal, tidak ada upgrade deadlock)."""
+    with _lock:
+        db = _db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+async def call(fn, *args):
+    """Jalankan fungsi DB (blocking) di thread shared state, tunggu hasilnya."""
+    return await asyncio.wrap_future(_executor.submit(fn, *args))
+
+def defer(fn, *args):
+    """Fire-and-forget ke thread shared state (aman dipanggil dari loop maupun thread lain)."""
+    _executor.submit(fn, *args).add_done_callback(_log_error)
+
+def _log_error(fut):
+    if not fut.cancelled() and fut.exception(): log.error(f"Shared State Error: {fut.exception()}")
+
+def _alive(pid: int) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: pass
+    return True
+
+# --- PRIMARY ELECTION ---
+def _try_primary() -> bool:
+    global _primary_fd
+    if _primary_fd is not None: return True
+    fd = os.open(PRIMARY_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _primary_fd = fd # Dipegang sampai proses mati -> kernel melepas lock otomatis
+    return True
+
+def is_primary() -> bool:
+    return not ENABLED or _primary_fd is not None
+
+async def run_primary(start_singletons):
+    """Jalankan start_singletons() sekali di worker yang memegang lock primary."""
+    if not ENABLED:
+        start_singletons()
+        return
+    while not _try_primary():
+        await asyncio.sleep(PRIMARY_RETRY)
+    log.info(f"SHARED STATE: worker {os.getpid()} is primary")
+    start_singletons()
+    while True:
+        try: await call(_maintain)
+        except Exception as e: log.error(f"Shared State Maintain Error: {e}")
+        await asyncio.sleep(MAINTAIN_INTERVAL)
+
+def _maintain():
+    now = time.time()
+    with transaction() as db:
+        db.execute("DELETE FROM events WHERE ts < ?", (now - EVENT_TTL,))
+        # Lease milik worker yang sudah mati (crash / restart) dilepas
+        pids = [r[0] for r in db.execute("SELECT DISTINCT pid FROM leases")]
+        dead = [p for p in pids if not _alive(p)]
+        for p in dead: db.execute("DELETE FROM leases WHERE pid = ?", (p,))
+    if dead: log.warning(f"SHARED STATE: released leases of dead workers {dead}")
+
+# --- LEASES (konkurensi global) ---
+def _try_lease(name: str, weight: int, capacity: int):
+    with transaction() as db:
+        used = db.execute("SELECT COALESCE(SUM(weight), 0) FROM leases WHERE name = ?", (name,)).fetchone()[0]
+        if used + weight > capacity: return None
+        return db.execute("INSERT INTO leases (name, weight, pid, ts) VALUES (?, ?, ?, ?)",
+                          (name, weight, os.getpid(), time.time())).lastrowid
+
+async def try_lease(name: str, weight: int, capacity: int):
+    """Return lease id kalau total weight untuk name masih muat, else None."""
+    fut = _executor.submit(_try_lease, name, weight, capacity)
+    try:
+        return await asyncio.shield(asyncio.wrap_future(fut))
+    except asyncio.CancelledError:
+        # Thread tetap jalan -> lease yang terlanjur didapat harus dilepas, jangan bocor
+        fut.add_done_callback(_release_orphan)
+        raise
+
+def _release_orphan(fut):
+    if fut.cancelled() or fut.exception() or fut.result() is None: return
+    release_lease(fut.result())
+
+def _release_lease(lease_id: int):
+    with transaction() as db:
+        db.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+
+def release_lease(lease_id: int):
+    defer(_release_lease, lease_id)
+
+def lease_held(name: str) -> bool:
+    """Blocking: panggil dari thread (mis. prune resume via asyncio.to_thread), bukan dari loop."""
+    with _lock:
+        return _db().execute("SELECT 1 FROM leases WHERE name = ? LIMIT 1", (name,)).fetchone() is not None
+
+# --- KV ROWS (rate limiter) ---
+def _rate_update(key: str, update):
+    with transaction() as db:
+        row = db.execute("SELECT data FROM rate WHERE key = ?", (key,)).fetchone()
+        data, result = update(json.loads(row[0]) if row else None)
+        db.execute("INSERT OR REPLACE INTO rate (key, data) VALUES (?, ?)", (key, json.dumps(data)))
+        return result
+
+async def rate_update(key: str, update):
+    """update(data dict | None) -> (data baru, hasil). Dijalankan atomik dalam satu transaksi."""
+    return await call(_rate_update, key, update)
+
+def rate_import(rows: dict):
+    """Migrasi sekali dari file JSON lama (hanya kalau tabel masih kosong)."""
+    with transaction() as db:
+        if db.execute("SELECT 1 FROM rate LIMIT 1").fetchone(): return 0
+        db.executemany("INSERT INTO rate (key, data) VALUES (?, ?)", [(k, json.dumps(v)) for k, v in rows.items()])
+        return len(rows)
+
+def rate_expire(cutoff: float) -> int:
+    with transaction() as db:
+        return db.execute("DELETE FROM rate WHERE json_extract(data, '$.last_seen') < ?", (cutoff,)).rowcount
+
+# --- JOBS ---
+def _job_save(job_id: str, payload: str, updated: float):
+    with transaction() as db:
+        db.execute("INSERT OR REPLACE INTO jobs (id, data, updated) VALUES (?, ?, ?)", (job_id, payload, updated))
+
+def job_save(job_id: str, data: dict):
+    # Snapshot di-serialize sekarang (job masih berubah di loop), tulisnya di thread shared state
+    defer(_job_save, job_id, json.dumps(data), time.time())
+
+def _job_load(job_id: str):
+    with _lock:
+        row = _db().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+async def job_load(job_id: str):
+    return await call(_job_load, job_id)
+
+def job_expire(ttl: float) -> int:
+    with transaction() as db:
+        return db.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - ttl,)).rowcount
+
+# --- EVENT BUS ---
+def publish(channel: str, payload: dict):
+    """Kirim ke worker lain (batch per BUS_INTERVAL). Worker pengirim tidak menerima balik."""
+    if ENABLED: _outbox.append((channel, json.dumps(payload)))
+
+def on(channel: str, handler):
+    _handlers.setdefault(channel, []).append(handler)
+
+def _exchange(batch: list) -> list:
+    global _last_event
+    pid = os.getpid()
+    with transaction() as db:
+        if batch:
+            now = time.time()
+            db.executemany("INSERT INTO events (pid, channel, payload, ts) VALUES (?, ?, ?, ?)",
+                           [(pid, ch, payload, now) for ch, payload in batch])
+        rows = db.execute("SELECT id, pid, channel, payload FROM events WHERE id > ? ORDER BY id", (_last_event,)).fetchall()
+    if rows: _last_event = rows[-1][0]
+    return [(ch, payload) for _, p, ch, payload in rows if p != pid]
+
+def _bus_start():
+    global _last_event
+    with _lock:
+        _last_event = _db().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0] # Jangan replay histori
+
+async def _pump():
+    await call(_bus_start)
+    while True:
+        await asyncio.sleep(BUS_INTERVAL)
+        batch = _outbox[:]
+        del _outbox[:len(batch)]
+        try:
+            incoming = await call(_exchange, batch)
+        except Exception as e:
+            _outbox[:0] = batch # Coba lagi di putaran berikutnya
+            log.error(f"Shared State Bus Error: {e}")
+            continue
+        for channel, payload in incoming:
+            for handler in _handlers.get(channel, ()):
+                try:
+                    res = handler(json.loads(payload))
+                    if asyncio.iscoroutine(res): await res
+                except Exception as e:
+                    log.error(f"Shared State Handler Error ({channel}): {e}")
+
+def start():
+    """Dipanggil di startup tiap worker (sebelum run_primary)."""
+    global _pump_task
+    if not ENABLED or _pump_task: return
+    _pump_task = asyncio.create_task(_pump())
+    log.info(f"SHARED STATE: worker {os.getpid()} joined ({WORKERS} workers, {DB_FILE})")